@@ -0,0 +1,160 @@
+import re
+from datetime import datetime
+from typing import Iterable, List, Optional, Tuple
+from pymongo import ReplaceOne
+from pymongo.errors import BulkWriteError
+from app.db import db
+from app.shutdown import shutdown_coordinator
+
+# Materialized summary collections served by the admin dashboards
+BREACHES_PER_YEAR = "analytics_breaches_per_year"
+DATA_CLASS_STATS = "analytics_data_classes"
+BREACH_AFFECTED_USERS = "analytics_breach_users"
+
+DUPLICATE_KEY = 11000
+
+# The catalog can hold repeated inserts of the same breach, count each Name once
+UNIQUE_BREACHES = [
+    {"$group": {"_id": "$Name", "breach": {"$first": "$$ROOT"}}},
+    {"$replaceWith": "$breach"},
+]
+
+
+# Background job of a catalog sync, resumed after a shutdown
+ANALYTICS_JOB = "catalog_analytics"
+
+
+async def store_rows(collection: str, rows: List[dict], started: datetime, keys: Optional[List[str]] = None):
+    """
+    Write the rows of a refresh that started at ``started`` and drop the ones it no
+    longer produced (only among ``keys`` when given).
+
+    Refreshes can overlap, within a worker or across workers. A row is only replaced by
+    a refresh that started later than the one that wrote it, so an older refresh that
+    finishes last cannot stamp the rows with its time and have the newer one's cleanup
+    delete them; its own cleanup only removes rows older than itself.
+    """
+    if rows:
+        try:
+            await db[collection].bulk_write(
+                [
+                    ReplaceOne({"_id": row["_id"], "updated_at": {"$lt": started}}, {**row, "updated_at": started}, upsert=True)
+                    for row in rows
+                ],
+                ordered=False,
+            )
+        except BulkWriteError as e:
+            # A duplicate key is a row a later refresh has already written, it is kept
+            if any(error.get("code") != DUPLICATE_KEY for error in e.details.get("writeErrors", [])):
+                raise
+
+    stale = {"updated_at": {"$lt": started}}
+    if keys is not None:
+        stale["_id"] = {"$in": keys}
+    await db[collection].delete_many(stale)
+
+
+async def refresh_breaches_per_year(years: Optional[Iterable[str]] = None):
+    started = datetime.utcnow()
+    years = None if years is None else sorted(set(years))
+    if years == []:
+        return
+
+    pipeline = []
+    if years is not None:
+        # Only the breaches of those years are read and regrouped
+        pipeline.append({"$match": {"BreachDate": {"$regex": f"^({'|'.join(map(re.escape, years))})"}}})
+    pipeline += UNIQUE_BREACHES + [
+        {"$match": {"BreachDate": {"$type": "string"}}},
+        {
+            "$group": {
+                "_id": {"$substrBytes": ["$BreachDate", 0, 4]},
+                "breaches": {"$sum": 1},
+                "pwn_count": {"$sum": {"$ifNull": ["$PwnCount", 0]}},
+            }
+        },
+    ]
+    rows = await db.breaches.aggregate(pipeline).to_list(None)
+    await store_rows(BREACHES_PER_YEAR, rows, started, years)
+
+
+async def refresh_data_class_stats(data_classes: Optional[Iterable[str]] = None):
+    started = datetime.utcnow()
+    data_classes = None if data_classes is None else sorted(set(data_classes))
+    if data_classes == []:
+        return
+
+    pipeline = []
+    if data_classes is not None:
+        pipeline.append({"$match": {"DataClasses": {"$in": data_classes}}})
+    pipeline += UNIQUE_BREACHES + [{"$unwind": "$DataClasses"}]
+    if data_classes is not None:
+        pipeline.append({"$match": {"DataClasses": {"$in": data_classes}}})
+    pipeline.append(
+        {
+            "$group": {
+                "_id": "$DataClasses",
+                "breaches": {"$sum": 1},
+                "pwn_count": {"$sum": {"$ifNull": ["$PwnCount", 0]}},
+            }
+        }
+    )
+    rows = await db.breaches.aggregate(pipeline).to_list(None)
+    await store_rows(DATA_CLASS_STATS, rows, started, data_classes)
+
+
+def catalog_keys(breaches: Iterable[dict]) -> Tuple[List[str], List[str]]:
+    # The year and data class rows a set of catalog breaches count towards
+    years, data_classes = set(), set()
+    for breach in breaches:
+        if isinstance(breach.get("BreachDate"), str):
+            years.add(breach["BreachDate"][:4])
+        data_classes.update(breach.get("DataClasses") or [])
+    return sorted(years), sorted(data_classes)
+
+
+async def refresh_catalog_analytics(years: Optional[List[str]] = None, data_classes: Optional[List[str]] = None):
+    """
+    Rebuild the catalog summaries. After a single breach is added only its year and
+    data class rows (see ``catalog_keys``) are recounted; without keys, e.g. after a
+    full catalog sync, every row is.
+    """
+    await refresh_breaches_per_year(years)
+    await refresh_data_class_stats(data_classes)
+
+
+shutdown_coordinator.resumable(ANALYTICS_JOB, refresh_catalog_analytics)
+
+
+async def refresh_affected_users(breach_names: Optional[Iterable[str]] = None):
+    """
+    Recount how many users are affected by each breach.
+
+    When ``breach_names`` is given only those breaches are recounted, which is what a
+    single user rescan needs; otherwise every breach is recounted.
+    """
+    started = datetime.utcnow()
+    names = None if breach_names is None else sorted(set(breach_names))
+    if names == []:
+        return
+
+    pipeline = [{"$match": {"breaches.Report": {"$type": "array"}}}]
+    if names is not None:
+        pipeline.append({"$match": {"breaches.Report.Name": {"$in": names}}})
+    pipeline.append({"$unwind": "$breaches.Report"})
+    if names is not None:
+        pipeline.append({"$match": {"breaches.Report.Name": {"$in": names}}})
+    pipeline.append({"$group": {"_id": "$breaches.Report.Name", "users": {"$sum": 1}}})
+    rows = await db.users.aggregate(pipeline).to_list(None)
+
+    # Breaches nobody is affected by any more are not in the rows and are dropped
+    await store_rows(BREACH_AFFECTED_USERS, rows, started, names)
+
+
+def breach_names(report) -> list:
+    # Names of the breaches in a stored user report ("Report" is a message when clean)
+    if isinstance(report, dict):
+        report = report.get("Report")
+    if not isinstance(report, list):
+        return []
+    return [breach["Name"] for breach in report if isinstance(breach, dict) and "Name" in breach]
@@ -3,10 +3,15 @@ from typing import Optional
 from jose import JWTError, jwt
 from fastapi import Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
+from app.db import db
+from app.profiling import span
+from app.log_pipeline import bind_user
+import os
 import secrets
 
-# Secret key and algorithm used to sign the JWT
-SECRET_KEY = secrets.token_hex(32)  # Generates a 64-character hexadecimal string
+# Secret key and algorithm used to sign the JWT. Set SECRET_KEY so every worker (and a
+# restarted server) accepts the same tokens; without it each process makes up its own.
+SECRET_KEY = os.getenv("SECRET_KEY") or secrets.token_hex(32)  # 64-character hexadecimal string
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 
@@ -35,10 +40,20 @@ def verify_token(token: str = Depends(oauth2_scheme)):
             raise credentials_exception
     except JWTError:
         raise credentials_exception
+    # Logged with every record of the request from here on
+    bind_user(username)
     return username  # or return any relevant user data from the token
 
 async def get_current_user(token: Optional[str] = Depends(oauth2_scheme)) -> str:
     if token:
-        return verify_token(token)
+        with span("auth"):
+            return verify_token(token)
     else:
-        raise HTTPException(status_code=401, detail="Not authenticated")
\ No newline at end of file
+        raise HTTPException(status_code=401, detail="Not authenticated")
+
+async def get_current_admin(current_user: str = Depends(get_current_user)) -> dict:
+    # Ensure the requesting user is an admin
+    admin_user = await db.users.find_one({"email": current_user}, {"email": 1, "user_type": 1})
+    if not admin_user or admin_user.get("user_type") != "admin":
+        raise HTTPException(status_code=403, detail="Access denied")
+    return admin_user
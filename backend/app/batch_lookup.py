@@ -0,0 +1,364 @@
+"""
+Batch breach lookups of organisation rosters.
+
+A roster (CSV with an email column, or NDJSON of emails or ``{"email": ...}`` objects)
+becomes a lookup job. Duplicates and invalid addresses are dropped, users whose breach
+report is stored locally are answered from it, and the remaining addresses are looked up
+on HIBP by a few concurrent requests spaced at this worker's share of the API key's
+rate limit (see ``BatchLookupSettings``). Results stream
+back as NDJSON as they complete and are stored with the job, so a dropped stream is
+resumed by its job id: stored results are replayed and only the missing ones looked up.
+
+    python -m app.batch_lookup run roster.csv > results.ndjson
+    python -m app.batch_lookup resume <job id> > results.ndjson
+"""
+import argparse
+import asyncio
+import csv
+import os
+import re
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Dict, List, NamedTuple, Optional, Tuple
+from urllib.parse import quote
+
+import orjson
+from pymongo import ReturnDocument
+
+from app.analytics_service import breach_names
+from app.config import BatchLookupSettings, get_batch_lookup_settings, get_hibp_settings
+from app.db import db, connect_to_mongo, close_mongo_connection
+from app.hibp_client import HIBP_API_URL, close_hibp_client, get_hibp_client, hibp_get
+from app.metrics import Counter
+
+LOOKUP_JOBS = "lookup_jobs"
+LOOKUP_RESULTS = "lookup_results"
+
+BREACHED = "breached"
+CLEAN = "clean"
+# HIBP refused the address itself (e.g. 400 for an account it does not accept), stored
+# like an answer so resuming the job does not ask again
+REJECTED = "rejected"
+ERROR = "error"
+
+# 4xx answers about the API key or timing rather than the address, retried on resume
+TRANSIENT_CLIENT_ERRORS = {401, 403, 408, 429}
+
+EMAIL_PATTERN = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+# Roster emails matched against the stored user reports per query
+LOCAL_CHUNK = 1000
+
+LOOKUP_RESULTS_TOTAL = Counter(
+    "batch_lookup_results_total", "Batch lookup results by source and status", ("source", "status"),
+)
+
+
+class Roster(NamedTuple):
+    emails: List[str]
+    duplicates: int
+    invalid: int
+
+
+def roster_values(content: bytes, filename: str = "") -> List[str]:
+    text = content.decode("utf-8-sig")
+    lines = [line for line in text.splitlines() if line.strip()]
+    if not lines:
+        return []
+
+    if filename.endswith((".ndjson", ".jsonl")) or lines[0].lstrip()[:1] in ("{", '"'):
+        values = []
+        for line in lines:
+            try:
+                item = orjson.loads(line)
+            except orjson.JSONDecodeError:
+                values.append("")
+                continue
+            values.append(item.get("email", "") if isinstance(item, dict) else item)
+        return values
+
+    rows = list(csv.reader(lines))
+    header = [cell.strip().lower() for cell in rows[0]]
+    if "email" in header:
+        column = header.index("email")
+        rows = rows[1:]
+    else:
+        # No header, the first column holding an address
+        column = next((position for position, cell in enumerate(rows[0]) if "@" in cell), 0)
+    return [row[column] if column < len(row) else "" for row in rows]
+
+
+def parse_roster(content: bytes, filename: str = "", max_emails: Optional[int] = None) -> Roster:
+    """
+    Normalised, deduplicated emails of an uploaded roster, in roster order.
+    """
+    emails, seen = [], set()
+    duplicates = invalid = 0
+    for value in roster_values(content, filename):
+        email = value.strip().lower() if isinstance(value, str) else ""
+        if not EMAIL_PATTERN.match(email):
+            invalid += 1
+        elif email in seen:
+            duplicates += 1
+        else:
+            seen.add(email)
+            emails.append(email)
+
+    if max_emails is not None and len(emails) > max_emails:
+        raise ValueError(f"Rosters are limited to {max_emails} emails")
+    return Roster(emails, duplicates, invalid)
+
+
+class RateLimiter:
+    """
+    Spaces calls evenly at ``per_minute``. Shared by every job of the worker, the API
+    key's limit does not grow with the number of jobs; the workers split it between
+    them through their settings.
+    """
+
+    def __init__(self, per_minute: float):
+        self.interval = 60.0 / per_minute
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+_limiter: Optional[RateLimiter] = None
+
+
+def rate_limiter(settings: BatchLookupSettings) -> RateLimiter:
+    global _limiter
+    if _limiter is None or _limiter.interval != 60.0 / settings.worker_requests_per_minute:
+        _limiter = RateLimiter(settings.worker_requests_per_minute)
+    return _limiter
+
+
+# -------------------------- Jobs --------------------------
+
+async def create_job(roster: Roster, created_by: str, settings: Optional[BatchLookupSettings] = None) -> dict:
+    """
+    Store a job for ``roster``, leased to the caller that streams it.
+    """
+    settings = settings or get_batch_lookup_settings()
+    now = datetime.utcnow()
+    job = {
+        "_id": uuid.uuid4().hex,
+        "created_by": created_by,
+        "created_at": now,
+        "emails": roster.emails,
+        "total": len(roster.emails),
+        "duplicates": roster.duplicates,
+        "invalid": roster.invalid,
+        "status": "running",
+        "lease_until": now + timedelta(seconds=settings.lease_seconds),
+        "expires_at": now + timedelta(days=settings.retention_days),
+    }
+    await db[LOOKUP_JOBS].insert_one(job)
+    return job
+
+
+async def find_job(job_id: str) -> Optional[dict]:
+    return await db[LOOKUP_JOBS].find_one({"_id": job_id}, {"emails": 0})
+
+
+async def claim_job(job_id: str, settings: Optional[BatchLookupSettings] = None) -> Optional[dict]:
+    """
+    Lease the job to the caller, or None while another stream holds it.
+    """
+    settings = settings or get_batch_lookup_settings()
+    now = datetime.utcnow()
+    return await db[LOOKUP_JOBS].find_one_and_update(
+        {"_id": job_id, "$or": [{"lease_until": None}, {"lease_until": {"$lt": now}}]},
+        {"$set": {"lease_until": now + timedelta(seconds=settings.lease_seconds)}},
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+class JobLease:
+    def __init__(self, job_id: str, settings: BatchLookupSettings):
+        self.job_id = job_id
+        self.settings = settings
+        self._renewed = time.monotonic()
+
+    async def renew(self):
+        # Extended once a third of the lease has passed, not on every result
+        if time.monotonic() - self._renewed < self.settings.lease_seconds / 3:
+            return
+        self._renewed = time.monotonic()
+        await db[LOOKUP_JOBS].update_one(
+            {"_id": self.job_id},
+            {"$set": {"lease_until": datetime.utcnow() + timedelta(seconds=self.settings.lease_seconds)}},
+        )
+
+
+async def load_local_reports(emails: List[str]) -> Dict[str, List[str]]:
+    # Breach names of the roster emails that have a stored user report
+    users = await db.users.find(
+        {"email": {"$in": emails}, "breaches": {"$exists": True}}, {"email": 1, "breaches.Report.Name": 1},
+    ).to_list(None)
+    return {user["email"]: breach_names(user.get("breaches")) for user in users}
+
+
+async def store_result(job: dict, seq: int, email: str, breaches: List[str], source: str,
+                       rejected: Optional[str] = None) -> dict:
+    result = {
+        "_id": f"{job['_id']}:{seq}",
+        "job": job["_id"],
+        "seq": seq,
+        "email": email,
+        "status": REJECTED if rejected else BREACHED if breaches else CLEAN,
+        "breaches": breaches,
+        "source": source,
+        "looked_up_at": datetime.utcnow(),
+        "expires_at": job["expires_at"],
+    }
+    if rejected:
+        result["error"] = rejected
+    await db[LOOKUP_RESULTS].replace_one({"_id": result["_id"]}, result, upsert=True)
+    LOOKUP_RESULTS_TOTAL.labels(source, result["status"]).inc()
+    return result
+
+
+def result_line(result: dict) -> dict:
+    return {key: result[key] for key in ("email", "status", "breaches", "source", "error") if key in result}
+
+
+async def lookup_worker(work: asyncio.Queue, results: asyncio.Queue, settings: BatchLookupSettings):
+    client = get_hibp_client()
+    headers = {"User-Agent": "spearow", "hibp-api-key": os.getenv("API_KEY")}
+    limiter = rate_limiter(settings)
+    # Not a request handler waiting on one answer, rate limits are waited out
+    retries = get_hibp_settings().rate_limit_retries
+
+    while True:
+        try:
+            seq, email = work.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+        await limiter.wait()
+        try:
+            response = await hibp_get(client, f"{HIBP_API_URL}/breachedaccount/{quote(email)}", headers, "breachedaccount", retries)
+            if response.status_code == 200:
+                results.put_nowait((seq, email, [breach["Name"] for breach in response.json()], None, None))
+            elif response.status_code == 404:
+                results.put_nowait((seq, email, [], None, None))
+            elif 400 <= response.status_code < 500 and response.status_code not in TRANSIENT_CLIENT_ERRORS:
+                # The same answer would come back on every resume
+                results.put_nowait((seq, email, [], None, f"HIBP answered {response.status_code}"))
+            else:
+                results.put_nowait((seq, email, None, f"HIBP answered {response.status_code}", None))
+        except Exception as e:
+            # The email is retried when the job is resumed
+            results.put_nowait((seq, email, None, type(e).__name__, None))
+
+
+async def stream_job(job: dict, settings: Optional[BatchLookupSettings] = None) -> AsyncIterator[dict]:
+    """
+    Results of a leased job as they complete: a header line, the results stored by
+    earlier streams, the local ones, then the HIBP ones in completion order, and a
+    summary line. Lookups that failed transiently (rate limits, HIBP errors, network) are
+    not stored, resuming the job retries them; addresses HIBP rejects are stored.
+    """
+    settings = settings or get_batch_lookup_settings()
+    lease = JobLease(job["_id"], settings)
+    counts = {BREACHED: 0, CLEAN: 0, REJECTED: 0, ERROR: 0}
+    tasks: List[asyncio.Task] = []
+
+    try:
+        yield {"job": job["_id"], "total": job["total"], "duplicates": job["duplicates"], "invalid": job["invalid"]}
+
+        done = set()
+        async for result in db[LOOKUP_RESULTS].find({"job": job["_id"]}).sort("seq", 1):
+            done.add(result["seq"])
+            counts[result["status"]] += 1
+            yield result_line(result)
+
+        pending = [(seq, email) for seq, email in enumerate(job["emails"]) if seq not in done]
+        remaining: List[Tuple[int, str]] = []
+        for start in range(0, len(pending), LOCAL_CHUNK):
+            chunk = pending[start:start + LOCAL_CHUNK]
+            local = await load_local_reports([email for _, email in chunk])
+            for seq, email in chunk:
+                if email in local:
+                    result = await store_result(job, seq, email, local[email], "local")
+                    counts[result["status"]] += 1
+                    yield result_line(result)
+                else:
+                    remaining.append((seq, email))
+            await lease.renew()
+
+        work, results = asyncio.Queue(), asyncio.Queue()
+        for item in remaining:
+            work.put_nowait(item)
+        tasks = [
+            asyncio.create_task(lookup_worker(work, results, settings))
+            for _ in range(min(settings.concurrency, len(remaining)))
+        ]
+        for _ in remaining:
+            while True:
+                try:
+                    seq, email, breaches, error, rejected = await asyncio.wait_for(results.get(), settings.lease_seconds / 3)
+                    break
+                except asyncio.TimeoutError:
+                    await lease.renew()
+            if error is not None:
+                counts[ERROR] += 1
+                LOOKUP_RESULTS_TOTAL.labels("hibp", ERROR).inc()
+                yield {"email": email, "status": ERROR, "error": error, "source": "hibp"}
+            else:
+                result = await store_result(job, seq, email, breaches, "hibp", rejected)
+                counts[result["status"]] += 1
+                yield result_line(result)
+            await lease.renew()
+
+        complete = counts[ERROR] == 0
+        await db[LOOKUP_JOBS].update_one(
+            {"_id": job["_id"]},
+            {"$set": {"status": "done" if complete else "incomplete", "lease_until": None, "finished_at": datetime.utcnow()}},
+        )
+        yield {"job": job["_id"], "done": complete, **counts}
+    finally:
+        # A dropped stream stops its lookups, the lease runs out and frees the job
+        for task in tasks:
+            task.cancel()
+
+
+def main():
+    from dotenv import load_dotenv
+
+    parser = argparse.ArgumentParser(description="Batch breach lookups")
+    parser.add_argument("command", choices=["run", "resume"])
+    parser.add_argument("source", help="roster file (CSV or NDJSON) to run, or the id of the job to resume")
+    args = parser.parse_args()
+    load_dotenv()
+
+    async def run():
+        await connect_to_mongo()
+        try:
+            if args.command == "run":
+                with open(args.source, "rb") as roster_file:
+                    roster = parse_roster(roster_file.read(), args.source, get_batch_lookup_settings().max_emails)
+                job = await create_job(roster, "cli")
+            else:
+                job = await claim_job(args.source)
+                if job is None:
+                    print(f"Job {args.source} does not exist or is being streamed elsewhere")
+                    return
+            async for line in stream_job(job):
+                print(orjson.dumps(line).decode(), flush=True)
+        finally:
+            await close_hibp_client()
+            await close_mongo_connection()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,400 @@
-from fastapi_mail import ConnectionConfig
-
-conf = ConnectionConfig(
-    MAIL_USERNAME="spearow.pwned@gmail.com",
-    MAIL_PASSWORD="ohyp dqbf ybpq eaou",
-    MAIL_FROM="spearow.pwned@gmail.com",
-    MAIL_PORT=587,  # Gmail's SMTP port
-    MAIL_SERVER="smtp.gmail.com",  # Gmail's SMTP server
-    MAIL_FROM_NAME="Spearow",
-    MAIL_STARTTLS=True,
-    MAIL_SSL_TLS=False,
-    USE_CREDENTIALS=True,
-    VALIDATE_CERTS=True,
-)
+import os
+from functools import lru_cache
+from typing import Literal, Optional, Union
+from pydantic import Field, model_validator
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+
+def env_flag(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+@lru_cache
+def get_mail_config():
+    # fastapi_mail (and its template and DNS dependencies) is loaded by the first email,
+    # not at startup. The SMTP server can be overridden, e.g. to point at a local sink
+    # for benchmarks.
+    from fastapi_mail import ConnectionConfig
+
+    return ConnectionConfig(
+        MAIL_USERNAME="spearow.pwned@gmail.com",
+        MAIL_PASSWORD="ohyp dqbf ybpq eaou",
+        MAIL_FROM="spearow.pwned@gmail.com",
+        MAIL_PORT=int(os.getenv("MAIL_PORT", 587)),  # Gmail's SMTP port
+        MAIL_SERVER=os.getenv("MAIL_SERVER", "smtp.gmail.com"),  # Gmail's SMTP server
+        MAIL_FROM_NAME="Spearow",
+        MAIL_STARTTLS=env_flag("MAIL_STARTTLS", True),
+        MAIL_SSL_TLS=False,
+        USE_CREDENTIALS=env_flag("MAIL_USE_CREDENTIALS", True),
+        VALIDATE_CERTS=env_flag("MAIL_VALIDATE_CERTS", True),
+    )
+
+
+class DatabaseSettings(BaseSettings):
+    """
+    MongoDB connection settings, read from MONGO_* environment variables or .env.
+
+    Pool limits apply per worker process. Set MONGO_POOL_BUDGET to the number of
+    connections the whole deployment may hold and each worker takes its share of it
+    (based on WEB_CONCURRENCY), so adding workers does not over-subscribe the cluster.
+    """
+
+    model_config = SettingsConfigDict(env_prefix="MONGO_", env_file=".env", extra="ignore")
+
+    url: str = "mongodb://localhost:27017"
+    db_name: str = "pwned_db"
+
+    # Connection pool
+    max_pool_size: int = 100
+    min_pool_size: int = 0
+    pool_budget: Optional[int] = None
+    workers: int = Field(default=1, ge=1, validation_alias="WEB_CONCURRENCY")
+    max_idle_time_ms: Optional[int] = 60_000
+    wait_queue_timeout_ms: Optional[int] = None
+
+    # Timeouts
+    server_selection_timeout_ms: int = 30_000
+    connect_timeout_ms: int = 20_000
+    socket_timeout_ms: Optional[int] = None
+
+    # Wire compression, comma separated in order of preference (zstd, snappy, zlib).
+    # zstd and snappy need the zstandard / python-snappy packages installed.
+    compressors: str = ""
+
+    # Report queries (breach catalog and summaries) tolerate slightly stale reads
+    report_read_preference: Literal[
+        "primary", "primaryPreferred", "secondary", "secondaryPreferred", "nearest"
+    ] = "primary"
+    report_read_concern: Optional[Literal["local", "available", "majority"]] = None
+
+    # Write concern for bulk jobs (admin bulk updates, migrations)
+    bulk_write_concern: Optional[Union[int, str]] = None
+    bulk_write_timeout_ms: Optional[int] = None
+
+    # Command monitoring: commands slower than this are logged, debug headers expose
+    # the per-request MongoDB time (X-DB-Time) and round trips (X-DB-Round-Trips)
+    slow_command_ms: float = 100.0
+    debug_headers: bool = False
+
+    @property
+    def pool_size(self) -> int:
+        if self.pool_budget is None:
+            return self.max_pool_size
+        return max(1, min(self.max_pool_size, self.pool_budget // self.workers))
+
+
+@lru_cache
+def get_database_settings() -> DatabaseSettings:
+    return DatabaseSettings()
+
+
+class ProfilingSettings(BaseSettings):
+    """
+    Per-request profiling, read from PROFILE_* environment variables or .env.
+
+    Admins can always profile a request with the ``X-Profile: 1`` header, the sample
+    rate additionally profiles that share of all requests.
+    """
+
+    model_config = SettingsConfigDict(env_prefix="PROFILE_", env_file=".env", extra="ignore")
+
+    sample_rate: float = Field(default=0.0, ge=0.0, le=1.0)
+    buffer_size: int = Field(default=20, ge=1)
+    top_functions: int = Field(default=40, ge=1)
+
+
+@lru_cache
+def get_profiling_settings() -> ProfilingSettings:
+    return ProfilingSettings()
+
+
+# backend/uploaded_ids, independent of the working directory
+DEFAULT_UPLOADED_IDS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "uploaded_ids")
+# Outside the storage directory, which is served publicly under /uploaded_ids
+DEFAULT_ID_PREVIEWS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "id_previews")
+
+
+class IdUploadSettings(BaseSettings):
+    """
+    ID document uploads, read from ID_UPLOAD_* environment variables or .env.
+    """
+
+    model_config = SettingsConfigDict(env_prefix="ID_UPLOAD_", env_file=".env", extra="ignore")
+
+    dir: str = DEFAULT_UPLOADED_IDS_DIR
+    max_bytes: int = Field(default=10 * 1024 * 1024, ge=1)
+    # Checked against the file's signature, not the client supplied content type
+    allowed_types: str = "image/jpeg,image/png,image/webp,application/pdf"
+
+    # Downscaled, EXIF-stripped previews of image uploads for the admin review list,
+    # only served by the admin-checked /id-previews route
+    preview_dir: str = DEFAULT_ID_PREVIEWS_DIR
+    preview_max_size: int = Field(default=480, ge=16)
+    preview_format: Literal["webp", "jpeg"] = "webp"
+    preview_quality: int = Field(default=75, ge=1, le=100)
+    preview_workers: int = Field(default=2, ge=1)
+
+    @model_validator(mode="after")
+    def previews_outside_storage(self):
+        # Anything under the storage directory is readable without a token
+        storage = os.path.realpath(self.dir)
+        previews = os.path.realpath(self.preview_dir)
+        if os.path.commonpath([storage, previews]) == storage:
+            raise ValueError("ID_UPLOAD_PREVIEW_DIR must not be inside ID_UPLOAD_DIR, which is served publicly")
+        return self
+
+    @property
+    def allowed_type_set(self) -> set:
+        return {value.strip() for value in self.allowed_types.split(",") if value.strip()}
+
+
+@lru_cache
+def get_id_upload_settings() -> IdUploadSettings:
+    return IdUploadSettings()
+
+
+
+class NotificationSettings(BaseSettings):
+    """
+    Admin notifications, read from NOTIFY_* environment variables or .env.
+
+    ID uploads are announced to the admins in digests, sent every digest interval or
+    as soon as ``digest_max_events`` uploads are pending, whichever comes first.
+    """
+
+    model_config = SettingsConfigDict(env_prefix="NOTIFY_", env_file=".env", extra="ignore")
+
+    digest_interval_seconds: float = Field(default=300.0, gt=0)
+    digest_max_events: int = Field(default=25, ge=1)
+    # Admin status changes drop the cached recipients in every worker right away (see
+    # app.invalidation), the TTL is a safety net for a missed invalidation
+    admin_cache_ttl_seconds: float = Field(default=3600.0, ge=0)
+
+
+@lru_cache
+def get_notification_settings() -> NotificationSettings:
+    return NotificationSettings()
+
+
+class LoginThrottleSettings(BaseSettings):
+    """
+    Login brute-force throttling, read from LOGIN_THROTTLE_* environment variables or .env.
+
+    Failures are counted per email and per client IP over ``window_seconds``. After the
+    free failures each attempt waits ``base_delay_seconds``, doubling up to
+    ``max_delay_seconds``; at the lockout threshold the key is locked for
+    ``lockout_seconds`` after its last failure.
+    """
+
+    model_config = SettingsConfigDict(env_prefix="LOGIN_THROTTLE_", env_file=".env", extra="ignore")
+
+    enabled: bool = True
+    # "mongo" shares the counters between workers
+    store: Literal["memory", "mongo"] = "memory"
+    max_keys: int = Field(default=100_000, ge=1)
+
+    window_seconds: float = Field(default=900.0, gt=0)
+    base_delay_seconds: float = Field(default=1.0, ge=0)
+    max_delay_seconds: float = Field(default=60.0, ge=0)
+    lockout_seconds: float = Field(default=900.0, ge=0)
+
+    email_free_failures: int = Field(default=3, ge=0)
+    email_lockout: int = Field(default=10, ge=1)
+    # One IP can front many users (offices, NAT), so it gets more room
+    ip_free_failures: int = Field(default=10, ge=0)
+    ip_lockout: int = Field(default=50, ge=1)
+
+    # OTP emails per address within the window
+    otp_emails_per_window: int = Field(default=5, ge=1)
+
+
+@lru_cache
+def get_login_throttle_settings() -> LoginThrottleSettings:
+    return LoginThrottleSettings()
+
+
+class ServerSettings(BaseSettings):
+    """
+    Production server launched by ``python -m app.serve``, read from SERVER_* environment
+    variables or .env.
+
+    Without ``workers`` one worker is started per available core. Workers are recycled
+    after ``max_requests`` requests to bound slow leaks.
+    """
+
+    model_config = SettingsConfigDict(env_prefix="SERVER_", env_file=".env", extra="ignore")
+
+    host: str = "0.0.0.0"
+    port: int = 8000
+    workers: Optional[int] = Field(default=None, ge=1)
+
+    # "auto" uses uvloop and httptools when they are installed
+    loop: Literal["auto", "uvloop", "asyncio"] = "auto"
+    http: Literal["auto", "httptools", "h11"] = "auto"
+
+    # Longer than the idle timeout of the load balancer in front (often 60s), so it is
+    # never handed a connection the server is about to close
+    keep_alive_seconds: int = Field(default=75, ge=1)
+    backlog: int = Field(default=2048, ge=1)
+    limit_concurrency: Optional[int] = Field(default=None, ge=1)
+    max_requests: Optional[int] = Field(default=10_000, ge=1)
+    graceful_shutdown_seconds: int = Field(default=30, ge=1)
+
+    # X-Forwarded-For / X-Forwarded-Proto are only trusted from these addresses
+    proxy_headers: bool = True
+    forwarded_allow_ips: str = "127.0.0.1"
+
+    log_level: str = "info"
+    access_log: bool = True
+
+
+@lru_cache
+def get_server_settings() -> ServerSettings:
+    return ServerSettings()
+
+
+class ShutdownSettings(BaseSettings):
+    """
+    Graceful shutdown of background jobs, read from SHUTDOWN_* environment variables or
+    .env. The drain starts once the server stopped serving requests, so the termination
+    grace period of the orchestrator must cover SERVER_GRACEFUL_SHUTDOWN_SECONDS plus
+    both of these.
+    """
+
+    model_config = SettingsConfigDict(env_prefix="SHUTDOWN_", env_file=".env", extra="ignore")
+
+    drain_seconds: float = Field(default=20, ge=0)
+    checkpoint_seconds: float = Field(default=5, gt=0)
+
+
+@lru_cache
+def get_shutdown_settings() -> ShutdownSettings:
+    return ShutdownSettings()
+
+
+class LoggingSettings(BaseSettings):
+    """
+    Log pipeline (app.log_pipeline), read from LOG_* environment variables or .env.
+    ``levels`` and ``sample`` are comma separated ``logger=value`` pairs.
+    """
+
+    model_config = SettingsConfigDict(env_prefix="LOG_", env_file=".env", extra="ignore")
+
+    level: str = "INFO"
+    # Per-module levels, e.g. "app.db_monitoring=DEBUG,app.routes.upload_routes=WARNING"
+    levels: str = ""
+    # Fraction of the records below WARNING kept per logger, e.g. "uvicorn.access=0.1"
+    sample: str = ""
+    format: Literal["json", "text"] = "json"
+    # Records logged while the queue is full are dropped, never waited on
+    queue_size: int = Field(default=10_000, ge=1)
+
+
+@lru_cache
+def get_logging_settings() -> LoggingSettings:
+    return LoggingSettings()
+
+
+class InvalidationSettings(BaseSettings):
+    """
+    Cross-worker cache invalidation bus (app.invalidation), read from INVALIDATION_*
+    environment variables or .env.
+    """
+
+    model_config = SettingsConfigDict(env_prefix="INVALIDATION_", env_file=".env", extra="ignore")
+
+    enabled: bool = True
+    collection: str = "cache_invalidations"
+    # Capped collection limits, only the last messages are ever read
+    size_bytes: int = Field(default=1_048_576, ge=4096)
+    max_messages: int = Field(default=1000, ge=1)
+    # How long a tailable cursor waits on the server for new messages
+    await_ms: int = Field(default=1000, ge=1)
+    # Pause before reopening a dead cursor, or between polls without a capped collection
+    poll_seconds: float = Field(default=0.5, gt=0)
+    # Largest clock difference between nodes, messages are re-read this far back
+    clock_skew_seconds: float = Field(default=30.0, ge=0)
+
+
+@lru_cache
+def get_invalidation_settings() -> InvalidationSettings:
+    return InvalidationSettings()
+
+
+class BatchLookupSettings(BaseSettings):
+    """
+    Batch breach lookups of rosters (app.batch_lookup), read from BATCH_LOOKUP_*
+    environment variables or .env.
+
+    ``requests_per_minute`` is the API key's limit for the whole deployment. A share of
+    it is left to the report routes, which call HIBP on demand, and each worker paces
+    its lookups at its part of the rest (based on WEB_CONCURRENCY, like the MongoDB
+    pool budget), so adding workers does not exceed the key's limit.
+    """
+
+    model_config = SettingsConfigDict(env_prefix="BATCH_LOOKUP_", env_file=".env", extra="ignore")
+
+    # HIBP calls per minute allowed by the API key
+    requests_per_minute: float = Field(default=10, gt=0)
+    # Share of the key's limit kept free for the report routes
+    request_path_share: float = Field(default=0.2, ge=0, lt=1)
+    workers: int = Field(default=1, ge=1, validation_alias="WEB_CONCURRENCY")
+    # HIBP calls in flight at once
+    concurrency: int = Field(default=4, ge=1)
+    max_emails: int = Field(default=10_000, ge=1)
+    max_bytes: int = Field(default=2_097_152, ge=1024)
+    # A job is streamed by one request at a time; a dropped stream frees it after this
+    lease_seconds: float = Field(default=60, gt=0)
+    # Jobs and their results are deleted after this
+    retention_days: int = Field(default=7, ge=1)
+
+    @property
+    def worker_requests_per_minute(self) -> float:
+        return self.requests_per_minute * (1 - self.request_path_share) / self.workers
+
+
+@lru_cache
+def get_batch_lookup_settings() -> BatchLookupSettings:
+    return BatchLookupSettings()
+
+
+class MetricsSettings(BaseSettings):
+    """
+    Access to the Prometheus ``/metrics`` endpoint, read from METRICS_* environment
+    variables or .env. A scrape is allowed from ``allow_ips`` (comma separated addresses
+    or networks) or with ``Authorization: Bearer <token>``; everything else gets 403.
+    """
+
+    model_config = SettingsConfigDict(env_prefix="METRICS_", env_file=".env", extra="ignore")
+
+    # Loopback only by default, e.g. "127.0.0.1,10.0.0.0/8" for a scraper on the network
+    allow_ips: str = "127.0.0.1,::1"
+    token: Optional[str] = None
+
+
+@lru_cache
+def get_metrics_settings() -> MetricsSettings:
+    return MetricsSettings()
+
+
+class HibpSettings(BaseSettings):
+    """
+    HIBP rate-limit handling (app.hibp_client), read from HIBP_* environment variables
+    or .env. Only background work such as batch lookups waits out a 429; request
+    handlers never retry, they answer 503 with the ``Retry-After`` of HIBP.
+    """
+
+    model_config = SettingsConfigDict(env_prefix="HIBP_", env_file=".env", extra="ignore")
+
+    # Retries of a 429 by callers that may wait
+    rate_limit_retries: int = Field(default=2, ge=0)
+    # Longest Retry-After waited out, larger ones are capped
+    max_retry_after_seconds: float = Field(default=10.0, ge=0)
+
+
+@lru_cache
+def get_hibp_settings() -> HibpSettings:
+    return HibpSettings()
@@ -0,0 +1,167 @@
+"""
+MongoDB command monitoring.
+
+A pymongo CommandListener records the latency of every command per collection and
+operation, logs slow commands with the shape of their filter, and attributes each
+command to the HTTP request that issued it. Motor runs commands on executor threads
+with a copy of the caller's context, so the per-request stats travel in a contextvar.
+"""
+import logging
+from contextvars import ContextVar
+from typing import Optional
+from pymongo import monitoring
+from app.metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+# Commands that are not issued by application code
+IGNORED_COMMANDS = {"ping", "hello", "ismaster", "isMaster", "endSessions", "killCursors"}
+
+COMMAND_DURATION = Histogram(
+    "mongo_command_duration_seconds",
+    "MongoDB command latency by collection and operation",
+    ("collection", "operation", "outcome"),
+)
+REQUEST_ROUND_TRIPS = Histogram(
+    "mongo_request_round_trips",
+    "MongoDB commands issued per HTTP request",
+    ("route",),
+    buckets=(0, 1, 2, 3, 4, 5, 8, 13, 21, 50),
+)
+REQUEST_DB_TIME = Histogram(
+    "mongo_request_duration_seconds",
+    "Total MongoDB time per HTTP request",
+    ("route",),
+)
+
+
+class RequestDbStats:
+    __slots__ = ("round_trips", "duration", "scope")
+
+    def __init__(self, scope: Optional[dict] = None):
+        self.round_trips = 0
+        self.duration = 0.0
+        self.scope = scope
+
+    def record(self, duration: float):
+        self.round_trips += 1
+        self.duration += duration
+
+    @property
+    def route(self) -> str:
+        # The router stores the matched route in the scope before the endpoint runs
+        route = self.scope.get("route") if self.scope else None
+        return route.path if route is not None else "unmatched"
+
+
+current_db_stats: ContextVar[Optional[RequestDbStats]] = ContextVar("current_db_stats", default=None)
+
+
+def query_shape(value):
+    # Replace literal values with their type so filters group by shape, not content
+    if isinstance(value, dict):
+        return {key: query_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [query_shape(value[0])] if value else []
+    return type(value).__name__
+
+
+def command_filter(command_name: str, command) -> Optional[dict]:
+    if command_name in ("find", "count", "findAndModify", "distinct"):
+        return command.get("filter") or command.get("query")
+    if command_name in ("update", "delete"):
+        statements = command.get("updates") or command.get("deletes") or []
+        return statements[0].get("q") if statements else None
+    if command_name == "aggregate":
+        pipeline = command.get("pipeline") or []
+        return pipeline[0].get("$match") if pipeline else None
+    return None
+
+
+class CommandMonitor(monitoring.CommandListener):
+    def __init__(self, slow_command_ms: float = 100.0):
+        self.slow_command_seconds = slow_command_ms / 1000
+        self._pending = {}
+
+    def started(self, event: monitoring.CommandStartedEvent):
+        if event.command_name in IGNORED_COMMANDS:
+            return
+
+        command = event.command
+        if event.command_name == "getMore":
+            collection = command.get("collection")
+        else:
+            collection = command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = "-"
+
+        # Only a reference to the filter is kept, its shape is computed for slow commands
+        self._pending[(event.connection_id, event.request_id)] = (
+            collection,
+            command_filter(event.command_name, command),
+            current_db_stats.get(),
+        )
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        self._finish(event, "ok")
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        self._finish(event, "error")
+
+    def _finish(self, event, outcome: str):
+        pending = self._pending.pop((event.connection_id, event.request_id), None)
+        if pending is None:
+            return
+
+        collection, filter_doc, stats = pending
+        duration = event.duration_micros / 1_000_000
+        COMMAND_DURATION.labels(collection, event.command_name, outcome).observe(duration)
+
+        if stats is not None:
+            stats.record(duration)
+
+        if duration >= self.slow_command_seconds:
+            logger.warning(
+                f"Slow MongoDB command {event.command_name} on {collection} took {duration * 1000:.1f}ms "
+                f"(route {stats.route if stats else '-'}, filter {query_shape(filter_doc) if filter_doc else '-'})"
+            )
+
+
+command_monitor = CommandMonitor()
+
+
+class DbStatsMiddleware:
+    """
+    ASGI middleware that collects the MongoDB round trips and time of each request.
+
+    With ``debug_headers`` the totals are returned in X-DB-Time (milliseconds) and
+    X-DB-Round-Trips response headers.
+    """
+
+    def __init__(self, app, debug_headers: bool = False):
+        self.app = app
+        self.debug_headers = debug_headers
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestDbStats(scope)
+        token = current_db_stats.set(stats)
+
+        async def send_with_stats(message):
+            if message["type"] == "http.response.start":
+                if self.debug_headers:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"x-db-time", f"{stats.duration * 1000:.2f}".encode()))
+                    headers.append((b"x-db-round-trips", str(stats.round_trips).encode()))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_stats)
+        finally:
+            REQUEST_ROUND_TRIPS.labels(stats.route).observe(stats.round_trips)
+            REQUEST_DB_TIME.labels(stats.route).observe(stats.duration)
+            current_db_stats.reset(token)
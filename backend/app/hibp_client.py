@@ -0,0 +1,88 @@
+import asyncio
+import os
+import time
+from typing import Optional
+import httpx
+from fastapi import HTTPException
+from app.config import get_hibp_settings
+from app.metrics import HIBP_REQUEST_DURATION, HIBP_RATE_LIMIT_WAIT
+from app.profiling import span
+
+# Base url of the HIBP v3 API, overridable to point at a local stand-in
+HIBP_API_URL = os.getenv("HIBP_API_URL", "https://haveibeenpwned.com/api/v3").rstrip("/")
+
+# Connections kept open to HIBP by each worker
+HIBP_LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=30.0)
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_hibp_client() -> httpx.AsyncClient:
+    """
+    The worker's pooled HIBP client, so calls reuse TLS connections instead of opening
+    one per request. Opened by the app lifespan in each worker, or on first use.
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(limits=HIBP_LIMITS)
+    return _client
+
+
+async def close_hibp_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def retry_after(response: httpx.Response) -> float:
+    try:
+        wait = float(response.headers.get("retry-after", 1))
+    except ValueError:
+        wait = 1.0
+    return min(max(wait, 0.0), get_hibp_settings().max_retry_after_seconds)
+
+
+def raise_for_hibp_status(response: httpx.Response):
+    """
+    Raise for an unexpected HIBP answer. A rate limit becomes a 503 with the wait HIBP
+    asked for, so the client retries later instead of a request handler sleeping.
+    """
+    if response.status_code == 429:
+        raise HTTPException(
+            status_code=503,
+            detail="Breach lookups are rate limited, please try again shortly",
+            headers={"Retry-After": str(max(1, int(retry_after(response))))},
+        )
+    response.raise_for_status()
+
+
+async def hibp_get(client: httpx.AsyncClient, url: str, headers: dict, endpoint: str, retries: int = 0) -> httpx.Response:
+    """
+    GET a HIBP API url, recording latency per endpoint.
+
+    HIBP answers 429 with a Retry-After header when the API key's rate limit is exceeded.
+    Up to ``retries`` of them are waited out; request handlers keep the default of none,
+    background work passes ``HIBP_RATE_LIMIT_RETRIES``.
+
+    ``endpoint`` is the metrics label (e.g. "breachedaccount"), never the full url, so
+    emails and site names do not end up in the metrics.
+    """
+    attempt = 0
+    while True:
+        start = time.perf_counter()
+        try:
+            with span("hibp"):
+                response = await client.get(url, headers=headers)
+        except httpx.HTTPError:
+            HIBP_REQUEST_DURATION.labels(endpoint, "error").observe(time.perf_counter() - start)
+            raise
+        HIBP_REQUEST_DURATION.labels(endpoint, response.status_code).observe(time.perf_counter() - start)
+
+        if response.status_code != 429 or attempt >= retries:
+            return response
+
+        wait = retry_after(response)
+        HIBP_RATE_LIMIT_WAIT.labels(endpoint).observe(wait)
+        await asyncio.sleep(wait)
+        attempt += 1
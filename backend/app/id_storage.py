@@ -0,0 +1,265 @@
+"""
+ID document storage.
+
+The multipart body of an upload is parsed as it streams in, and the file part is written
+to a temporary file next to its destination in a worker thread, chunk by chunk. The
+file type is sniffed from its first bytes before anything is written, so an unsupported
+type (or an oversized body) is rejected while the rest of the body is still in flight.
+Once the bytes are flushed to disk the file is renamed atomically to a content-addressed
+path, ``<dir>/<sha256[:2]>/<sha256>.<ext>``, so identical uploads are stored once and a
+crash never leaves a half written document behind.
+"""
+import hashlib
+import os
+import tempfile
+from typing import Dict, NamedTuple, Optional
+
+from fastapi import HTTPException, Request
+from multipart.multipart import MultipartParseError, MultipartParser, parse_options_header
+from starlette.concurrency import run_in_threadpool
+from app.config import IdUploadSettings
+
+CHUNK_SIZE = 64 * 1024
+
+# Room for the multipart boundaries and headers around the file
+MULTIPART_OVERHEAD = 64 * 1024
+
+# Parts of an upload besides the file, which are skipped
+MAX_FORM_PARTS = 10
+
+# Leading bytes identifying each accepted type
+SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg", ".jpg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png", ".png"),
+    (b"%PDF-", "application/pdf", ".pdf"),
+)
+
+# Bytes needed to tell every type apart (RIFF....WEBP)
+SNIFF_BYTES = 12
+
+# URL prefix the storage directory is mounted under
+PUBLIC_PREFIX = "uploaded_ids"
+
+
+class StoredDocument(NamedTuple):
+    path: str  # relative to the mount, e.g. "uploaded_ids/ab/ab12....jpg"
+    sha256: str
+    size: int
+    content_type: str
+
+
+def sniff_type(head: bytes) -> Optional[tuple]:
+    for signature, content_type, extension in SIGNATURES:
+        if head.startswith(signature):
+            return content_type, extension
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp", ".webp"
+    return None
+
+
+class DocumentSink:
+    """
+    A document written chunk by chunk: the type is checked on the first bytes, before
+    the temporary file is even created, and the size on every chunk. Every method
+    blocks, call them from a worker thread.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, allowed_types: set):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.allowed_types = allowed_types
+        self.detected: Optional[tuple] = None
+        self.size = 0
+        self._digest = hashlib.sha256()
+        self._head = b""
+        self._target = None
+        self._temp_path: Optional[str] = None
+
+    def write(self, chunk: bytes):
+        if self.detected is None:
+            # Held back until there are enough bytes to sniff
+            self._head += chunk
+            if len(self._head) < SNIFF_BYTES:
+                return
+            chunk, self._head = self._head, b""
+            self._open(chunk)
+        self._append(chunk)
+
+    def _open(self, head: bytes):
+        detected = sniff_type(head)
+        if detected is None or detected[0] not in self.allowed_types:
+            raise HTTPException(status_code=415, detail="Unsupported file type")
+        self.detected = detected
+        os.makedirs(self.directory, exist_ok=True)
+        descriptor, self._temp_path = tempfile.mkstemp(dir=self.directory, prefix=".upload-")
+        self._target = os.fdopen(descriptor, "wb")
+
+    def _append(self, chunk: bytes):
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise HTTPException(status_code=413, detail="File too large")
+        self._digest.update(chunk)
+        self._target.write(chunk)
+
+    def finish(self) -> StoredDocument:
+        if self.detected is None:
+            # Shorter than SNIFF_BYTES
+            if not self._head:
+                raise HTTPException(status_code=400, detail="Empty file")
+            head, self._head = self._head, b""
+            self._open(head)
+            self._append(head)
+
+        self._target.flush()
+        os.fsync(self._target.fileno())
+        self._target.close()
+
+        sha256 = self._digest.hexdigest()
+        content_type, extension = self.detected
+        shard = os.path.join(self.directory, sha256[:2])
+        os.makedirs(shard, exist_ok=True)
+        os.replace(self._temp_path, os.path.join(shard, sha256 + extension))
+        self._temp_path = None
+        fsync_directory(shard)
+        return StoredDocument(f"{PUBLIC_PREFIX}/{sha256[:2]}/{sha256}{extension}", sha256, self.size, content_type)
+
+    def discard(self):
+        if self._target is not None:
+            self._target.close()
+        if self._temp_path is not None and os.path.exists(self._temp_path):
+            os.unlink(self._temp_path)
+        self._temp_path = None
+
+
+def write_document(source, directory: str, max_bytes: int, allowed_types: set) -> StoredDocument:
+    # Runs in a worker thread: every call here blocks
+    sink = DocumentSink(directory, max_bytes, allowed_types)
+    try:
+        while True:
+            chunk = source.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            sink.write(chunk)
+        return sink.finish()
+    except BaseException:
+        sink.discard()
+        raise
+
+
+class MultipartUpload:
+    """
+    Multipart body parser writing the ``field`` file part to a DocumentSink as the body
+    arrives; other parts are skipped. Blocks like the sink, call it from a worker thread.
+    """
+
+    def __init__(self, boundary: bytes, field: str, sink: DocumentSink, max_parts: int = MAX_FORM_PARTS + 1):
+        self.field = field.encode()
+        self.sink = sink
+        self.max_parts = max_parts
+        self.found = False
+        self._parts = 0
+        self._writing = False
+        self._headers: Dict[bytes, bytes] = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._parser = MultipartParser(boundary, callbacks={
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+        })
+
+    def on_part_begin(self):
+        self._parts += 1
+        if self._parts > self.max_parts:
+            raise HTTPException(status_code=400, detail="Too many form fields")
+        self._headers = {}
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = self._header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        if options.get(b"name") != self.field or b"filename" not in options:
+            return
+        if self.found:
+            raise HTTPException(status_code=400, detail="Only one file can be uploaded")
+        self.found = self._writing = True
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        if self._writing:
+            self.sink.write(data[start:end])
+
+    def on_part_end(self):
+        self._writing = False
+
+    def write(self, chunk: bytes):
+        try:
+            self._parser.write(chunk)
+        except MultipartParseError:
+            raise HTTPException(status_code=400, detail="Malformed multipart body")
+
+    def finish(self) -> StoredDocument:
+        try:
+            self._parser.finalize()
+        except MultipartParseError:
+            raise HTTPException(status_code=400, detail="Malformed multipart body")
+        if not self.found:
+            raise HTTPException(status_code=400, detail="No file uploaded")
+        return self.sink.finish()
+
+
+async def receive_id_document(request: Request, settings: IdUploadSettings, field: str = "file") -> StoredDocument:
+    """
+    Stream the ``field`` file of a multipart ID upload to disk and store it. Oversized
+    bodies and unsupported file types are rejected as soon as they show, without reading
+    the rest of the body; the body is never buffered or spooled as a whole.
+    """
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in options:
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data upload")
+
+    max_body = settings.max_bytes + MULTIPART_OVERHEAD
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_body:
+        raise HTTPException(status_code=413, detail="File too large")
+
+    upload = MultipartUpload(options[b"boundary"], field, DocumentSink(settings.dir, settings.max_bytes, settings.allowed_type_set))
+    received = 0
+    try:
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > max_body:
+                raise HTTPException(status_code=413, detail="File too large")
+            if chunk:
+                await run_in_threadpool(upload.write, chunk)
+        return await run_in_threadpool(upload.finish)
+    except BaseException:
+        # Also when the client goes away or the request is cancelled
+        upload.sink.discard()
+        raise
+
+
+def fsync_directory(path: str):
+    # Makes the rename itself durable; not supported on every platform
+    try:
+        descriptor = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(descriptor)
+    except OSError:
+        pass
+    finally:
+        os.close(descriptor)
+
@@ -0,0 +1,250 @@
+"""
+Declarative index registry.
+
+Every query shape the routes issue is listed in QUERY_SHAPES together with the index in
+INDEXES that serves it. At startup the indexes in REQUIRED_INDEXES are built before the
+app serves requests and the other missing ones in the background; the CLI shows the
+difference with the live database, applies it, and explains the registered queries to
+flag any that fall back to a collection scan.
+
+Collections that only hold data for a while expire it with a TTL index. The derived
+collections that are not expired are rewritten as a whole: ``hibp_data_classes`` (one
+document, refreshed by age on read), ``user_risk`` (replaced by every rescore),
+``breach_recommendations`` (pruned by each full catalog sync) and the ``analytics_*``
+collections (replaced by each refresh). A batch lookup lease is a ``lease_until`` field
+on its job, it is released by the stream or runs out, and the job itself expires.
+
+    python -m app.indexes diff
+    python -m app.indexes apply [--drop-extra]
+    python -m app.indexes explain
+"""
+import argparse
+import asyncio
+import logging
+from typing import Dict, List, NamedTuple, Optional
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from app.db import db
+
+logger = logging.getLogger(__name__)
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    "users": [
+        # Login, OTP and every per-user lookup by email
+        IndexModel([("email", ASCENDING)], unique=True),
+        # Admin directory name prefix search
+        IndexModel([("name", ASCENDING)]),
+        # Admin recipient lookups, only admins are indexed
+        IndexModel([("user_type", ASCENDING)], partialFilterExpression={"user_type": "admin"}),
+        # Affected-user analytics refreshed for a handful of breaches
+        IndexModel([("breaches.Report.Name", ASCENDING)]),
+    ],
+    "uploads": [
+        # "My uploads", newest first
+        IndexModel([("user_id", ASCENDING), ("upload_date", DESCENDING)]),
+        # Admin review queue of unverified uploads
+        IndexModel([("status", ASCENDING), ("upload_date", ASCENDING)]),
+    ],
+    "breaches": [
+        # Single-site reports
+        IndexModel([("Name", ASCENDING)]),
+    ],
+    "login_throttle": [
+        # Throttle counters shared between workers expire with their window
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+    "password_resets": [
+        # Reset records expire on their own
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+    "analytics_data_classes": [
+        IndexModel([("pwn_count", DESCENDING)]),
+    ],
+    "analytics_breach_users": [
+        IndexModel([("users", DESCENDING)]),
+    ],
+    "deferred_jobs": [
+        # Checkpoints no worker resumed within a week are stale, later syncs and digests
+        # have superseded them
+        IndexModel([("deferred_at", ASCENDING)], expireAfterSeconds=7 * 24 * 3600),
+    ],
+    "lookup_jobs": [
+        # Batch lookup jobs expire with their results, past their leases
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+    "lookup_results": [
+        # Replay of a resumed job in roster order
+        IndexModel([("job", ASCENDING), ("seq", ASCENDING)]),
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+}
+
+# Built before the app serves requests: until the unique email index exists, concurrent
+# signups with one address can both create an account
+REQUIRED_INDEXES: Dict[str, List[str]] = {
+    "users": ["email_1"],
+}
+
+# Index options that make two indexes with the same key different
+COMPARED_OPTIONS = ("unique", "sparse", "expireAfterSeconds", "partialFilterExpression")
+
+
+class QueryShape(NamedTuple):
+    collection: str
+    filter: dict
+    sort: Optional[list] = None
+
+
+QUERY_SHAPES: List[QueryShape] = [
+    QueryShape("users", {"email": "user@example.com"}),
+    QueryShape("users", {"user_type": "admin"}),
+    QueryShape("users", {"name": {"$regex": "^Jo"}}),
+    QueryShape("users", {"breaches.Report.Name": {"$in": ["Adobe"]}}),
+    QueryShape("uploads", {"user_id": ObjectId()}, [("upload_date", DESCENDING), ("_id", DESCENDING)]),
+    QueryShape("uploads", {"status": "unverified"}),
+    QueryShape("breaches", {"Name": "Adobe"}),
+    QueryShape("lookup_results", {"job": "0" * 32}, [("seq", ASCENDING)]),
+]
+
+
+def index_spec(index: dict) -> dict:
+    # Comparable form of an index, from an IndexModel document or index_information()
+    return {
+        "key": [(field, direction) for field, direction in index["key"].items()]
+        if isinstance(index["key"], dict)
+        else [tuple(part) for part in index["key"]],
+        **{option: index[option] for option in COMPARED_OPTIONS if option in index},
+    }
+
+
+async def diff_indexes() -> Dict[str, dict]:
+    """
+    Compare the registry with the live indexes.
+
+    Returns, per collection, the registry indexes that are ``missing``, the existing ones
+    whose options ``changed`` and the ``extra`` ones the registry does not know about.
+    """
+    diff = {}
+    for collection, models in INDEXES.items():
+        existing = await db[collection].index_information()
+        existing.pop("_id_", None)
+
+        missing, changed = [], []
+        for model in models:
+            wanted = model.document
+            current = existing.pop(wanted["name"], None)
+            if current is None:
+                missing.append(model)
+            elif index_spec(current) != index_spec(wanted):
+                changed.append(model)
+
+        diff[collection] = {"missing": missing, "changed": changed, "extra": sorted(existing)}
+
+    return diff
+
+
+async def apply_indexes(drop_extra: bool = False) -> Dict[str, dict]:
+    diff = await diff_indexes()
+
+    for collection, changes in diff.items():
+        # Changed indexes are rebuilt under the same name
+        for model in changes["changed"]:
+            await db[collection].drop_index(model.document["name"])
+        if changes["missing"] or changes["changed"]:
+            await db[collection].create_indexes(changes["missing"] + changes["changed"])
+        if drop_extra:
+            for name in changes["extra"]:
+                await db[collection].drop_index(name)
+
+    return diff
+
+
+async def ensure_indexes(only: Optional[Dict[str, List[str]]] = None):
+    # Only creates what is missing, never drops, safe to run on every boot. ``only``
+    # limits it to the named indexes per collection
+    try:
+        diff = await diff_indexes()
+        for collection, changes in diff.items():
+            missing = changes["missing"]
+            if only is not None:
+                missing = [model for model in missing if model.document["name"] in only.get(collection, ())]
+            if missing:
+                await db[collection].create_indexes(missing)
+                logger.info(f"Created indexes on {collection}: {[m.document['name'] for m in missing]}")
+            if changes["changed"] and only is None:
+                logger.warning(f"Indexes on {collection} differ from the registry, run 'python -m app.indexes apply'")
+    except Exception as e:
+        # e.g. duplicate emails stored before the unique index, the app still starts
+        logger.error(f"Error ensuring indexes: {e}")
+
+
+async def ensure_required_indexes():
+    # Awaited by the lifespan before it yields, on an existing database it is a no-op
+    await ensure_indexes(REQUIRED_INDEXES)
+
+
+def start_index_build() -> asyncio.Task:
+    # The others are built in the background so startup does not wait on them
+    return asyncio.create_task(ensure_indexes())
+
+
+def plan_stages(plan) -> List[str]:
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages += plan_stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            stages += plan_stages(item)
+    return stages
+
+
+async def explain_query_shapes() -> List[dict]:
+    results = []
+    for shape in QUERY_SHAPES:
+        command = {"find": shape.collection, "filter": shape.filter}
+        if shape.sort:
+            command["sort"] = dict(shape.sort)
+
+        explanation = await db.command({"explain": command, "verbosity": "queryPlanner"})
+        stages = plan_stages(explanation["queryPlanner"]["winningPlan"])
+        results.append({"shape": shape, "stages": stages, "collscan": "COLLSCAN" in stages})
+
+    return results
+
+
+async def run_cli(command: str, drop_extra: bool = False) -> int:
+    if command == "explain":
+        results = await explain_query_shapes()
+        for result in results:
+            flag = "COLLSCAN" if result["collscan"] else "ok"
+            print(f"[{flag}] {result['shape'].collection} {result['shape'].filter} -> {' > '.join(result['stages'])}")
+        return 1 if any(result["collscan"] for result in results) else 0
+
+    diff = await apply_indexes(drop_extra) if command == "apply" else await diff_indexes()
+    for collection, changes in diff.items():
+        for model in changes["missing"]:
+            print(f"{collection}: + {model.document['name']}")
+        for model in changes["changed"]:
+            print(f"{collection}: ~ {model.document['name']}")
+        for name in changes["extra"]:
+            print(f"{collection}: {'-' if drop_extra else '?'} {name}")
+
+    if command == "diff":
+        return 1 if any(changes["missing"] or changes["changed"] for changes in diff.values()) else 0
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Diff, apply and check the MongoDB index registry")
+    parser.add_argument("command", choices=["diff", "apply", "explain"])
+    parser.add_argument("--drop-extra", action="store_true", help="Drop indexes that are not in the registry")
+    args = parser.parse_args()
+
+    raise SystemExit(asyncio.run(run_cli(args.command, args.drop_extra)))
+
+
+if __name__ == "__main__":
+    main()
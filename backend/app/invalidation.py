@@ -0,0 +1,183 @@
+"""
+Cross-worker cache invalidation.
+
+The caches live in each worker process: the encoded breach catalog and its search
+index, the HIBP data classes and the admin recipients. A worker that changes the data
+behind one of them updates its own copy and publishes the cache key on a capped MongoDB
+collection. Every worker tails that collection and drops its copy as soon as the
+message arrives, so all workers and nodes converge within milliseconds and no short TTL
+is needed to bound staleness.
+
+Messages are read again from a little before the last one seen whenever the cursor is
+reopened (ObjectIds of different nodes only order by their clocks), duplicates are
+skipped. Without a capped collection (in-memory test databases) the bus polls instead.
+"""
+import asyncio
+import logging
+import uuid
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Deque, Dict, List, Optional, Set
+
+from bson import ObjectId
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid
+
+from app.config import InvalidationSettings, get_invalidation_settings
+from app.db import db
+from app.metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+# Cache keys
+BREACH_CATALOG = "breach_catalog"
+DATA_CLASSES = "data_classes"
+ADMIN_RECIPIENTS = "admin_recipients"
+
+INVALIDATIONS = Counter("cache_invalidations_total", "Cache invalidations by key and direction", ("key", "direction"))
+INVALIDATION_LAG = Histogram(
+    "cache_invalidation_lag_seconds",
+    "Time from an invalidation being published to this worker applying it",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+
+
+class InvalidationBus:
+    """
+    Publishes cache keys to the other workers and applies the keys they publish.
+    """
+
+    def __init__(self, settings: Optional[InvalidationSettings] = None):
+        self._settings = settings
+        # Messages of this worker are skipped, it invalidated its own caches already
+        self.origin = uuid.uuid4().hex
+        self._handlers: Dict[str, List[Callable[[], None]]] = {}
+        self._recent: Deque[ObjectId] = deque()
+        self._recent_ids: Set[ObjectId] = set()
+        self._task: Optional[asyncio.Task] = None
+        self.tailable = False
+
+    @property
+    def settings(self) -> InvalidationSettings:
+        return self._settings or get_invalidation_settings()
+
+    @property
+    def collection(self):
+        return db[self.settings.collection]
+
+    def subscribe(self, key: str, handler: Callable[[], None]):
+        """
+        Run ``handler`` when another worker publishes ``key``. Handlers only drop local
+        state, they must not block.
+        """
+        self._handlers.setdefault(key, []).append(handler)
+
+    async def publish(self, key: str):
+        """
+        Tell the other workers ``key`` changed. The caller has updated its own caches.
+        """
+        if not self.settings.enabled:
+            return
+        try:
+            await self.collection.insert_one({"key": key, "origin": self.origin, "published_at": datetime.utcnow()})
+        except Exception as e:
+            # The other workers keep their copy until their TTL, if any, runs out
+            logger.error(f"Could not publish the invalidation of {key}: {e}")
+            return
+        INVALIDATIONS.labels(key, "published").inc()
+
+    def apply(self, message: dict) -> bool:
+        message_id = message["_id"]
+        if message_id in self._recent_ids:
+            return False
+        self._remember(message_id)
+        if message.get("origin") == self.origin:
+            return False
+
+        key = message["key"]
+        for handler in self._handlers.get(key, []):
+            try:
+                handler()
+            except Exception as e:
+                logger.error(f"Invalidation handler of {key} failed: {e}")
+        INVALIDATIONS.labels(key, "received").inc()
+        published_at = message.get("published_at")
+        if published_at is not None:
+            INVALIDATION_LAG.observe(max(0.0, (datetime.utcnow() - published_at).total_seconds()))
+        return True
+
+    def _remember(self, message_id: ObjectId):
+        self._recent.append(message_id)
+        self._recent_ids.add(message_id)
+        while len(self._recent) > self.settings.max_messages:
+            self._recent_ids.discard(self._recent.popleft())
+
+    async def ensure_collection(self) -> bool:
+        """
+        Create the capped collection, returning whether it can be tailed.
+        """
+        settings = self.settings
+        try:
+            await db.create_collection(settings.collection, capped=True, size=settings.size_bytes, max=settings.max_messages)
+            return True
+        except CollectionInvalid:
+            # Created by another worker
+            options = await self.collection.options()
+            return bool(options.get("capped"))
+        except Exception as e:
+            logger.warning(f"Cannot create the capped {settings.collection} collection, polling it instead: {e}")
+            return False
+
+    def _since(self, published: datetime) -> ObjectId:
+        # Nodes whose clocks lag ours still publish ObjectIds older than our newest one
+        return ObjectId.from_datetime(published - timedelta(seconds=self.settings.clock_skew_seconds))
+
+    async def read(self, since: ObjectId) -> ObjectId:
+        """
+        Apply the messages from ``since`` until the cursor runs out (or, for a tailable
+        cursor, dies), returning where to continue from.
+        """
+        query = {"_id": {"$gte": since}}
+        if self.tailable:
+            cursor = self.collection.find(query, cursor_type=CursorType.TAILABLE_AWAIT)
+            cursor = cursor.max_await_time_ms(self.settings.await_ms)
+        else:
+            cursor = self.collection.find(query).sort("_id", 1)
+
+        while True:
+            async for message in cursor:
+                self.apply(message)
+                since = max(since, self._since(message["_id"].generation_time))
+            # An awaiting cursor stops iterating after an empty wait but stays open
+            if not getattr(cursor, "alive", False):
+                return since
+
+    async def run(self):
+        self.tailable = await self.ensure_collection()
+        since = self._since(datetime.now(timezone.utc))
+        while True:
+            try:
+                since = await self.read(since)
+            except Exception as e:
+                logger.error(f"Error reading cache invalidations: {e}")
+            # A tailable cursor dies on an empty collection, the polling one each pass
+            await asyncio.sleep(self.settings.poll_seconds)
+
+    def start(self) -> Optional[asyncio.Task]:
+        if not self.settings.enabled:
+            return None
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+        return self._task
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+invalidation_bus = InvalidationBus()
@@ -0,0 +1,324 @@
+"""
+Non-blocking structured logging.
+
+A log call on the event loop only renders the message and puts the record on an
+in-memory queue; a listener thread writes it to stderr as one JSON line. When the
+queue is full, records are dropped and counted rather than blocking a request. Every
+record carries the request id, route template and user of the request it was logged
+from, kept in a contextvar set by LogContextMiddleware (background jobs and Motor's
+executor threads inherit it).
+
+Levels can be set per module, and info logs of busy loggers sampled:
+
+    LOG_LEVEL=INFO LOG_LEVELS="app.db_monitoring=DEBUG,app.routes=WARNING"
+    LOG_SAMPLE="uvicorn.access=0.1"
+
+Loggers below their level return before a record is created, so debug calls are free
+when disabled as long as they pass arguments (``logger.debug("x %s", value)``) rather
+than pre-formatted f-strings.
+"""
+import copy
+import logging
+import logging.handlers
+import queue
+import re
+import time
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+import orjson
+
+from app.config import LoggingSettings, get_logging_settings
+from app.metrics import Counter
+
+RECORDS_DROPPED = Counter("log_records_dropped_total", "Log records dropped because the log queue was full")
+
+# Attributes of every LogRecord, anything else was passed in ``extra`` (uvicorn adds a
+# colored copy of its messages, not wanted in JSON)
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {
+    "message", "request_id", "route", "user_id", "color_message",
+}
+
+# Request ids accepted from the client or the proxy in front
+REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s"
+
+EXCEPTION_FORMATTER = logging.Formatter()
+
+
+class RequestContext:
+    """
+    The request a log record belongs to. The user is bound once the token is verified.
+    """
+
+    __slots__ = ("request_id", "scope", "user_id")
+
+    def __init__(self, request_id: str, scope: Optional[dict] = None, user_id: Optional[str] = None):
+        self.request_id = request_id
+        self.scope = scope
+        self.user_id = user_id
+
+    @property
+    def route(self) -> Optional[str]:
+        # The router stores the matched route in the scope before the endpoint runs
+        route = self.scope.get("route") if self.scope else None
+        return route.path if route is not None else None
+
+
+current_request: ContextVar[Optional[RequestContext]] = ContextVar("current_request", default=None)
+
+
+def bind_user(user_id: str):
+    context = current_request.get()
+    if context is not None:
+        context.user_id = user_id
+
+
+def parse_pairs(value: str) -> Dict[str, str]:
+    # "app.db=DEBUG, uvicorn.access=WARNING" -> {"app.db": "DEBUG", "uvicorn.access": "WARNING"}
+    pairs = {}
+    for item in value.split(","):
+        if item.strip():
+            name, _, setting = item.partition("=")
+            pairs[name.strip()] = setting.strip()
+    return pairs
+
+
+# -------------------------- Filters and formatters --------------------------
+
+class ContextFilter(logging.Filter):
+    """
+    Copies the request context onto the record. Runs in the thread that logged, the
+    listener thread has no context.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = current_request.get()
+        if context is None:
+            record.request_id = record.route = record.user_id = None
+        else:
+            record.request_id = context.request_id
+            record.route = context.route
+            record.user_id = context.user_id
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps a fraction of the records below WARNING of the configured loggers (and their
+    children). Every n-th record is kept rather than a random one, so the rate is exact
+    over short windows.
+    """
+
+    def __init__(self, rates: Optional[Dict[str, float]] = None):
+        super().__init__()
+        self.rates = {name: min(max(float(rate), 0.0), 1.0) for name, rate in (rates or {}).items()}
+        self._seen: Dict[str, int] = {}
+
+    def rate_for(self, name: str) -> Optional[str]:
+        # The most specific configured logger
+        while name:
+            if name in self.rates:
+                return name
+            name = name.rpartition(".")[0]
+        return None
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        name = self.rate_for(record.name)
+        if name is None:
+            return True
+        rate = self.rates[name]
+        seen = self._seen.get(name, 0) + 1
+        self._seen[name] = seen
+        return int(seen * rate) != int((seen - 1) * rate)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key in ("request_id", "route", "user_id"):
+            value = getattr(record, key, None)
+            if value is not None:
+                entry[key] = value
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return orjson.dumps(entry, default=str).decode()
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__(TEXT_FORMAT)
+
+    def format(self, record: logging.LogRecord) -> str:
+        if getattr(record, "request_id", None) is None:
+            record.request_id = "-"
+        return super().format(record)
+
+
+# -------------------------- Queue --------------------------
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    """
+    Puts records on the queue without ever blocking, dropping them when it is full.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Arguments and tracebacks are rendered in the thread that logged, the objects
+        # they refer to may have changed by the time the listener writes the record
+        record = copy.copy(record)
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = record.exc_text or EXCEPTION_FORMATTER.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            RECORDS_DROPPED.inc()
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def queue_handler(queue_size: int = 10_000, output_format: str = "json") -> LogQueueHandler:
+    """
+    Handler factory for ``logging.config.dictConfig``. Starts the listener thread that
+    writes the queued records to stderr.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+    log_queue = queue.Queue(maxsize=queue_size)
+    output = logging.StreamHandler()
+    output.setFormatter(JsonFormatter() if output_format == "json" else TextFormatter())
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=False)
+    _listener.start()
+    return LogQueueHandler(log_queue)
+
+
+def flush_logging(timeout: float = 2.0):
+    """
+    Wait until the listener wrote the queued records. Worker processes exit without
+    running atexit handlers, so the lifespan calls this last.
+    """
+    if _listener is None:
+        return
+    deadline = time.monotonic() + timeout
+    while _listener.queue.unfinished_tasks and time.monotonic() < deadline:
+        time.sleep(0.005)
+
+
+def stop_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def logging_config(settings: Optional[LoggingSettings] = None) -> dict:
+    """
+    ``dictConfig`` configuration of the pipeline, passed to uvicorn as its log config
+    so every worker process sets it up before the app is imported.
+    """
+    settings = settings or get_logging_settings()
+    sample = {name: float(rate) for name, rate in parse_pairs(settings.sample).items()}
+    # uvicorn's loggers lose their own handlers and go through the queue like any other
+    loggers = {name: {"propagate": True} for name in ("uvicorn", "uvicorn.error", "uvicorn.access")}
+    for name, level in parse_pairs(settings.levels).items():
+        loggers.setdefault(name, {})["level"] = level.upper()
+    return {
+        "version": 1,
+        "disable_existing_loggers": False,
+        "filters": {
+            "context": {"()": ContextFilter},
+            "sample": {"()": SamplingFilter, "rates": sample},
+        },
+        "handlers": {
+            "queue": {
+                "()": queue_handler,
+                "queue_size": settings.queue_size,
+                "output_format": settings.format,
+                "filters": ["sample", "context"],
+            },
+        },
+        "loggers": loggers,
+        "root": {"level": settings.level.upper(), "handlers": ["queue"]},
+    }
+
+
+def configure_logging(settings: Optional[LoggingSettings] = None):
+    import atexit
+    import logging.config
+
+    logging.config.dictConfig(logging_config(settings))
+    atexit.register(stop_logging)
+
+
+def ensure_logging(settings: Optional[LoggingSettings] = None) -> bool:
+    """
+    Install the pipeline unless it is running already, returning whether it was
+    installed here. ``python -m app.serve`` hands it to uvicorn as its log config; the
+    lifespan calls this so ``uvicorn app.main:app --reload`` and other entry points get
+    it as well, without configuring a worker twice.
+    """
+    if _listener is not None:
+        return False
+    configure_logging(settings)
+    return True
+
+
+# -------------------------- Middleware --------------------------
+
+class LogContextMiddleware:
+    """
+    ASGI middleware giving every request an id (the client's X-Request-ID when it sends
+    a usable one), returned in the X-Request-ID response header and logged with every
+    record of the request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope.get("headers", []):
+            if name == b"x-request-id":
+                value = value.decode("latin-1")
+                request_id = value if REQUEST_ID_PATTERN.match(value) else None
+                break
+        context = RequestContext(request_id or uuid.uuid4().hex, scope)
+        token = current_request.set(context)
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"x-request-id", context.request_id.encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            current_request.reset(token)
@@ -0,0 +1,248 @@
+"""
+Brute-force throttling for ``/login``.
+
+Failed attempts are counted in sliding windows per email and per client IP. Past a few
+free failures every further attempt has to wait a doubling delay, and past the lockout
+threshold the key is locked out for a while. Throttled attempts are rejected with 429
+before the user is looked up, so they cost no bcrypt verification and send no OTP
+email; OTP emails per address are capped the same way.
+
+Every attempt is counted when it is checked, atomically with reading the count, so a
+concurrent burst sees the attempts still in flight and is rejected like a sequential
+one. Attempts that turn out not to be failures (a login, an OTP sent) are taken back.
+
+Counters live in process memory by default. With several workers set
+``LOGIN_THROTTLE_STORE=mongo`` so they share one count in the ``login_throttle``
+collection (expired by a TTL index).
+"""
+import math
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from fastapi import HTTPException, Request
+from pymongo import ReturnDocument, UpdateOne
+
+from app.config import LoginThrottleSettings, get_login_throttle_settings
+from app.db import db
+from app.metrics import Counter
+
+LOGIN_REJECTED = Counter(
+    "login_attempts_rejected_total",
+    "Login attempts rejected by the throttle before any password check",
+    ("scope", "reason"),
+)
+LOGIN_FAILURES = Counter("login_failures_total", "Failed login attempts", ("reason",))
+
+
+class MemoryThrottleStore:
+    """
+    Attempt timestamps per key, for a single worker. The least recently used keys are
+    dropped past ``max_keys`` so a spray of addresses cannot grow it without bound.
+    """
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._hits: "OrderedDict[str, List[float]]" = OrderedDict()
+
+    async def hits(self, keys: List[str], since: float) -> Dict[str, List[float]]:
+        found = {}
+        for key in keys:
+            hits = [hit for hit in self._hits.get(key, ()) if hit >= since]
+            if hits:
+                self._hits[key] = hits
+            else:
+                self._hits.pop(key, None)
+            found[key] = hits
+        return found
+
+    async def add(self, keys: List[str], now: float, window: float, limit: int):
+        for key in keys:
+            hits = self._hits.pop(key, [])
+            hits.append(now)
+            self._hits[key] = hits[-limit:]
+        while len(self._hits) > self.max_keys:
+            self._hits.popitem(last=False)
+
+    async def reserve(self, keys: List[str], now: float, since: float, limit: int) -> Dict[str, List[float]]:
+        # No await between reading and adding, the event loop makes it atomic
+        prior = {key: list(hits) for key, hits in (await self.hits(keys, since)).items()}
+        await self.add(keys, now, now - since, limit)
+        return prior
+
+    async def remove(self, keys: List[str], hit: float):
+        for key in keys:
+            hits = self._hits.get(key)
+            if hits and hit in hits:
+                hits.remove(hit)
+
+    async def clear(self, key: str):
+        self._hits.pop(key, None)
+
+
+class MongoThrottleStore:
+    """
+    Attempt timestamps shared by all workers, one document per key.
+    """
+
+    def __init__(self, collection: str = "login_throttle"):
+        self.collection = collection
+
+    async def hits(self, keys: List[str], since: float) -> Dict[str, List[float]]:
+        found = {key: [] for key in keys}
+        async for document in db[self.collection].find({"_id": {"$in": keys}}):
+            found[document["_id"]] = [hit for hit in document.get("hits", []) if hit >= since]
+        return found
+
+    async def add(self, keys: List[str], now: float, window: float, limit: int):
+        expires_at = datetime.utcnow() + timedelta(seconds=window)
+        await db[self.collection].bulk_write([
+            UpdateOne(
+                {"_id": key},
+                {"$push": {"hits": {"$each": [now], "$slice": -limit}}, "$set": {"expires_at": expires_at}},
+                upsert=True,
+            )
+            for key in keys
+        ], ordered=False)
+
+    async def reserve(self, keys: List[str], now: float, since: float, limit: int) -> Dict[str, List[float]]:
+        # The document returned by the update holds the hits pushed before this one
+        expires_at = datetime.utcnow() + timedelta(seconds=now - since)
+        prior = {}
+        for key in keys:
+            document = await db[self.collection].find_one_and_update(
+                {"_id": key},
+                {"$push": {"hits": {"$each": [now], "$slice": -limit}}, "$set": {"expires_at": expires_at}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+            prior[key] = [hit for hit in document["hits"][:-1] if hit >= since]
+        return prior
+
+    async def remove(self, keys: List[str], hit: float):
+        await db[self.collection].update_many({"_id": {"$in": keys}}, {"$pull": {"hits": hit}})
+
+    async def clear(self, key: str):
+        await db[self.collection].delete_one({"_id": key})
+
+
+def retry_delay(hits: List[float], now: float, free: int, lockout: int,
+                settings: LoginThrottleSettings) -> Tuple[float, Optional[str]]:
+    """
+    Seconds the next attempt has to wait given the failures in the window, and why.
+    """
+    if len(hits) >= lockout:
+        wait = settings.lockout_seconds - (now - hits[-1])
+        return (wait, "lockout") if wait > 0 else (0.0, None)
+    if len(hits) > free:
+        delay = min(settings.max_delay_seconds, settings.base_delay_seconds * 2 ** (len(hits) - free - 1))
+        wait = delay - (now - hits[-1])
+        return (wait, "delay") if wait > 0 else (0.0, None)
+    return 0.0, None
+
+
+class LoginAttempt(NamedTuple):
+    # Counted under these keys at this time until it is taken back
+    keys: Dict[str, str]
+    at: float
+
+
+class LoginThrottle:
+    def __init__(self, settings: LoginThrottleSettings, store=None):
+        self.settings = settings
+        if store is None:
+            store = MongoThrottleStore() if settings.store == "mongo" else MemoryThrottleStore(settings.max_keys)
+        self.store = store
+
+    @property
+    def history_limit(self) -> int:
+        # Hits beyond the largest threshold never change a decision
+        return max(self.settings.email_lockout, self.settings.ip_lockout, self.settings.otp_emails_per_window) + 1
+
+    def keys(self, email: str, ip: Optional[str]) -> Dict[str, str]:
+        keys = {"email": f"email:{email.strip().lower()}"}
+        if ip:
+            keys["ip"] = f"ip:{ip}"
+        return keys
+
+    async def check(self, email: str, ip: Optional[str], sends_otp: bool = False) -> Optional[LoginAttempt]:
+        """
+        Count the attempt, raising 429 if the email or IP has to wait given the failures
+        and attempts in flight before it, or if the address already received its share
+        of OTP emails. Runs before the user lookup and bcrypt.
+
+        The attempt stays counted as a failure unless record_success or release takes it
+        back, so one that errors out counts too.
+        """
+        settings = self.settings
+        if not settings.enabled:
+            return None
+        now = time.time()
+        since = now - settings.window_seconds
+        keys = self.keys(email, ip)
+        hits = await self.store.reserve(list(keys.values()), now, since, self.history_limit)
+        otp_key = f"otp:{email.strip().lower()}"
+        if sends_otp:
+            hits.update(await self.store.hits([otp_key], since))
+
+        waits = []
+        for scope, free, lockout in (
+            ("email", settings.email_free_failures, settings.email_lockout),
+            ("ip", settings.ip_free_failures, settings.ip_lockout),
+        ):
+            if scope in keys:
+                wait, reason = retry_delay(hits[keys[scope]], now, free, lockout, settings)
+                if reason:
+                    waits.append((wait, scope, reason))
+        if sends_otp and len(hits[otp_key]) >= settings.otp_emails_per_window:
+            # Until the oldest counted email leaves the window
+            oldest = hits[otp_key][-settings.otp_emails_per_window]
+            waits.append((oldest + settings.window_seconds - now, "email", "otp_quota"))
+
+        if waits:
+            # A rejected attempt is not a failure, the wait does not grow with retries
+            await self.store.remove(list(keys.values()), now)
+            wait, scope, reason = max(waits)
+            LOGIN_REJECTED.labels(scope, reason).inc()
+            retry_after = max(1, math.ceil(wait))
+            raise HTTPException(
+                status_code=429,
+                detail=f"Too many login attempts. Please try again in {retry_after} seconds.",
+                headers={"Retry-After": str(retry_after)},
+            )
+        return LoginAttempt(keys, now)
+
+    async def record_failure(self, attempt: Optional[LoginAttempt], reason: str):
+        # The attempt was counted by check, it stays
+        LOGIN_FAILURES.labels(reason).inc()
+
+    async def record_success(self, attempt: Optional[LoginAttempt]):
+        # A completed login clears the failures of the address, not those of the IP
+        if attempt is not None:
+            await self.store.clear(attempt.keys["email"])
+            await self.release(attempt)
+
+    async def release(self, attempt: Optional[LoginAttempt]):
+        # The attempt was not a failure (e.g. the password was right and an OTP sent)
+        if attempt is not None:
+            await self.store.remove(list(attempt.keys.values()), attempt.at)
+
+    async def record_otp_sent(self, email: str):
+        if self.settings.enabled:
+            await self.store.add([f"otp:{email.strip().lower()}"], time.time(), self.settings.window_seconds, self.history_limit)
+
+
+_login_throttle: Optional[LoginThrottle] = None
+
+
+def get_login_throttle() -> LoginThrottle:
+    global _login_throttle
+    if _login_throttle is None:
+        _login_throttle = LoginThrottle(get_login_throttle_settings())
+    return _login_throttle
+
+
+def client_ip(request: Request) -> Optional[str]:
+    # Behind a proxy this relies on the server trusting its forwarded headers
+    return request.client.host if request.client else None
@@ -1,8 +1,21 @@
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from app.routes import login_routes, report_routes, upload_routes, home_routes, admin_routes
+from fastapi.middleware.gzip import GZipMiddleware
+from app.routes import login_routes, report_routes, upload_routes, home_routes, admin_routes, analytics_routes, metrics_routes, lookup_routes
 from app.db import connect_to_mongo, close_mongo_connection
+from app.indexes import ensure_required_indexes, start_index_build
+from app.thumbnails import shutdown_preview_pool
+from app.notifications import verification_digest
+from app.hibp_client import get_hibp_client, close_hibp_client
+from app.shutdown import shutdown_coordinator
+from app.invalidation import invalidation_bus
+from app.config import get_database_settings, get_profiling_settings, get_id_upload_settings
+from app.db_monitoring import DbStatsMiddleware
+from app.metrics import MetricsMiddleware
+from app.profiling import ProfilingMiddleware
+from app.log_pipeline import LogContextMiddleware, ensure_logging, flush_logging
+from app.serialization import GZIP_MIN_SIZE, GZIP_LEVEL
 from fastapi.staticfiles import StaticFiles
 import os
 from dotenv import load_dotenv
@@ -11,30 +24,44 @@ load_dotenv()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    # Everything the app needs is created here rather than on import, so importing the
+    # app stays cheap. Runs in every worker: each gets its own MongoDB pool and HIBP
+    # connections.
+    # The entry point may have set up the log pipeline already (python -m app.serve)
+    ensure_logging()
+    os.makedirs(get_id_upload_settings().dir, exist_ok=True)
+    os.makedirs(get_id_upload_settings().preview_dir, exist_ok=True)
     await connect_to_mongo()
+    get_hibp_client()
+    # The unique email index is built before serving, the other registry indexes in
+    # the background so startup does not wait on them
+    await ensure_required_indexes()
+    index_build = start_index_build()
+    # Sends the admins a digest of ID uploads every interval or once enough are pending
+    verification_digest.start()
+    # Cache invalidations published by the other workers and nodes
+    invalidation_bus.start()
+    # Jobs checkpointed by workers that shut down earlier are picked up again
+    resume = shutdown_coordinator.start()
     yield
+    # Background jobs finish, or are checkpointed at the deadline, while the database,
+    # HIBP client and preview pool they use are still open
+    resume.cancel()
+    await shutdown_coordinator.drain()
+    await invalidation_bus.stop()
+    index_build.cancel()
+    await verification_digest.stop()
+    shutdown_preview_pool()
+    await close_hibp_client()
     await close_mongo_connection()
+    # Workers exit without atexit handlers, queued log records are written out first
+    flush_logging()
 
 app = FastAPI(lifespan=lifespan)
 
-# Get the absolute path to the 'backend' directory
-backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-
-# Define the path to the 'uploaded_ids' directory inside 'backend'
-uploaded_ids_dir = os.path.join(backend_dir, "uploaded_ids")
-
-# Check if the 'uploaded_ids' directory exists, and create it if it doesn't
-if not os.path.isdir(uploaded_ids_dir):
-    try:
-        os.makedirs(uploaded_ids_dir)
-        print(f"The 'uploaded_ids' directory has been created at: {uploaded_ids_dir}")
-    except OSError as e:
-        print(f"Error creating 'uploaded_ids' directory: {e}")
-else:
-    print(f"The 'uploaded_ids' directory already exists at: {uploaded_ids_dir}")
-
-# Mount the directory to serve the files under the /uploaded_ids endpoint
-app.mount("/uploaded_ids", StaticFiles(directory=uploaded_ids_dir), name="uploaded_ids")
+# Serve the 'uploaded_ids' directory ('backend/uploaded_ids' unless ID_UPLOAD_DIR is set)
+# under /uploaded_ids, it is created in the lifespan
+app.mount("/uploaded_ids", StaticFiles(directory=get_id_upload_settings().dir, check_dir=False), name="uploaded_ids")
 
 app.add_middleware(
     CORSMiddleware,
@@ -42,11 +69,38 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-DB-Time", "X-DB-Round-Trips", "X-Profile-Id", "ETag", "X-Request-ID", "X-Lookup-Job"],
+)
+
+# cProfile and span breakdown of admin-requested (X-Profile: 1) or sampled requests,
+# inside DbStatsMiddleware so the MongoDB time of the request is known
+profiling_settings = get_profiling_settings()
+app.add_middleware(
+    ProfilingMiddleware,
+    sample_rate=profiling_settings.sample_rate,
+    buffer_size=profiling_settings.buffer_size,
+    top_functions=profiling_settings.top_functions,
 )
 
+# Attributes MongoDB commands to the request that issued them
+app.add_middleware(DbStatsMiddleware, debug_headers=get_database_settings().debug_headers)
+
+# Compresses large responses that are not already pre-gzipped (cached payloads are)
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MIN_SIZE, compresslevel=GZIP_LEVEL)
+
+# Request counts, latency and sizes per route, served on /metrics
+app.add_middleware(MetricsMiddleware)
+
+# Request id, route and user of every log record, outermost so all other middleware logs
+# with them
+app.add_middleware(LogContextMiddleware)
+
 # Include your routes
 app.include_router(login_routes.router)
 app.include_router(report_routes.router)
 app.include_router(upload_routes.router)
 app.include_router(home_routes.router)
 app.include_router(admin_routes.router)
+app.include_router(analytics_routes.router)
+app.include_router(metrics_routes.router)
+app.include_router(lookup_routes.router)
@@ -0,0 +1,274 @@
+"""
+In-process metrics in the Prometheus text exposition format.
+
+Metrics are plain Python objects kept in a module-level registry and rendered on
+/metrics, no client library or external service is needed. They are updated from the
+event loop and from the Motor executor threads, so every series guards its state with
+a lock.
+"""
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, List, Tuple
+
+# Latency buckets in seconds, from 1ms to 10s
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Payload size buckets in bytes, from 256B to 64MB
+SIZE_BUCKETS = tuple(256 * 4 ** exponent for exponent in range(10))
+
+REGISTRY: List["Metric"] = []
+
+
+class CounterSeries:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+
+class GaugeSeries(CounterSeries):
+    def dec(self, amount: float = 1.0):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float):
+        with self._lock:
+            self.value = value
+
+
+class HistogramSeries:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def quantile(self, q: float) -> float:
+        # Estimated by linear interpolation inside the bucket holding the q-th observation
+        with self._lock:
+            counts = list(self.counts)
+            total = self.count
+        if total == 0:
+            return 0.0
+
+        rank = q * total
+        seen = 0
+        for index, count in enumerate(counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "p50": round(self.quantile(0.5), 6),
+            "p95": round(self.quantile(0.95), 6),
+            "p99": round(self.quantile(0.99), 6),
+        }
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._series: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _new_series(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        key = tuple(str(value) for value in values)
+        series = self._series.get(key)
+        if series is None:
+            with self._lock:
+                series = self._series.setdefault(key, self._new_series())
+        return series
+
+    def series(self) -> List[Tuple[Dict[str, str], object]]:
+        with self._lock:
+            items = list(self._series.items())
+        return [(dict(zip(self.labelnames, key)), series) for key, series in items]
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for labels, series in self.series():
+            lines.append(f"{self.name}{format_labels(labels)} {format_value(series.value)}")
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def _new_series(self):
+        return CounterSeries()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def _new_series(self):
+        return GaugeSeries()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self.labels().dec(amount)
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labelnames)
+
+    def _new_series(self):
+        return HistogramSeries(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def snapshot(self) -> List[dict]:
+        return [{"labels": labels, **series.snapshot()} for labels, series in self.series()]
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for labels, series in self.series():
+            with series._lock:
+                counts = list(series.counts)
+                total, count = series.sum, series.count
+
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                bucket_labels = format_labels({**labels, "le": format_value(bound)})
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(labels)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(labels)} {count}")
+        return lines
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def escape_label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label_value(value)}"' for name, value in labels.items()) + "}"
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+# -------------------------- HTTP metrics --------------------------
+
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests by route template and status", ("method", "route", "status"))
+HTTP_REQUEST_DURATION = Histogram("http_request_duration_seconds", "HTTP request latency", ("method", "route"))
+HTTP_REQUESTS_IN_PROGRESS = Gauge("http_requests_in_progress", "HTTP requests being served", ("method",))
+HTTP_RESPONSE_SIZE = Histogram("http_response_size_bytes", "HTTP response body size", ("method", "route"), buckets=SIZE_BUCKETS)
+
+# -------------------------- Application metrics --------------------------
+
+HIBP_REQUEST_DURATION = Histogram("hibp_request_duration_seconds", "HIBP API call latency", ("endpoint", "status"))
+HIBP_RATE_LIMIT_WAIT = Histogram("hibp_rate_limit_wait_seconds", "Time spent waiting on HIBP rate limits", ("endpoint",))
+PDF_RENDER_DURATION = Histogram("pdf_render_duration_seconds", "Time spent rendering PDF reports")
+UPLOAD_BYTES = Counter("upload_bytes_total", "Bytes received in data uploads")
+UPLOAD_RECORDS = Counter("upload_records_processed_total", "Records kept after processing data uploads")
+BACKGROUND_JOBS = Gauge("background_jobs_queued", "Background jobs queued or running", ("job",))
+
+
+def queued_job(name: str, func):
+    """
+    Wrap a background task so it is counted in the job queue depth until it finishes.
+    """
+    series = BACKGROUND_JOBS.labels(name)
+    series.inc()
+
+    async def run(*args, **kwargs):
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            series.dec()
+
+    return run
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording request counts, latency, in-flight requests and response
+    sizes per route template (never the raw path, so ids do not explode cardinality).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        in_progress = HTTP_REQUESTS_IN_PROGRESS.labels(method)
+        in_progress.inc()
+        start = time.perf_counter()
+        status = 500
+        size = 0
+
+        async def send_with_metrics(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            route = scope.get("route")
+            route_path = route.path if route is not None else "unmatched"
+            HTTP_REQUESTS.labels(method, route_path, status).inc()
+            HTTP_REQUEST_DURATION.labels(method, route_path).observe(time.perf_counter() - start)
+            HTTP_RESPONSE_SIZE.labels(method, route_path).observe(size)
+            in_progress.dec()
@@ -0,0 +1,90 @@
+"""
+One-shot migration that folds the embedded ``users.uploaded_data`` arrays into
+``db.uploads`` and removes them from the user documents.
+
+Users are streamed in batches and every batch is written with two bulk_writes, so the
+migration can be interrupted and re-run safely.
+
+    python -m app.migrations.move_uploaded_data [--batch-size 200] [--dry-run]
+"""
+import argparse
+import asyncio
+from typing import List, Tuple
+from pymongo import UpdateOne
+from app.db import db, bulk_write_options
+
+DEFAULT_BATCH_SIZE = 200
+
+
+def plan_batch(users: List[dict]) -> Tuple[List[UpdateOne], List[UpdateOne]]:
+    upload_ops = []
+    user_ops = []
+
+    for user in users:
+        for entry in user.get("uploaded_data") or []:
+            if not entry.get("upload_id"):
+                continue
+
+            # The user array was the only place the processed flag lived, never lower it
+            upload_ops.append(
+                UpdateOne(
+                    {"_id": entry["upload_id"], "user_id": user["_id"]},
+                    {"$max": {"processed": bool(entry.get("processed", False))}},
+                )
+            )
+
+        user_ops.append(UpdateOne({"_id": user["_id"]}, {"$unset": {"uploaded_data": ""}}))
+
+    return upload_ops, user_ops
+
+
+async def migrate_batch(users: List[dict], dry_run: bool = False) -> int:
+    upload_ops, user_ops = plan_batch(users)
+
+    if not dry_run:
+        # Uploads first, so an interrupted batch still has its arrays to migrate from
+        if upload_ops:
+            await db.uploads.with_options(**bulk_write_options()).bulk_write(upload_ops, ordered=False)
+        if user_ops:
+            await db.users.with_options(**bulk_write_options()).bulk_write(user_ops, ordered=False)
+
+    return len(upload_ops)
+
+
+async def migrate(batch_size: int = DEFAULT_BATCH_SIZE, dry_run: bool = False):
+    cursor = db.users.find(
+        {"uploaded_data": {"$exists": True}},
+        {"uploaded_data.upload_id": 1, "uploaded_data.processed": 1},
+    ).batch_size(batch_size)
+
+    users_migrated = 0
+    uploads_migrated = 0
+    batch = []
+
+    async for user in cursor:
+        batch.append(user)
+        if len(batch) >= batch_size:
+            uploads_migrated += await migrate_batch(batch, dry_run)
+            users_migrated += len(batch)
+            print(f"Migrated {users_migrated} users ({uploads_migrated} uploads)")
+            batch = []
+
+    if batch:
+        uploads_migrated += await migrate_batch(batch, dry_run)
+        users_migrated += len(batch)
+
+    action = "Would migrate" if dry_run else "Migrated"
+    print(f"{action} {users_migrated} users and {uploads_migrated} uploads")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move users.uploaded_data into the uploads collection")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--dry-run", action="store_true", help="Count what would be migrated without writing")
+    args = parser.parse_args()
+
+    asyncio.run(migrate(args.batch_size, args.dry_run))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,23 @@
+from pydantic import BaseModel, Field
+from typing import List
+
+# Upper bound on the number of users a single bulk request may touch
+MAX_BULK_USERS = 1000
+
+class AdminStatusChange(BaseModel):
+    user_id: str
+    admin: bool
+
+class VerifyStatusChange(BaseModel):
+    user_id: str
+    verified: bool
+
+class BulkAdminStatusUpdate(BaseModel):
+    updates: List[AdminStatusChange] = Field(min_length=1, max_length=MAX_BULK_USERS)
+
+class BulkVerifyStatusUpdate(BaseModel):
+    updates: List[VerifyStatusChange] = Field(min_length=1, max_length=MAX_BULK_USERS)
+    notify: bool = False  # Send the "Account Verified" email to newly verified users
+
+class BulkVerifiedEmailRequest(BaseModel):
+    user_ids: List[str] = Field(min_length=1, max_length=MAX_BULK_USERS)
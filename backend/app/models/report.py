@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional, Union
+from typing import Any, Dict, List, Optional, Union
 from datetime import datetime
 
 class RequestData(BaseModel):
@@ -13,6 +13,7 @@ class UserReport(BaseModel):
     Name: str
     Email: str
     ReportGeneratedAt: str = Field(default_factory=lambda: datetime.utcnow().date().isoformat())
-    Report: Union[str, List[str]]
+    # HIBP lists breaches as {"Name": ...} objects, a clean account gets a message
+    Report: Union[str, List[Dict[str, Any]], List[str]]
 
 
@@ -0,0 +1,180 @@
+"""
+Digests of ID uploads awaiting verification.
+
+An ID upload only records a verification event here. Events are collected and sent to
+the admins as one digest email, either when the digest interval elapses or as soon as
+enough events are pending, so onboarding waves do not flood admin inboxes and uploads
+never wait on SMTP. Events that cannot be sent before shutdown are checkpointed and
+added to the digest of the next worker. The admin recipient list is cached and dropped
+in every worker whenever an admin status changes.
+"""
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from app.config import NotificationSettings, get_notification_settings
+from app.db import db
+from app.invalidation import ADMIN_RECIPIENTS, invalidation_bus
+from app.metrics import Counter, Gauge
+from app.otp_service import notify_admins_of_verification
+from app.shutdown import shutdown_coordinator
+
+logger = logging.getLogger(__name__)
+
+PENDING_EVENTS = Gauge("verification_events_pending", "ID uploads waiting for the next admin digest")
+DIGESTS_SENT = Counter("verification_digests_sent_total", "Admin verification digests by outcome", ("status",))
+
+DEFERRED_JOB = "verification_digest"
+
+
+class AdminRecipients:
+    """
+    Admin email addresses, loaded once and kept until an admin status changes in any
+    worker or the TTL (a safety net for a missed invalidation) expires.
+    """
+
+    def __init__(self, ttl: Optional[float] = None):
+        self.ttl = ttl
+        self._emails: Optional[List[str]] = None
+        self._loaded_at = 0.0
+        self._generation = 0
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        self._generation += 1
+        self._emails = None
+
+    def _fresh(self) -> bool:
+        ttl = self.ttl if self.ttl is not None else get_notification_settings().admin_cache_ttl_seconds
+        return self._emails is not None and time.monotonic() - self._loaded_at < ttl
+
+    async def get(self) -> List[str]:
+        if self._fresh():
+            return self._emails
+
+        async with self._lock:
+            if self._fresh():
+                return self._emails
+            generation = self._generation
+            admins = await db.users.find({"user_type": "admin"}, {"_id": 0, "email": 1}).to_list(None)
+            emails = [admin["email"] for admin in admins if admin.get("email")]
+            # A status change while loading makes the result stale, it is not cached
+            if generation == self._generation:
+                self._emails = emails
+                self._loaded_at = time.monotonic()
+            return emails
+
+
+admin_recipients = AdminRecipients()
+invalidation_bus.subscribe(ADMIN_RECIPIENTS, admin_recipients.invalidate)
+
+
+class VerificationDigest:
+    """
+    Pending verification events, flushed as one digest email by a background task.
+    """
+
+    def __init__(self, send: Callable[[List[str], List[str]], Awaitable[None]],
+                 recipients: AdminRecipients, settings: Optional[NotificationSettings] = None):
+        self._send = send
+        self._recipients = recipients
+        self._settings = settings
+        # Users with a pending upload, in upload order, each listed once
+        self._pending: Dict[str, None] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def settings(self) -> NotificationSettings:
+        return self._settings or get_notification_settings()
+
+    @property
+    def pending(self) -> List[str]:
+        return list(self._pending)
+
+    def add(self, user_email: str):
+        # Called from the request, never blocks
+        self._pending.setdefault(user_email)
+        PENDING_EVENTS.set(len(self._pending))
+        if self._wakeup is not None and len(self._pending) >= self.settings.digest_max_events:
+            self._wakeup.set()
+
+    def _restore(self, batch: Dict[str, None]):
+        # Back in front of the uploads that arrived in the meantime
+        batch.update(self._pending)
+        self._pending = batch
+        PENDING_EVENTS.set(len(self._pending))
+
+    async def flush(self) -> int:
+        """
+        Send the pending events as one digest, returning how many were sent. Events of a
+        digest that failed, had no admin to go to or was cancelled are kept for the next
+        attempt.
+        """
+        if not self._pending:
+            return 0
+        batch, self._pending = self._pending, {}
+        PENDING_EVENTS.set(0)
+
+        try:
+            admins = await self._recipients.get()
+            if not admins:
+                logger.warning(f"No admins to notify of {len(batch)} ID uploads, keeping them for the next digest")
+                DIGESTS_SENT.labels("no_recipients").inc()
+                self._restore(batch)
+                return 0
+            await self._send(admins, list(batch))
+        except Exception as e:
+            logger.error(f"Error sending the verification digest of {len(batch)} ID uploads: {e}")
+            DIGESTS_SENT.labels("error").inc()
+            self._restore(batch)
+            return 0
+        except BaseException:
+            # Cancelled mid-send at shutdown, stop() sends or checkpoints the batch
+            self._restore(batch)
+            raise
+
+        DIGESTS_SENT.labels("sent").inc()
+        return len(batch)
+
+    async def run(self):
+        self._wakeup = asyncio.Event()
+        if len(self._pending) >= self.settings.digest_max_events:
+            self._wakeup.set()
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.settings.digest_interval_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self) -> asyncio.Task:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+        return self._task
+
+    async def stop(self):
+        # Pending events are sent before shutdown rather than dropped, or checkpointed
+        # when the digest cannot go out
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        if self._pending:
+            if await shutdown_coordinator.defer(DEFERRED_JOB, [self.pending]):
+                self._pending = {}
+                PENDING_EVENTS.set(0)
+
+    async def requeue(self, user_emails: List[str]):
+        for user_email in user_emails:
+            self.add(user_email)
+
+
+verification_digest = VerificationDigest(notify_admins_of_verification, admin_recipients)
+shutdown_coordinator.resumable(DEFERRED_JOB, verification_digest.requeue)
@@ -1,8 +1,11 @@
-from fastapi_mail import FastMail, MessageSchema
 from pydantic import EmailStr
-from .config import conf  # Email configuration
+from .config import get_mail_config  # Email configuration
 import pyotp
+from html import escape
 from app.db import db
+import logging
+
+logger = logging.getLogger(__name__)
 
 # Generate or retrieve a user's secret key
 async def get_or_create_secret_key(user_email: str):
@@ -21,49 +24,47 @@ async def generate_otp(user_email: str):
     totp = pyotp.TOTP(secret_key)  # Initialize TOTP with the user's secret key
     return totp.now()  # Generate the current time-based OTP
 
-# Send the OTP via email
-async def send_otp_email(email: EmailStr, otp:str):
+# Send one html email, fastapi_mail is only imported when the first email goes out
+async def send_email(subject: str, recipients: list, body: str):
+    from fastapi_mail import FastMail, MessageSchema
+
     message = MessageSchema(
-        subject="Your OTP Code for Spearow authentication",
-        recipients=[email],
-        body=f"Your OTP code is: {otp}",
+        subject=subject,
+        recipients=recipients,
+        body=body,
         subtype="html"
     )
 
-    fm = FastMail(conf)
+    fm = FastMail(get_mail_config())
     await fm.send_message(message)
 
+# Send the OTP via email
+async def send_otp_email(email: EmailStr, otp:str):
+    await send_email("Your OTP Code for Spearow authentication", [email], f"Your OTP code is: {otp}")
+
 async def send_verified_email(email: EmailStr):
-    message = MessageSchema(
-        subject="Account Verified",
-        recipients=[email],
-        body=f"Your Spearow Account has been Verified! Login with your details to Generate a custom Report of your account breaches!",
-        subtype="html",
-    )
+    await send_email("Account Verified", [email], f"Your Spearow Account has been Verified! Login with your details to Generate a custom Report of your account breaches!")
 
-    fm = FastMail(conf)
-    await fm.send_message(message)
+# send the verified email to a batch of users, one failed address does not stop the rest
+async def send_verified_emails(emails: list):
+    for email in emails:
+        try:
+            await send_verified_email(email)
+        except Exception as e:
+            logger.error(f"Error sending verified email to {email}: {e}")
 
 # send email to user when a report generated on their behalf
 async def send_report_generated_email(email: EmailStr):
-    message = MessageSchema(
-        subject="Report Generate",
-        recipients=[email],
-        body=f"A report has been generated on your behalf.",
-        subtype="html",
-    )
-
-    fm = FastMail(conf)
-    await fm.send_message(message)
+    await send_email("Report Generate", [email], f"A report has been generated on your behalf.")
 
-# send a report to all admins when an unverified user uploads an ID
-async def notify_admins_of_verification(admin_emails: list, user_email: str):
-    message = MessageSchema(
-        subject="User Verification Needed",
-        recipients=admin_emails,
-        body=f"The user with email {user_email} needs to be verified. Please log in to the system to review.",
-        subtype="html"
-    )
+# send a digest to all admins of the users that uploaded an ID since the last one
+async def notify_admins_of_verification(admin_emails: list, user_emails: list):
+    if len(user_emails) == 1:
+        subject = "User Verification Needed"
+        body = f"The user with email {user_emails[0]} needs to be verified. Please log in to the system to review."
+    else:
+        subject = f"{len(user_emails)} Users Need Verification"
+        listed = "".join(f"<li>{escape(email)}</li>" for email in user_emails)
+        body = f"The following users uploaded an ID and need to be verified:<ul>{listed}</ul>Please log in to the system to review."
 
-    fm = FastMail(conf)
-    await fm.send_message(message)
\ No newline at end of file
+    await send_email(subject, admin_emails, body)
\ No newline at end of file
@@ -0,0 +1,257 @@
+"""
+Opt-in per-request profiling.
+
+A request is profiled when an admin sends the ``X-Profile: 1`` header, or when it is
+picked by the sampling rate (PROFILE_SAMPLE_RATE). The request runs under cProfile and
+its time is broken down into spans: auth, db (from the command monitor), hibp, render,
+parse and serialise. Finished profiles are kept in a bounded ring buffer served to
+admins on /admin/profiles.
+
+cProfile is per thread and only one profiler can run at a time, so a single request is
+profiled at once and requests arriving meanwhile run normally. Work of other requests
+interleaved on the event loop shows up in the cProfile output, spans only count the
+profiled request; MongoDB commands run on Motor's executor threads and are covered by
+the db span only.
+"""
+import cProfile
+import io
+import logging
+import marshal
+import pstats
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException
+from app.db import db
+from app.db_monitoring import current_db_stats
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = b"x-profile"
+PROFILE_ID_HEADER = b"x-profile-id"
+
+# Paths that are never sampled, profiling them only adds noise
+UNPROFILED_PATHS = ("/metrics", "/admin/profiles")
+
+# Response encoding happens inside FastAPI and Starlette, its time is read from cProfile
+SERIALISE_FUNCTIONS = {
+    ("fastapi/routing.py", "serialize_response"),
+    ("starlette/responses.py", "render"),
+}
+
+
+class RequestProfile:
+    __slots__ = ("spans",)
+
+    def __init__(self):
+        self.spans: Dict[str, float] = {}
+
+    def add(self, name: str, duration: float):
+        self.spans[name] = self.spans.get(name, 0.0) + duration
+
+
+current_profile: ContextVar[Optional[RequestProfile]] = ContextVar("current_profile", default=None)
+
+
+@contextmanager
+def span(name: str):
+    """
+    Time a block of work of the current request under ``name``. A no-op unless the
+    request is being profiled.
+    """
+    profile = current_profile.get()
+    if profile is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add(name, time.perf_counter() - start)
+
+
+class ProfileBuffer:
+    """
+    Ring buffer of the most recent profiles, the oldest is dropped when full.
+    """
+
+    def __init__(self, capacity: int = 20):
+        self.capacity = capacity
+        self._profiles: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, profile: dict):
+        with self._lock:
+            self._profiles[profile["id"]] = profile
+            while len(self._profiles) > self.capacity:
+                self._profiles.popitem(last=False)
+
+    def get(self, profile_id: str) -> Optional[dict]:
+        with self._lock:
+            return self._profiles.get(profile_id)
+
+    def summaries(self) -> List[dict]:
+        # Newest first, without the cProfile output
+        with self._lock:
+            profiles = list(self._profiles.values())
+        return [
+            {key: value for key, value in profile.items() if key not in ("functions", "stats")}
+            for profile in reversed(profiles)
+        ]
+
+    def clear(self):
+        with self._lock:
+            self._profiles.clear()
+
+
+profile_buffer = ProfileBuffer()
+
+
+def function_label(key) -> str:
+    filename, line, name = key
+    return f"{filename}:{line}({name})" if line else name
+
+
+def top_functions(stats: pstats.Stats, limit: int) -> List[dict]:
+    entries = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+    return [
+        {
+            "function": function_label(key),
+            "calls": calls,
+            "total_ms": round(total * 1000, 3),
+            "cumulative_ms": round(cumulative * 1000, 3),
+        }
+        for key, (_, calls, total, cumulative, _) in entries
+    ]
+
+
+def serialise_time(stats: pstats.Stats) -> float:
+    total = 0.0
+    for (filename, _, name), (_, _, _, cumulative, _) in stats.stats.items():
+        if any(filename.endswith(suffix) and name == function for suffix, function in SERIALISE_FUNCTIONS):
+            total += cumulative
+    return total
+
+
+async def is_admin_request(scope) -> bool:
+    # Imported here, app.auth imports span from this module
+    from app.auth import verify_token
+
+    headers = dict(scope.get("headers") or [])
+    authorization = headers.get(b"authorization", b"").decode("latin-1")
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return False
+    try:
+        email = verify_token(token)
+    except HTTPException:
+        return False
+    user = await db.users.find_one({"email": email}, {"user_type": 1})
+    return bool(user) and user.get("user_type") == "admin"
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware profiling admin-requested (``X-Profile: 1``) or sampled requests.
+
+    Profiled responses carry an X-Profile-Id header with the id to look up on
+    /admin/profiles/{id}.
+    """
+
+    def __init__(self, app, sample_rate: float = 0.0, buffer_size: int = 20, top_functions: int = 40,
+                 buffer: ProfileBuffer = profile_buffer):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.top_functions = top_functions
+        self.buffer = buffer
+        self.buffer.capacity = buffer_size
+        self._active = threading.Lock()
+
+    async def trigger(self, scope) -> Optional[str]:
+        if scope["path"].startswith(UNPROFILED_PATHS):
+            return None
+        headers = dict(scope.get("headers") or [])
+        if headers.get(PROFILE_HEADER, b"").strip() in (b"1", b"true"):
+            return "header" if await is_admin_request(scope) else None
+        if self.sample_rate and random.random() < self.sample_rate:
+            return "sample"
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trigger = await self.trigger(scope)
+        if trigger is None or not self._active.acquire(blocking=False):
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = uuid.uuid4().hex
+        request_profile = RequestProfile()
+        token = current_profile.set(request_profile)
+        db_stats = current_db_stats.get()
+        db_time_before = db_stats.duration if db_stats else 0.0
+        round_trips_before = db_stats.round_trips if db_stats else 0
+        status = 500
+
+        async def send_with_profile_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message = {**message, "headers": list(message.get("headers", [])) + [(PROFILE_ID_HEADER, profile_id.encode())]}
+            await send(message)
+
+        profiler = cProfile.Profile()
+        started_at = datetime.utcnow()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            profiler.disable()
+            duration = time.perf_counter() - start
+            current_profile.reset(token)
+            self._active.release()
+            try:
+                self.store(scope, profile_id, trigger, status, started_at, duration, profiler, request_profile,
+                           (db_stats.duration - db_time_before) if db_stats else 0.0,
+                           (db_stats.round_trips - round_trips_before) if db_stats else 0)
+            except Exception as e:
+                logger.error(f"Could not store profile {profile_id}: {e}")
+
+    def store(self, scope, profile_id, trigger, status, started_at, duration, profiler, request_profile, db_time, round_trips):
+        profiler.create_stats()
+        stats = pstats.Stats(profiler, stream=io.StringIO())
+
+        spans = dict(request_profile.spans)
+        spans["db"] = db_time
+        serialise = serialise_time(stats)
+        if serialise:
+            spans["serialise"] = spans.get("serialise", 0.0) + serialise
+        spans["other"] = max(0.0, duration - sum(spans.values()))
+
+        route = scope.get("route")
+        self.buffer.add({
+            "id": profile_id,
+            "method": scope["method"],
+            "path": scope["path"],
+            "route": route.path if route is not None else "unmatched",
+            "status": status,
+            "trigger": trigger,
+            "started_at": started_at.isoformat() + "Z",
+            "duration_ms": round(duration * 1000, 3),
+            "db_round_trips": round_trips,
+            "spans_ms": {name: round(value * 1000, 3) for name, value in spans.items()},
+            "functions": top_functions(stats, self.top_functions),
+            # Raw stats in the pstats file format, for snakeviz or pstats.Stats
+            "stats": marshal.dumps(profiler.stats),
+        })
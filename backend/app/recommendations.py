@@ -0,0 +1,232 @@
+"""
+Security recommendations of user reports.
+
+Each HIBP data class maps to remediation steps (exposed passwords to changing them and
+turning on two-factor authentication, phone numbers to a carrier PIN, and so on). The
+ids of the steps every breach calls for are computed once per catalog sync and stored
+in ``breach_recommendations``. A report only unions the cached ids of the user's
+breaches, no rules run per request.
+
+Deployments whose catalog was synced before recommendations existed fill the collection
+with:
+
+    python -m app.recommendations refresh
+"""
+import argparse
+import asyncio
+from datetime import datetime
+from typing import Dict, FrozenSet, Iterable, List, Optional
+
+from pymongo import ReplaceOne
+from app.db import db, connect_to_mongo, close_mongo_connection
+from app.invalidation import BREACH_CATALOG, invalidation_bus
+
+BREACH_RECOMMENDATIONS = "breach_recommendations"
+
+# Recommendation ids with their title and advice, most urgent first (reports list them
+# in this order)
+RECOMMENDATIONS = {
+    "change-passwords": (
+        "Change exposed passwords",
+        "Change the password of the breached account and of every other account that used the same or a similar one.",
+    ),
+    "revoke-sessions": (
+        "Sign out other sessions",
+        "Sign out of all sessions and revoke connected apps on the breached service, leaked tokens stay valid until then.",
+    ),
+    "contact-bank": (
+        "Contact your bank",
+        "Ask your bank to replace the exposed cards or accounts and watch your statements for payments you did not make.",
+    ),
+    "credit-freeze": (
+        "Freeze your credit",
+        "Place a credit freeze or fraud alert with the credit bureaus so no one can open accounts in your name.",
+    ),
+    "identity-documents": (
+        "Report exposed identity documents",
+        "Tell the issuing authority about exposed ID or passport numbers and ask whether they should be replaced.",
+    ),
+    "security-questions": (
+        "Replace security answers",
+        "Change your security questions and answers, use random answers kept in a password manager.",
+    ),
+    "enable-2fa": (
+        "Turn on two-factor authentication",
+        "Use an authenticator app or a security key rather than SMS codes on every account that supports it.",
+    ),
+    "password-manager": (
+        "Use a password manager",
+        "Give every site its own generated password so one breach cannot unlock your other accounts.",
+    ),
+    "sim-pin": (
+        "Protect your phone number",
+        "Set a PIN or port-out lock with your carrier and be wary of unexpected calls and texts.",
+    ),
+    "health-data": (
+        "Check your health insurance statements",
+        "Look for treatments or claims you did not make and report them to your insurer.",
+    ),
+    "private-messages": (
+        "Review exposed conversations",
+        "Assume the leaked messages are public and warn the people they concern.",
+    ),
+    "sensitive-breach": (
+        "Review accounts on sensitive sites",
+        "The breached site is flagged as sensitive, remove personal details from the account or close it.",
+    ),
+    "phishing": (
+        "Watch for phishing",
+        "Expect emails and messages quoting the breached data, do not follow links or open attachments you did not expect.",
+    ),
+    "location-privacy": (
+        "Review location sharing",
+        "Turn off location sharing you do not need, the breach exposed where you were.",
+    ),
+    "review-account": (
+        "Review the breached account",
+        "Check the account for changes you did not make, or delete it if you no longer use it.",
+    ),
+}
+PRIORITY = {recommendation: position for position, recommendation in enumerate(RECOMMENDATIONS)}
+
+DATA_CLASS_RECOMMENDATIONS = {
+    "Passwords": ("change-passwords", "enable-2fa", "password-manager"),
+    "Password hints": ("change-passwords", "password-manager"),
+    "Auth tokens": ("revoke-sessions", "enable-2fa"),
+    "Security questions and answers": ("security-questions",),
+    "Credit cards": ("contact-bank",),
+    "Partial credit card data": ("contact-bank", "phishing"),
+    "Bank account numbers": ("contact-bank",),
+    "Social security numbers": ("credit-freeze", "identity-documents"),
+    "Government issued IDs": ("identity-documents", "credit-freeze"),
+    "Passport numbers": ("identity-documents",),
+    "Phone numbers": ("sim-pin", "phishing"),
+    "Health insurance information": ("health-data",),
+    "Private messages": ("private-messages",),
+    "Email addresses": ("phishing",),
+    "Physical addresses": ("phishing",),
+    "Dates of birth": ("phishing",),
+    "Geographic locations": ("location-privacy",),
+}
+# Every breach, including the ones the catalog does not hold (yet)
+BASELINE = frozenset({"review-account"})
+
+CATALOG_PROJECTION = {"_id": 0, "Name": 1, "DataClasses": 1, "IsSensitive": 1}
+
+
+def recommendations_for_breach(breach: dict) -> List[str]:
+    recommendations = set(BASELINE)
+    for data_class in breach.get("DataClasses") or []:
+        recommendations.update(DATA_CLASS_RECOMMENDATIONS.get(data_class, ()))
+    if breach.get("IsSensitive"):
+        recommendations.add("sensitive-breach")
+    return sorted(recommendations, key=PRIORITY.__getitem__)
+
+
+async def refresh_breach_recommendations(breaches: Optional[Iterable[dict]] = None):
+    """
+    Recompute the recommendations of ``breaches`` (just synced from HIBP), or of the
+    whole catalog by default. Called before the other workers are told about the sync,
+    so they reload the new recommendations.
+    """
+    started = datetime.utcnow()
+    full = breaches is None
+    if full:
+        # From the primary, the sync has just written the catalog
+        breaches = await db.breaches.find({}, CATALOG_PROJECTION).to_list(None)
+
+    # The catalog can hold repeated inserts of the same breach, later ones win
+    by_name = {breach["Name"]: breach for breach in breaches if breach.get("Name")}
+    if by_name:
+        await db[BREACH_RECOMMENDATIONS].bulk_write(
+            [
+                ReplaceOne(
+                    {"_id": name},
+                    {"_id": name, "recommendations": recommendations_for_breach(breach), "updated_at": started},
+                    upsert=True,
+                )
+                for name, breach in by_name.items()
+            ],
+            ordered=False,
+        )
+    if full:
+        await db[BREACH_RECOMMENDATIONS].delete_many({"updated_at": {"$lt": started}})
+    breach_recommendations.invalidate()
+
+
+class BreachRecommendations:
+    """
+    Recommendation ids of every catalog breach, loaded once and kept until the catalog
+    is synced in any worker.
+    """
+
+    def __init__(self):
+        self._by_breach: Optional[Dict[str, FrozenSet[str]]] = None
+        self._generation = 0
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        self._generation += 1
+        self._by_breach = None
+
+    async def get(self) -> Dict[str, FrozenSet[str]]:
+        if self._by_breach is not None:
+            return self._by_breach
+
+        async with self._lock:
+            if self._by_breach is not None:
+                return self._by_breach
+            generation = self._generation
+            documents = await db[BREACH_RECOMMENDATIONS].find({}, {"recommendations": 1}).to_list(None)
+            by_breach = {document["_id"]: frozenset(document["recommendations"]) for document in documents}
+            # A sync while loading makes the result stale, it is not cached
+            if generation == self._generation:
+                self._by_breach = by_breach
+            return by_breach
+
+    async def for_breaches(self, names: Iterable[str]) -> List[str]:
+        """
+        Recommendation ids of a user's breaches, most urgent first.
+        """
+        names = list(names)
+        if not names:
+            return []
+        by_breach = await self.get()
+        return sorted(frozenset().union(*(by_breach.get(name, BASELINE) for name in names)), key=PRIORITY.__getitem__)
+
+
+breach_recommendations = BreachRecommendations()
+invalidation_bus.subscribe(BREACH_CATALOG, breach_recommendations.invalidate)
+
+
+def recommendation_fields(recommendations: List[str]) -> dict:
+    # Added to user reports, plain strings so the CSV export and the PDF list them as text
+    if not recommendations:
+        return {}
+    return {
+        "Recommendations": [
+            f"{RECOMMENDATIONS[recommendation][0]}: {RECOMMENDATIONS[recommendation][1]}"
+            for recommendation in recommendations
+        ],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Breach recommendations")
+    parser.add_argument("command", choices=["refresh"])
+    parser.parse_args()
+
+    async def run():
+        await connect_to_mongo()
+        try:
+            await refresh_breach_recommendations()
+            count = await db[BREACH_RECOMMENDATIONS].count_documents({})
+            print(f"Stored recommendations of {count} breaches")
+        finally:
+            await close_mongo_connection()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
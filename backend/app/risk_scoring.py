@@ -0,0 +1,349 @@
+"""
+Exposure risk scores of users.
+
+Every breach in the catalog gets a severity from the sensitivity of its data classes,
+how recent it is, whether HIBP verified it or flags it as sensitive, and how many
+accounts it exposed. A user's score (0-100) adds up the severities of their breaches.
+Both steps are matrix products over the whole user base:
+
+    severity = f(breaches x data classes @ class weights, recency, flags, reach)
+    exposure = users x breaches @ severity
+
+Scores are stored as compact summary documents in ``user_risk`` (one per scanned user,
+keyed by the user id) and shown in user reports and the admin directory. The catalog
+matrix is built once per catalog generation and dropped in every worker when the
+catalog changes. Users are rescored after their own rescan, and in a background job
+after catalog syncs; recency decays over time, so a periodic full pass keeps the scores
+current:
+
+    python -m app.risk_scoring rescore
+"""
+import argparse
+import asyncio
+import logging
+import math
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from pymongo import ReplaceOne
+from app.analytics_service import breach_names
+from app.db import db, report_read_options, connect_to_mongo, close_mongo_connection
+from app.invalidation import BREACH_CATALOG, invalidation_bus
+from app.shutdown import shutdown_coordinator
+
+logger = logging.getLogger(__name__)
+
+USER_RISK = "user_risk"
+
+# Sensitivity of each HIBP data class, 1.0 for data that enables account takeover or
+# fraud on its own. Classes not listed get DEFAULT_CLASS_WEIGHT.
+DATA_CLASS_WEIGHTS = {
+    "Passwords": 1.0,
+    "Auth tokens": 1.0,
+    "Credit cards": 1.0,
+    "Bank account numbers": 1.0,
+    "Social security numbers": 1.0,
+    "Government issued IDs": 1.0,
+    "Passport numbers": 1.0,
+    "Security questions and answers": 0.9,
+    "Partial credit card data": 0.8,
+    "Password hints": 0.7,
+    "Private messages": 0.7,
+    "Health insurance information": 0.7,
+    "Dates of birth": 0.5,
+    "Physical addresses": 0.5,
+    "Phone numbers": 0.5,
+    "Geographic locations": 0.3,
+    "IP addresses": 0.3,
+    "Genders": 0.1,
+    "Usernames": 0.2,
+    "Names": 0.2,
+    "Email addresses": 0.2,
+}
+DEFAULT_CLASS_WEIGHT = 0.3
+# Data classes at least this sensitive are listed on the summary
+SENSITIVE_CLASS_WEIGHT = 0.7
+
+# Breaches lose half their weight every RECENCY_HALF_LIFE_YEARS, down to RECENCY_FLOOR
+RECENCY_HALF_LIFE_YEARS = 3.0
+RECENCY_FLOOR = 0.2
+UNVERIFIED_FACTOR = 0.6
+SENSITIVE_BREACH_FACTOR = 1.5
+# Severity of breaches a user report names but the catalog does not hold (yet)
+UNKNOWN_BREACH_SEVERITY = 0.3
+# Exposure at which the score reaches 63 (1 - 1/e), scores approach 100 asymptotically
+SCORE_SCALE = 2.0
+LEVELS = ((75.0, "critical"), (50.0, "high"), (25.0, "medium"), (0.0, "low"))
+TOP_BREACHES = 3
+
+# Users scored per matrix, bounds the dense users x breaches block
+CHUNK_SIZE = 2000
+
+# A cached catalog matrix is rebuilt at least this often, its recency factors age
+MATRIX_MAX_AGE_SECONDS = 24 * 3600
+
+RESCORE_JOB = "rescore_users"
+
+CATALOG_PROJECTION = {"_id": 0, "Name": 1, "DataClasses": 1, "BreachDate": 1, "IsVerified": 1, "IsSensitive": 1, "PwnCount": 1}
+USER_PROJECTION = {"email": 1, "breaches.Report.Name": 1}
+
+
+class CatalogMatrix(NamedTuple):
+    names: List[str]
+    # Column of each breach name, unknown names use the last column
+    columns: Dict[str, int]
+    data_classes: List[str]
+    # breaches x data classes, 1 where the breach exposed the class (plus an empty row
+    # for unknown breaches)
+    exposure: "numpy.ndarray"
+    severity: "numpy.ndarray"
+
+
+def level_for(score: float) -> str:
+    for threshold, level in LEVELS:
+        if score >= threshold:
+            return level
+    return "low"
+
+
+def breach_year_fraction(breach_date, now: datetime) -> float:
+    # Age in years, unknown dates count as old
+    try:
+        breached = datetime.strptime(str(breach_date)[:10], "%Y-%m-%d")
+    except ValueError:
+        return 10 * RECENCY_HALF_LIFE_YEARS
+    return max(0.0, (now - breached).days / 365.25)
+
+
+def build_catalog_matrix(breaches: Iterable[dict], now: Optional[datetime] = None) -> CatalogMatrix:
+    import numpy as np
+
+    now = now or datetime.utcnow()
+    # The catalog can hold repeated inserts of the same breach, later ones win
+    by_name = {breach["Name"]: breach for breach in breaches if breach.get("Name")}
+    names = list(by_name)
+    columns = {name: position for position, name in enumerate(names)}
+    data_classes = sorted({data_class for breach in by_name.values() for data_class in breach.get("DataClasses") or []})
+    class_columns = {data_class: position for position, data_class in enumerate(data_classes)}
+
+    exposure = np.zeros((len(names) + 1, len(data_classes)), dtype=np.float32)
+    rows = [columns[breach["Name"]] for breach in by_name.values() for _ in breach.get("DataClasses") or []]
+    cols = [class_columns[data_class] for breach in by_name.values() for data_class in breach.get("DataClasses") or []]
+    exposure[rows, cols] = 1.0
+
+    weights = np.array([DATA_CLASS_WEIGHTS.get(data_class, DEFAULT_CLASS_WEIGHT) for data_class in data_classes], dtype=np.float32)
+    breaches = list(by_name.values())
+    age = np.array([breach_year_fraction(breach.get("BreachDate"), now) for breach in breaches], dtype=np.float32)
+    verified = np.array([bool(breach.get("IsVerified", True)) for breach in breaches])
+    sensitive = np.array([bool(breach.get("IsSensitive", False)) for breach in breaches])
+    pwn_count = np.array([float(breach.get("PwnCount") or 0) for breach in breaches], dtype=np.float64)
+
+    # Saturates, a breach of many minor classes stays below one of a few critical ones
+    data = 1.0 - np.exp(-(exposure[:-1] @ weights))
+    recency = RECENCY_FLOOR + (1.0 - RECENCY_FLOOR) * np.power(0.5, age / RECENCY_HALF_LIFE_YEARS)
+    reach = np.log1p(pwn_count) / math.log1p(max(pwn_count.max(initial=0.0), 1.0))
+    severity = (
+        data
+        * recency
+        * np.where(verified, 1.0, UNVERIFIED_FACTOR)
+        * np.where(sensitive, SENSITIVE_BREACH_FACTOR, 1.0)
+        * (0.75 + 0.25 * reach)
+    ).astype(np.float32)
+    severity = np.append(severity, np.float32(UNKNOWN_BREACH_SEVERITY))
+
+    return CatalogMatrix(names, columns, data_classes, exposure, severity)
+
+
+def score_users(users: List[dict], catalog: CatalogMatrix, now: Optional[datetime] = None) -> List[dict]:
+    """
+    Summary documents of one chunk of users, scored in one vectorised pass.
+    """
+    import numpy as np
+
+    now = now or datetime.utcnow()
+    unknown = len(catalog.names)
+    memberships = [sorted({catalog.columns.get(name, unknown) for name in breach_names(user.get("breaches"))}) for user in users]
+    # users x breaches, 1 where the user is in the breach
+    matrix = np.zeros((len(users), unknown + 1), dtype=np.float32)
+    rows = np.repeat(np.arange(len(users)), [len(columns) for columns in memberships])
+    matrix[rows, [column for columns in memberships for column in columns]] = 1.0
+
+    contributions = matrix * catalog.severity
+    exposure = contributions.sum(axis=1)
+    scores = 100.0 * (1.0 - np.exp(-exposure / SCORE_SCALE))
+    top = np.argsort(-contributions, axis=1)[:, :TOP_BREACHES]
+    # users x data classes, the classes each user had exposed anywhere
+    exposed_classes = (matrix @ catalog.exposure) > 0
+
+    sensitive_columns = [
+        position for position, data_class in sorted(
+            enumerate(catalog.data_classes), key=lambda item: -DATA_CLASS_WEIGHTS.get(item[1], DEFAULT_CLASS_WEIGHT)
+        )
+        if DATA_CLASS_WEIGHTS.get(data_class, DEFAULT_CLASS_WEIGHT) >= SENSITIVE_CLASS_WEIGHT
+    ]
+
+    summaries = []
+    for position, user in enumerate(users):
+        score = round(float(scores[position]), 1)
+        summaries.append({
+            "_id": user["_id"],
+            "email": user.get("email"),
+            "score": score,
+            "level": level_for(score),
+            "breaches": len(memberships[position]),
+            "top_breaches": [
+                catalog.names[column]
+                for column in top[position]
+                if contributions[position, column] > 0 and column != unknown
+            ],
+            "sensitive_data_classes": [
+                catalog.data_classes[column] for column in sensitive_columns if exposed_classes[position, column]
+            ],
+            "scored_at": now,
+        })
+    return summaries
+
+
+async def load_catalog_matrix(now: Optional[datetime] = None) -> CatalogMatrix:
+    breaches = await db.get_collection("breaches", **report_read_options()).find({}, CATALOG_PROJECTION).to_list(None)
+    # Thousands of breaches, built off the event loop
+    return await asyncio.to_thread(build_catalog_matrix, breaches, now)
+
+
+class CatalogMatrices:
+    """
+    The catalog matrix, built once and kept until a catalog sync in any worker drops it,
+    or until it is MATRIX_MAX_AGE_SECONDS old.
+    """
+
+    def __init__(self, max_age: float = MATRIX_MAX_AGE_SECONDS):
+        self.max_age = max_age
+        self._matrix: Optional[CatalogMatrix] = None
+        self._built_at = 0.0
+        self._generation = 0
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        self._generation += 1
+        self._matrix = None
+
+    def _fresh(self) -> bool:
+        return self._matrix is not None and time.monotonic() - self._built_at < self.max_age
+
+    async def get(self) -> CatalogMatrix:
+        if self._fresh():
+            return self._matrix
+
+        async with self._lock:
+            if self._fresh():
+                return self._matrix
+            generation = self._generation
+            matrix = await load_catalog_matrix()
+            # A catalog sync while building makes the matrix stale, it is not cached
+            if generation == self._generation:
+                self._matrix = matrix
+                self._built_at = time.monotonic()
+            return matrix
+
+
+catalog_matrices = CatalogMatrices()
+invalidation_bus.subscribe(BREACH_CATALOG, catalog_matrices.invalidate)
+
+
+async def refresh_risk_scores(query: Optional[dict] = None) -> int:
+    """
+    Rescore the scanned users matching ``query`` (all of them by default), returning
+    how many were scored.
+    """
+    now = datetime.utcnow()
+    catalog = await catalog_matrices.get()
+    cursor = db.users.find({**(query or {}), "breaches": {"$exists": True}}, USER_PROJECTION).batch_size(CHUNK_SIZE)
+
+    scored = 0
+    chunk: List[dict] = []
+    async for user in cursor:
+        chunk.append(user)
+        if len(chunk) == CHUNK_SIZE:
+            scored += await store_scores(chunk, catalog, now)
+            chunk = []
+    if chunk:
+        scored += await store_scores(chunk, catalog, now)
+    return scored
+
+
+async def store_scores(users: List[dict], catalog: CatalogMatrix, now: datetime) -> int:
+    # NumPy releases the GIL, large chunks do not hold up the event loop
+    summaries = await asyncio.to_thread(score_users, users, catalog, now)
+    await db[USER_RISK].bulk_write(
+        [ReplaceOne({"_id": summary["_id"]}, summary, upsert=True) for summary in summaries], ordered=False,
+    )
+    return len(summaries)
+
+
+async def rescore_breach_users(breach_name: Optional[str] = None) -> int:
+    """
+    Background job of a catalog sync: rescore the users in ``breach_name``, or every
+    scanned user after a full sync. Safe to repeat, so resumed after a shutdown.
+    """
+    return await refresh_risk_scores({"breaches.Report.Name": breach_name} if breach_name else None)
+
+
+shutdown_coordinator.resumable(RESCORE_JOB, rescore_breach_users)
+
+
+async def refresh_user_risk(user_id) -> Optional[dict]:
+    """
+    Rescore one user after their rescan, returning the new summary.
+    """
+    user = await db.users.find_one({"_id": user_id}, USER_PROJECTION)
+    if user is None or "breaches" not in user:
+        return None
+    now = datetime.utcnow()
+    catalog = await catalog_matrices.get()
+    summary = (await asyncio.to_thread(score_users, [user], catalog, now))[0]
+    await db[USER_RISK].replace_one({"_id": user_id}, summary, upsert=True)
+    return summary
+
+
+async def load_risk_summaries(user_ids: List) -> Dict:
+    if not user_ids:
+        return {}
+    summaries = await db[USER_RISK].find({"_id": {"$in": user_ids}}, {"score": 1, "level": 1}).to_list(None)
+    return {summary["_id"]: summary for summary in summaries}
+
+
+async def load_risk_summary(user_id) -> Optional[dict]:
+    return await db[USER_RISK].find_one({"_id": user_id})
+
+
+def report_fields(summary: Optional[dict]) -> dict:
+    # Added to user reports, flat so the CSV export gets one column each
+    if not summary:
+        return {}
+    return {
+        "RiskScore": summary["score"],
+        "RiskLevel": summary["level"],
+        "TopRisks": summary.get("top_breaches", []),
+        "ExposedSensitiveData": summary.get("sensitive_data_classes", []),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exposure risk scores")
+    parser.add_argument("command", choices=["rescore"])
+    parser.parse_args()
+
+    async def run():
+        await connect_to_mongo()
+        try:
+            scored = await refresh_risk_scores()
+            print(f"Scored {scored} users")
+        finally:
+            await close_mongo_connection()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,51 @@
 from datetime import timedelta
-from fastapi import APIRouter, HTTPException, Depends, Request
-from app.db import db
+from typing import List, Optional, Tuple
+from fastapi import APIRouter, HTTPException, Depends, Request, BackgroundTasks
+from app.db import db, bulk_write_options
 from app.models.report import RequestData
+from app.models.admin import BulkAdminStatusUpdate, BulkVerifyStatusUpdate, BulkVerifiedEmailRequest
 from app.routes.report_routes import generate_report_on_auth_user, generate_csv, generate_pdf
-from app.auth import create_access_token
+from app.auth import create_access_token, get_current_admin
+from app.log_pipeline import bind_user
 from jose import jwt
 from bson import ObjectId
-from ..otp_service import send_verified_email, send_report_generated_email
+from bson.errors import InvalidId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+import asyncio
+import re
+from ..shutdown import background_job, shutdown_coordinator
+from ..notifications import admin_recipients
+from ..invalidation import ADMIN_RECIPIENTS, invalidation_bus
+from ..risk_scoring import load_risk_summaries
+from ..otp_service import send_verified_email, send_verified_emails, send_report_generated_email
 
 router = APIRouter()
 
+# A batch cut off at shutdown is sent again in full, some users may get the email twice
+shutdown_coordinator.resumable("send_verified_emails", send_verified_emails)
+
+# Only the fields the admin user table shows
+DIRECTORY_PROJECTION = {"name": 1, "email": 1, "verified": 1, "user_type": 1, "id_file": 1, "id_preview": 1}
+
+MAX_DIRECTORY_PAGE = 200
+
+
+def directory_entry(user: dict, risk: Optional[dict] = None) -> dict:
+    return {
+        "name": user.get("name"),
+        "email": user.get("email"),
+        "verified": user.get("verified", False),
+        "admin": True if user.get("user_type") == "admin" else False,
+        "id": str(user.get("_id")),  # Convert ObjectId to string
+        # The list shows the small preview, the full-size file is opened on demand
+        "id_file": user.get("id_file"),
+        "id_preview": user.get("id_preview"),
+        # Unscanned users have no score yet
+        "risk_score": risk["score"] if risk else None,
+        "risk_level": risk["level"] if risk else None,
+    }
+
 
 @router.post("/user/{user_id}/send-verified-email")
 async def send_verified_email_endpoint(user_id: str, request: Request):
@@ -26,6 +62,7 @@ async def send_verified_email_endpoint(user_id: str, request: Request):
         admin_email = jwt.decode(
             token, key=None, algorithms=["HS256"], options={"verify_signature": False}
         ).get("sub")
+        bind_user(admin_email)
     except jwt.JWTError:
         raise HTTPException(status_code=403, detail="Invalid token")
 
@@ -60,6 +97,7 @@ async def fetch_user_data(request: Request):
         user_email = jwt.decode(
             token, key=None, algorithms=["HS256"], options={"verify_signature": False}
         ).get("sub")
+        bind_user(user_email)
 
     except jwt.JWTError:
         raise HTTPException(status_code=403, detail="Invalid token")
@@ -76,25 +114,69 @@ async def fetch_user_data(request: Request):
             status_code=403, detail="You do not have access to this resource"
         )
 
-    # Fetch all users' data from the database
-    users = await db.users.find().to_list(100)  # Limit to 100 users for performance
+    # Fetch the first users' data from the database, /admin/users pages through the rest
+    users = await db.users.find({}, DIRECTORY_PROJECTION).to_list(100)
+    risks = await load_risk_summaries([user["_id"] for user in users])
 
     # Prepare the data for response
-    users_data = [
-        {
-            "name": user.get("name"),
-            "email": user.get("email"),
-            "verified": user.get("verified", False),
-            "admin": True if user.get("user_type") == "admin" else False,
-            "id": str(user.get("_id")),  # Convert ObjectId to string
-            "id_file": user.get("id_file"),
-        }
-        for user in users
-    ]
+    users_data = [directory_entry(user, risks.get(user["_id"])) for user in users]
 
     return {"message": "User data fetched successfully", "users": users_data}
 
 
+@router.get("/admin/users")
+async def list_users(
+    q: Optional[str] = None,
+    verified: Optional[bool] = None,
+    admin: Optional[bool] = None,
+    has_id_file: Optional[bool] = None,
+    after: Optional[str] = None,
+    limit: int = 50,
+    admin_user: dict = Depends(get_current_admin),
+):
+    if limit < 1 or limit > MAX_DIRECTORY_PAGE:
+        raise HTTPException(status_code=400, detail=f"Limit must be between 1 and {MAX_DIRECTORY_PAGE}")
+
+    query = {}
+
+    # Prefix search, anchored so the email and name indexes can be used
+    if q:
+        prefix = "^" + re.escape(q)
+        query["$or"] = [{"email": {"$regex": prefix}}, {"name": {"$regex": prefix}}]
+        if q.lower() != q:
+            query["$or"].append({"email": {"$regex": "^" + re.escape(q.lower())}})
+
+    if verified is not None:
+        query["verified"] = True if verified else {"$ne": True}
+    if admin is not None:
+        query["user_type"] = "admin" if admin else {"$ne": "admin"}
+    if has_id_file is not None:
+        query["id_file"] = {"$exists": has_id_file}
+
+    # Keyset pagination on _id, the cursor is the last id of the previous page
+    page_query = dict(query)
+    if after:
+        try:
+            page_query["_id"] = {"$gt": ObjectId(after)}
+        except InvalidId:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    total, users = await asyncio.gather(
+        db.users.count_documents(query),
+        db.users.find(page_query, DIRECTORY_PROJECTION).sort("_id", 1).limit(limit + 1).to_list(None),
+    )
+
+    has_more = len(users) > limit
+    users = users[:limit]
+    risks = await load_risk_summaries([user["_id"] for user in users])
+
+    return {
+        "users": [directory_entry(user, risks.get(user["_id"])) for user in users],
+        "total": total,
+        "next_cursor": str(users[-1]["_id"]) if has_more else None,
+    }
+
+
 @router.post("/user-report")
 async def get_user_report(request: Request):
     data = await request.json()  # Get JSON data from the request body
@@ -117,6 +199,7 @@ async def get_user_report(request: Request):
         user_email = jwt.decode(
             token, key=None, algorithms=["HS256"], options={"verify_signature": False}
         ).get("sub")
+        bind_user(user_email)
     except jwt.JWTError:
         raise HTTPException(status_code=403, detail="Invalid token")
 
@@ -185,6 +268,7 @@ async def update_admin_status(user_id: str, request: Request):
         user_email = jwt.decode(
             token, key=None, algorithms=["HS256"], options={"verify_signature": False}
         ).get("sub")
+        bind_user(user_email)
     except jwt.JWTError:
         raise HTTPException(status_code=403, detail="Invalid token")
 
@@ -203,6 +287,8 @@ async def update_admin_status(user_id: str, request: Request):
         {"_id": ObjectId(user_id)},
         {"$set": {"user_type": "admin" if is_admin else "standard"}},
     )
+    admin_recipients.invalidate()
+    await invalidation_bus.publish(ADMIN_RECIPIENTS)
 
     return {"message": "Admin status updated successfully", "admin": is_admin}
 
@@ -229,6 +315,7 @@ async def update_verify_status(user_id: str, request: Request):
         user_email = jwt.decode(
             token, key=None, algorithms=["HS256"], options={"verify_signature": False}
         ).get("sub")
+        bind_user(user_email)
     except jwt.JWTError:
         raise HTTPException(status_code=403, detail="Invalid token")
 
@@ -252,10 +339,141 @@ async def update_verify_status(user_id: str, request: Request):
 
  # find all admins email addresses
 async def get_admin_emails():
-    # Fetch all users with user_type 'admin' and get their email addresses
-    admins = await db.users.find({"user_type": "admin"}, {"_id": 0, "email": 1}).to_list(None)
-    
-    # Extract email addresses into a list
-    email_list = [admin.get('email') for admin in admins]
+    # Cached, dropped whenever an admin status changes
+    return await admin_recipients.get()
+
+
+def user_key(user_id: str) -> str:
+    # Canonical form of a valid id, ObjectId hex is accepted in any case
+    return str(ObjectId(user_id))
+
+
+async def resolve_users(user_ids: List[str]) -> Tuple[List[dict], dict]:
+    """
+    Look up a batch of users in one query.
+
+    Returns one result per requested id, in order, plus the found users keyed by
+    ``user_key`` of the id. Ids that are malformed, repeated or unknown get their error
+    status here.
+    """
+    results = []
+    object_ids = []
+    seen = set()
+
+    for user_id in user_ids:
+        result = {"user_id": user_id, "status": "pending"}
+        try:
+            object_id = ObjectId(user_id)
+        except (InvalidId, TypeError):
+            result["status"] = "invalid_id"
+        else:
+            if object_id in seen:
+                result["status"] = "duplicate"
+            else:
+                seen.add(object_id)
+                object_ids.append(object_id)
+        results.append(result)
+
+    users = await db.users.find({"_id": {"$in": object_ids}}, {"email": 1, "verified": 1}).to_list(None)
+    users_by_id = {str(user["_id"]): user for user in users}
+
+    for result in results:
+        if result["status"] == "pending" and user_key(result["user_id"]) not in users_by_id:
+            result["status"] = "not_found"
+
+    return results, users_by_id
+
+
+async def bulk_update_users(changes: List[Tuple[str, dict]]) -> Tuple[List[dict], dict]:
+    """
+    Apply a ``$set`` per user in a single unordered bulk_write, with per-item results.
+    """
+    results, users_by_id = await resolve_users([user_id for user_id, _ in changes])
+
+    pending = [
+        (result, fields)
+        for result, (_, fields) in zip(results, changes)
+        if result["status"] == "pending"
+    ]
+
+    if pending:
+        operations = [UpdateOne({"_id": ObjectId(result["user_id"])}, {"$set": fields}) for result, fields in pending]
+        failed = {}
+        try:
+            await db.users.with_options(**bulk_write_options()).bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            failed = {error["index"]: error.get("errmsg", "Write failed") for error in e.details.get("writeErrors", [])}
+
+        for index, (result, _) in enumerate(pending):
+            if index in failed:
+                result["status"] = "error"
+                result["detail"] = failed[index]
+            else:
+                result["status"] = "updated"
+
+    return results, users_by_id
+
+
+def bulk_summary(message: str, results: List[dict], status: str = "updated") -> dict:
+    return {
+        "message": message,
+        "succeeded": sum(1 for result in results if result["status"] == status),
+        "failed": sum(1 for result in results if result["status"] != status),
+        "results": results,
+    }
+
+
+@router.patch("/users/admin-status")
+async def bulk_update_admin_status(data: BulkAdminStatusUpdate, admin_user: dict = Depends(get_current_admin)):
+    results, _ = await bulk_update_users(
+        [(change.user_id, {"user_type": "admin" if change.admin else "standard"}) for change in data.updates]
+    )
+    admin_recipients.invalidate()
+    await invalidation_bus.publish(ADMIN_RECIPIENTS)
+
+    return bulk_summary("Admin statuses updated", results)
+
+
+@router.patch("/users/verify-status")
+async def bulk_update_verify_status(
+    data: BulkVerifyStatusUpdate,
+    background_tasks: BackgroundTasks,
+    admin_user: dict = Depends(get_current_admin),
+):
+    results, users_by_id = await bulk_update_users(
+        [(change.user_id, {"verified": change.verified}) for change in data.updates]
+    )
 
-    return email_list
\ No newline at end of file
+    # Queue one batch of emails for the users that were just verified, not for those
+    # that already were
+    if data.notify:
+        emails = [
+            users_by_id[user_key(result["user_id"])]["email"]
+            for result, change in zip(results, data.updates)
+            if result["status"] == "updated" and change.verified
+            and not users_by_id[user_key(result["user_id"])].get("verified", False)
+        ]
+        if emails:
+            background_tasks.add_task(background_job("send_verified_emails", send_verified_emails), emails)
+
+    return bulk_summary("Verification statuses updated", results)
+
+
+@router.post("/users/send-verified-email")
+async def bulk_send_verified_email(
+    data: BulkVerifiedEmailRequest,
+    background_tasks: BackgroundTasks,
+    admin_user: dict = Depends(get_current_admin),
+):
+    results, users_by_id = await resolve_users(data.user_ids)
+
+    emails = []
+    for result in results:
+        if result["status"] == "pending":
+            result["status"] = "queued"
+            emails.append(users_by_id[user_key(result["user_id"])]["email"])
+
+    if emails:
+        background_tasks.add_task(background_job("send_verified_emails", send_verified_emails), emails)
+
+    return bulk_summary("Verification emails queued", results, status="queued")
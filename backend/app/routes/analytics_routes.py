@@ -0,0 +1,61 @@
+from fastapi import APIRouter, Depends, HTTPException
+from app.auth import get_current_admin
+from app.db import db, report_read_options
+from app.analytics_service import (
+    BREACHES_PER_YEAR,
+    DATA_CLASS_STATS,
+    BREACH_AFFECTED_USERS,
+    refresh_catalog_analytics,
+    refresh_affected_users,
+)
+
+router = APIRouter()
+
+MAX_LIMIT = 100
+
+
+def check_limit(limit: int):
+    if limit < 1 or limit > MAX_LIMIT:
+        raise HTTPException(status_code=400, detail=f"Limit must be between 1 and {MAX_LIMIT}")
+
+
+@router.get("/admin/analytics/breaches-per-year")
+async def breaches_per_year(admin: dict = Depends(get_current_admin)):
+    rows = await db.get_collection(BREACHES_PER_YEAR, **report_read_options()).find({}).sort("_id", 1).to_list(None)
+
+    return {
+        "years": [
+            {"year": row["_id"], "breaches": row["breaches"], "pwn_count": row["pwn_count"]}
+            for row in rows
+        ]
+    }
+
+
+@router.get("/admin/analytics/data-classes")
+async def top_data_classes(limit: int = 20, admin: dict = Depends(get_current_admin)):
+    check_limit(limit)
+    rows = await db.get_collection(DATA_CLASS_STATS, **report_read_options()).find({}).sort("pwn_count", -1).limit(limit).to_list(None)
+
+    return {
+        "data_classes": [
+            {"data_class": row["_id"], "breaches": row["breaches"], "pwn_count": row["pwn_count"]}
+            for row in rows
+        ]
+    }
+
+
+@router.get("/admin/analytics/affected-users")
+async def affected_users(limit: int = 20, admin: dict = Depends(get_current_admin)):
+    check_limit(limit)
+    rows = await db.get_collection(BREACH_AFFECTED_USERS, **report_read_options()).find({}).sort("users", -1).limit(limit).to_list(None)
+
+    return {"breaches": [{"name": row["_id"], "users": row["users"]} for row in rows]}
+
+
+@router.post("/admin/analytics/refresh")
+async def refresh_analytics(admin: dict = Depends(get_current_admin)):
+    # Full rebuild, normally the views are refreshed as the data changes
+    await refresh_catalog_analytics()
+    await refresh_affected_users()
+
+    return {"message": "Analytics refreshed successfully"}
@@ -1,14 +1,38 @@
-from fastapi import APIRouter, HTTPException, Depends, Request, File, UploadFile
+from fastapi import APIRouter, HTTPException, Depends, Request, BackgroundTasks
+from fastapi.responses import FileResponse
+from datetime import datetime
 from app.db import db
+from app.auth import get_current_admin
+from app.config import get_id_upload_settings
+from app.id_storage import receive_id_document
+from app.thumbnails import PREVIEW_CACHE_CONTROL, store_preview
+from app.shutdown import background_job
+from app.log_pipeline import bind_user
 from jose import jwt
 import os
-from app.otp_service import notify_admins_of_verification
-from app.routes.admin_routes import get_admin_emails
+import re
+from app.notifications import verification_digest
 
 router = APIRouter()
 
-# Define the folder where the files will be stored
-UPLOAD_FOLDER = "uploaded_ids"
+# Preview file names are "<sha256>-<size>.<ext>", anything else is rejected
+PREVIEW_NAME = re.compile(r"^[0-9a-f]{64}-\d+\.(webp|jpg)$")
+
+# Documented request body: the file is parsed by the route itself, see receive_id_document
+ID_UPLOAD_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["file"],
+                    "properties": {"file": {"type": "string", "format": "binary"}},
+                }
+            }
+        },
+    }
+}
 
 
 @router.get("/home")
@@ -28,6 +52,7 @@ async def get_user_info(request: Request):
         user_email = jwt.decode(
             token, key=None, algorithms=["HS256"], options={"verify_signature": False}
         ).get("sub")
+        bind_user(user_email)
 
         user = await db.users.find_one({"email": user_email})
 
@@ -58,12 +83,8 @@ async def get_user_info(request: Request):
         raise HTTPException(status_code=401, detail="Authorization token not provided")
 
 
-@router.post("/uploadID")
-async def upload_id(request: Request, file: UploadFile = File(...)):
-
-    # Ensure the upload folder exists
-    if not os.path.exists(UPLOAD_FOLDER):
-        os.makedirs(UPLOAD_FOLDER)
+@router.post("/uploadID", openapi_extra=ID_UPLOAD_BODY)
+async def upload_id(request: Request, background_tasks: BackgroundTasks):
 
     # Extract the token from the Authorization header
     authorization: str = request.headers.get("Authorization")
@@ -74,33 +95,49 @@ async def upload_id(request: Request, file: UploadFile = File(...)):
         user_email = jwt.decode(
             token, key=None, algorithms=["HS256"], options={"verify_signature": False}
         ).get("sub")
+        bind_user(user_email)
 
         user = await db.users.find_one({"email": user_email})
 
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
 
-        # Get the original file extension
-        _, file_extension = os.path.splitext(file.filename)
-
-        # Construct a new filename using the user's name or email and file extension
-        new_filename = f"{user_email}_id{file_extension}"
-
-        # Save the file to the server with the new filename
-        file_path = os.path.join(UPLOAD_FOLDER, new_filename)
-        with open(file_path, "wb") as buffer:
-            buffer.write(await file.read())
+        # Stream the file to disk (size and type are checked on the way) and store it
+        # under its content hash
+        document = await receive_id_document(request, get_id_upload_settings())
 
         # Update the database with the file path (not the actual file)
         await db.users.update_one(
-            {"email": user_email}, {"$set": {"id_file": file_path}}
+            {"email": user_email},
+            {"$set": {
+                "id_file": document.path,
+                "id_file_info": {
+                    "sha256": document.sha256,
+                    "size": document.size,
+                    "content_type": document.content_type,
+                    "uploaded_at": datetime.utcnow(),
+                },
+            }},
         )
 
-        #notify admins of new upload
-        admins = await get_admin_emails()
-        await notify_admins_of_verification(admins,user_email)
-        
+        # The document is on disk, the preview is rendered after the response is sent
+        # and the admins hear about the upload in their next digest
+        background_tasks.add_task(background_job("id_preview", store_preview), user_email, document)
+        verification_digest.add(user_email)
 
         return {"message": "Your ID has been successfully uploaded!"}
     else:
         raise HTTPException(status_code=401, detail="Authorization token not provided")
+
+
+@router.get("/id-previews/{shard}/{name}")
+async def get_id_preview(shard: str, name: str, admin: dict = Depends(get_current_admin)):
+    if not PREVIEW_NAME.match(name) or shard != name[:2]:
+        raise HTTPException(status_code=404, detail="Preview not found")
+
+    path = os.path.join(get_id_upload_settings().preview_dir, shard, name)
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Preview not found")
+
+    media_type = "image/webp" if name.endswith(".webp") else "image/jpeg"
+    return FileResponse(path, media_type=media_type, headers={"Cache-Control": PREVIEW_CACHE_CONTROL})
@@ -1,7 +1,8 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Request
 from app.models.login import LoginData, RegisterData, OTPVerification
 from app.db import get_db
 from app.auth import create_access_token
+from app.login_throttle import LoginThrottle, get_login_throttle, client_ip
 from passlib.context import CryptContext
 from ..otp_service import send_otp_email, generate_otp, get_or_create_secret_key
 import pyotp
@@ -40,10 +41,20 @@ async def register(data: RegisterData, db: AsyncIOMotorDatabase = Depends(get_db
     return {"message": "User registered successfully", "user_id": str(result.inserted_id)}
 
 @router.post("/login")
-async def login(data: LoginData, db: AsyncIOMotorDatabase = Depends(get_db)):
+async def login(
+    data: LoginData,
+    request: Request,
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    throttle: LoginThrottle = Depends(get_login_throttle),
+):
+    # Throttled attempts are turned away before any bcrypt work or OTP email
+    ip = client_ip(request)
+    attempt = await throttle.check(data.email, ip, sends_otp=not data.otp)
+
     user = await db.users.find_one({"email": data.email})
 
     if not user:
+        await throttle.record_failure(attempt, "unknown_user")
         raise HTTPException(status_code=404, detail="User not found")
 
     # Add "verified" field if it's missing
@@ -62,6 +73,7 @@ async def login(data: LoginData, db: AsyncIOMotorDatabase = Depends(get_db)):
 
                 if totp.verify(data.otp, valid_window=2):
                     # OTP is valid
+                    await throttle.record_success(attempt)
                     access_token_expires = timedelta(minutes=30)
                     access_token = create_access_token(
                         data={"sub": user["email"]}, expires_delta=access_token_expires
@@ -73,16 +85,20 @@ async def login(data: LoginData, db: AsyncIOMotorDatabase = Depends(get_db)):
                     }
                 else:
                     # Invalid OTP
+                    await throttle.record_failure(attempt, "otp")
                     raise HTTPException(status_code=400, detail="Invalid OTP. Please try again or request a new OTP.")
                 
             else:
                 # First stage (email and password correct), send OTP
                 otp = await generate_otp(user["email"])
+                await throttle.release(attempt)
+                await throttle.record_otp_sent(user["email"])
                 await send_otp_email(user["email"], otp)  # Send OTP via email
                 return {"message": "OTP sent. Please check your email."}
 
         else:
             # Invalid credentials
+            await throttle.record_failure(attempt, "password")
             raise HTTPException(status_code=400, detail="Invalid password")
 
     else:
@@ -103,13 +119,25 @@ async def login(data: LoginData, db: AsyncIOMotorDatabase = Depends(get_db)):
 
 
 @router.post("/forgot-password")
-async def forgot_password(data: ForgotPasswordRequest, db: AsyncIOMotorDatabase = Depends(get_db)): 
+async def forgot_password(
+    data: ForgotPasswordRequest,
+    request: Request,
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    throttle: LoginThrottle = Depends(get_login_throttle),
+):
+    # Shares the OTP email quota with /login
+    ip = client_ip(request)
+    attempt = await throttle.check(data.email, ip, sends_otp=True)
+
     user = await db.users.find_one({"email": data.email})
     if not user:
+        await throttle.record_failure(attempt, "unknown_user")
         raise HTTPException(status_code=404, detail="User not found")
     
     # Send OTP
     otp = await generate_otp(user["email"])
+    await throttle.release(attempt)
+    await throttle.record_otp_sent(user["email"])
     await send_otp_email(user["email"], otp)  # Send OTP via email
 
     return {"message": "Password reset request received"}
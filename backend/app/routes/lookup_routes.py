@@ -0,0 +1,52 @@
+from typing import AsyncIterator
+from fastapi import APIRouter, Depends, File, HTTPException, UploadFile
+from fastapi.responses import StreamingResponse
+from app.auth import get_current_admin
+from app.batch_lookup import claim_job, create_job, find_job, parse_roster, stream_job
+from app.config import get_batch_lookup_settings
+import orjson
+
+router = APIRouter()
+
+# Lines are sent as they complete: no gzip (it buffers a streamed body), no proxy buffering
+STREAM_HEADERS = {"Content-Encoding": "identity", "Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def ndjson_response(job_id: str, lines: AsyncIterator[dict]) -> StreamingResponse:
+    async def body():
+        async for line in lines:
+            yield orjson.dumps(line) + b"\n"
+
+    return StreamingResponse(
+        body(), media_type="application/x-ndjson", headers={**STREAM_HEADERS, "X-Lookup-Job": job_id},
+    )
+
+
+@router.post("/admin/lookups")
+async def start_lookup(file: UploadFile = File(...), admin_user: dict = Depends(get_current_admin)):
+    settings = get_batch_lookup_settings()
+    content = await file.read(settings.max_bytes + 1)
+    if len(content) > settings.max_bytes:
+        raise HTTPException(status_code=413, detail="File too large")
+
+    try:
+        roster = parse_roster(content, file.filename or "", settings.max_emails)
+    except (UnicodeDecodeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not roster.emails:
+        raise HTTPException(status_code=400, detail="No email addresses found")
+
+    job = await create_job(roster, admin_user["email"], settings)
+    return ndjson_response(job["_id"], stream_job(job, settings))
+
+
+@router.get("/admin/lookups/{job_id}")
+async def resume_lookup(job_id: str, admin_user: dict = Depends(get_current_admin)):
+    # Replays the stored results, then looks up the missing ones
+    job = await claim_job(job_id)
+    if job is None:
+        if await find_job(job_id) is None:
+            raise HTTPException(status_code=404, detail="Lookup job not found")
+        raise HTTPException(status_code=409, detail="Lookup job is being streamed by another request")
+
+    return ndjson_response(job["_id"], stream_job(job))
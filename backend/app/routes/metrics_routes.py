@@ -0,0 +1,72 @@
+import ipaddress
+import secrets
+from typing import Literal
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.responses import PlainTextResponse
+from app.auth import get_current_admin
+from app.config import get_metrics_settings
+from app.db_monitoring import COMMAND_DURATION, REQUEST_ROUND_TRIPS, REQUEST_DB_TIME
+from app.metrics import render_metrics
+from app.profiling import profile_buffer
+
+router = APIRouter()
+
+
+def allowed_ip(host: str, allow_ips: str) -> bool:
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    for entry in filter(None, (part.strip() for part in allow_ips.split(","))):
+        if address in ipaddress.ip_network(entry, strict=False):
+            return True
+    return False
+
+
+async def require_metrics_access(request: Request):
+    # Scrapers come from an allowed address or present the bearer token
+    settings = get_metrics_settings()
+    authorization = request.headers.get("authorization", "")
+    if settings.token and secrets.compare_digest(authorization.encode(), f"Bearer {settings.token}".encode()):
+        return
+    if request.client and allowed_ip(request.client.host, settings.allow_ips):
+        return
+    raise HTTPException(status_code=403, detail="Access denied")
+
+
+@router.get("/metrics", include_in_schema=False, dependencies=[Depends(require_metrics_access)])
+async def metrics():
+    # Prometheus text exposition format
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@router.get("/admin/metrics/db")
+async def db_metrics(admin: dict = Depends(get_current_admin)):
+    # Latencies are in seconds, quantiles are estimated from the histogram buckets
+    return {
+        "commands": COMMAND_DURATION.snapshot(),
+        "round_trips_per_request": REQUEST_ROUND_TRIPS.snapshot(),
+        "db_time_per_request": REQUEST_DB_TIME.snapshot(),
+    }
+
+
+@router.get("/admin/profiles")
+async def list_profiles(admin: dict = Depends(get_current_admin)):
+    # Most recent profiled requests, newest first, with their span breakdown
+    return {"profiles": profile_buffer.summaries(), "capacity": profile_buffer.capacity}
+
+
+@router.get("/admin/profiles/{profile_id}")
+async def get_profile(profile_id: str, format: Literal["json", "pstats"] = "json", admin: dict = Depends(get_current_admin)):
+    profile = profile_buffer.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+
+    if format == "pstats":
+        # Loadable with pstats.Stats(path) or snakeviz
+        return Response(
+            content=profile["stats"],
+            media_type="application/octet-stream",
+            headers={"Content-Disposition": f'attachment; filename="profile-{profile_id}.prof"'},
+        )
+    return {key: value for key, value in profile.items() if key != "stats"}
@@ -1,25 +1,31 @@
 from ..models.report import RequestData, UserReport
-from ..db import db
-from fastapi import APIRouter, HTTPException, Response
+from ..db import db, report_read_options
+from ..search_service import breach_index, ensure_breach_index
+from ..hibp_client import get_hibp_client, hibp_get, raise_for_hibp_status, HIBP_API_URL
+from ..metrics import PDF_RENDER_DURATION
+from ..profiling import span
+from ..serialization import CACHE_CONTROL, catalog_cache, encode_payload, json_response
+from ..analytics_service import ANALYTICS_JOB, catalog_keys, refresh_catalog_analytics, refresh_affected_users, breach_names
+from ..invalidation import BREACH_CATALOG, invalidation_bus
+from ..risk_scoring import RESCORE_JOB, catalog_matrices, load_risk_summary, refresh_user_risk, report_fields, rescore_breach_users
+from ..recommendations import breach_recommendations, recommendation_fields, refresh_breach_recommendations
+from ..shutdown import background_job
+from ..log_pipeline import bind_user
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Request, Response
 from jose import jwt
 from dotenv import load_dotenv
 
-from reportlab.lib.pagesizes import letter
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
-from reportlab.lib.enums import TA_CENTER
-
+import functools
 import html
 import csv
-import httpx
 import io
 import re
 import os
+import time
 
 HIBP_PASSWORD_URL = "https://api.pwnedpasswords.com/range/"
-HIBP_ALL_BREACHES_URL = "https://haveibeenpwned.com/api/v3/breaches"
-HIBP_LATEST_BREACHES_URL = "https://haveibeenpwned.com/api/v3/latestbreach"
+HIBP_ALL_BREACHES_URL = f"{HIBP_API_URL}/breaches"
+HIBP_LATEST_BREACHES_URL = f"{HIBP_API_URL}/latestbreach"
 
 # Load .env file
 load_dotenv()
@@ -27,33 +33,92 @@ load_dotenv()
 # Access the API key from the environment
 API_KEY = os.getenv('API_KEY')
 
+# Minimum search score for a catalog breach to be suggested for an unknown site name
+FUZZY_MATCH_THRESHOLD = 0.6
+SUGGESTION_LIMIT = 3
+
 router = APIRouter()
 
+
+def drop_catalog_caches():
+    # Another worker synced the catalog, both are reloaded from the database on next use
+    catalog_cache.invalidate()
+    breach_index.invalidate()
+
+
+invalidation_bus.subscribe(BREACH_CATALOG, drop_catalog_caches)
+
 @router.post("/reports")
-async def generate_report(data: RequestData):
+async def generate_report(data: RequestData, request: Request, background_tasks: BackgroundTasks):
     if data.reportType not in {"detailed", "user"}:
         raise HTTPException(status_code=400, detail="Invalid report type")
     else:
         if data.reportType == "detailed":
-            report = await generate_detailed_report(data)
+            if data.reportCategory == "allbreaches" and data.reportFormat == "json":
+                # The encoded catalog is reused until the next catalog sync
+                payload = await catalog_cache.get_or_build(functools.partial(fetch_all_breaches, background_tasks))
+                return json_response(request, payload)
+
+            report = await generate_detailed_report(data, background_tasks)
 
             if data.reportFormat == "json":
-                return report
+                return json_response(request, encode_payload(report))
             elif data.reportFormat == "pdf":
-                return await generate_pdf(data, report)
+                with span("render"):
+                    return await generate_pdf(data, report)
             else:
-                return await generate_csv(data, report)
+                with span("render"):
+                    return await generate_csv(data, report)
         else:
             report = await generate_report_on_auth_user(data)
 
             if data.reportFormat == "json":
-                return report
+                return json_response(request, encode_payload(report))
             elif data.reportFormat == "pdf":
-                return await generate_pdf(data, report)
+                with span("render"):
+                    return await generate_pdf(data, report)
             else:
-                return await generate_csv(data, report)
+                with span("render"):
+                    return await generate_csv(data, report)
+
+@router.get("/breaches")
+async def get_breach_catalog(request: Request, background_tasks: BackgroundTasks):
+    # Cacheable form of the allbreaches report: repeat clients revalidate with the ETag
+    # and get a 304 without the catalog being read
+    payload = await catalog_cache.get_or_build(functools.partial(fetch_all_breaches, background_tasks))
+    return json_response(request, payload, cache_control=CACHE_CONTROL)
+
+@router.get("/breaches/search")
+async def search_breaches(q: str, limit: int = 10):
+    if limit < 1 or limit > 50:
+        raise HTTPException(status_code=400, detail="Limit must be between 1 and 50")
+
+    # Served from the in-memory catalog index, no HIBP calls
+    await ensure_breach_index()
+    results = breach_index.search(q, limit=limit)
+
+    return {"query": q, "results": [search_result(result) for result in results]}
+
+@router.get("/breaches/domain/{domain}")
+async def lookup_breaches_by_domain(domain: str):
+    await ensure_breach_index()
+    breaches = breach_index.lookup_domain(domain)
+
+    if not breaches:
+        raise HTTPException(status_code=404, detail="No breaches found for domain")
+
+    return {"domain": domain, "breaches": breaches}
 
 # -------------------------- Helper functions --------------------------
+
+def search_result(result: dict) -> dict:
+    return {
+        "Name": result["breach"].get("Name"),
+        "Title": result["breach"].get("Title"),
+        "Domain": result["breach"].get("Domain"),
+        "score": result["score"],
+    }
+
 """
 Generate report on the user's account.
 
@@ -61,125 +126,184 @@ Generate report on the user's account.
 async def generate_report_on_auth_user(data: RequestData):
     # Retrieves the email of the user
     user_email = jwt.decode(data.token, key=None, algorithms=["HS256"], options={"verify_signature": False}).get("sub")
+    bind_user(user_email)
 
     # Checks the email in the db before using the HIBP_API
     user_data = await db.users.find_one({"email": user_email})
 
     # Return the local data breach in the db for faster responses
     if "breaches" in user_data:
+        if isinstance(user_data['breaches'], dict):
+            # With the risk score from the last rescan
+            return {
+                **user_data['breaches'],
+                **report_fields(await load_risk_summary(user_data['_id'])),
+                **await suggest_mechanisms(user_data['breaches']),
+            }
         return user_data['breaches']
     else:
         headers = {"User-Agent": "Spearow", "hibp-api-key": API_KEY}
 
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"https://haveibeenpwned.com/api/v3/breachedaccount/{user_email}", headers=headers)
+        client = get_hibp_client()
+        response = await hibp_get(client, f"{HIBP_API_URL}/breachedaccount/{user_email}", headers, "breachedaccount")
 
-            if response.status_code == 200:
-                user_report = UserReport(
-                    Name=user_data['name'],
-                    Email=user_email,
-                    Report=response.json()
-                )
-
-                # link the exposed data to an existing or new user breaches our the db
-                await db.users.find_one_and_update(
-                    {"email": user_email},
-                    {"$set": {"breaches": user_report.model_dump()}})
+        if response.status_code == 200:
+            user_report = UserReport(
+                Name=user_data['name'],
+                Email=user_email,
+                Report=response.json()
+            )
 
-                return user_report.model_dump_json()
-            elif response.status_code == 404:
-                user_report = UserReport(
-                    Name=user_data['name'],
-                    Email=user_email,
-                    Report="Email address not found in any breaches."
-                )
+            # link the exposed data to an existing or new user breaches our the db
+            await db.users.find_one_and_update(
+                {"email": user_email},
+                {"$set": {"breaches": user_report.model_dump()}})
+            await refresh_affected_users(breach_names(user_report.Report))
+            risk = await refresh_user_risk(user_data['_id'])
+
+            return {**user_report.model_dump(), **report_fields(risk), **await suggest_mechanisms(user_report.Report)}
+        elif response.status_code == 404:
+            user_report = UserReport(
+                Name=user_data['name'],
+                Email=user_email,
+                Report="Email address not found in any breaches."
+            )
 
-                # link the exposed data to an existing or new user breaches our the db
-                await db.users.find_one_and_update(
-                    {"email": user_email},
-                    {"$set": {"breaches": user_report.model_dump()}})
+            # link the exposed data to an existing or new user breaches our the db
+            await db.users.find_one_and_update(
+                {"email": user_email},
+                {"$set": {"breaches": user_report.model_dump()}})
+            risk = await refresh_user_risk(user_data['_id'])
 
-                return user_report.model_dump()
-            else:
-                response.raise_for_status()
+            return {**user_report.model_dump(), **report_fields(risk), **await suggest_mechanisms(user_report.Report)}
+        else:
+            raise_for_hibp_status(response)
 
 """
 Generate detailed report on data breaches.
 
 """
-async def generate_detailed_report(data: RequestData):
+async def generate_detailed_report(data: RequestData, background_tasks: BackgroundTasks):
     if data.reportCategory == "allbreaches":
-        # Retrieves all the collection names in the db
-        collection_names = await db.list_collection_names()
-
-        if "breaches" in collection_names:
-            elements = db['breaches'].find({})
-            breached_data = []
-
-            async for element in elements:
-                # Removes the object id
-                element.pop('_id', None)
-                breached_data.append(element)
-            return breached_data
-        else:
-            headers = {"User-Agent": "spearow", "hibp-api-key": API_KEY}
-
-            async with httpx.AsyncClient() as client:
-                response = await client.get(HIBP_ALL_BREACHES_URL, headers=headers)
-
-                if response.status_code == 200:
-                    # Create and link all breaches to the db
-                    await db['breaches'].insert_many(response.json())
-                    return response.json()
-                else:
-                    response.raise_for_status()
+        return await fetch_all_breaches(background_tasks)
     elif data.reportCategory == "latestBreaches":
         headers = {"User-Agent": "spearow", "hibp-api-key": API_KEY}
 
-        async with httpx.AsyncClient() as client:
-            response = await client.get(HIBP_LATEST_BREACHES_URL, headers=headers)
-
-            if response.status_code == 200:
-                # link latest breaches to the db
-                await db['breaches'].insert_one(response.json())
-                return response.json()
-            else:
-                 response.raise_for_status()
+        client = get_hibp_client()
+        response = await hibp_get(client, HIBP_LATEST_BREACHES_URL, headers, "latestbreach")
+
+        if response.status_code == 200:
+            # link latest breaches to the db
+            await db['breaches'].insert_one(response.json())
+            catalog_cache.invalidate()
+            catalog_matrices.invalidate()
+            if breach_index.is_built:
+                breach_index.add(response.json())
+            await refresh_breach_recommendations([response.json()])
+            await invalidation_bus.publish(BREACH_CATALOG)
+            # Only the breach's year and data class rows are recounted, after the response
+            background_tasks.add_task(background_job(ANALYTICS_JOB, refresh_catalog_analytics), *catalog_keys([response.json()]))
+            # Users already in the breach are scored with its details after the response
+            background_tasks.add_task(background_job(RESCORE_JOB, rescore_breach_users), response.json().get("Name"))
+            return response.json()
+        else:
+             raise_for_hibp_status(response)
     else:
         # Regular expression for a valid domain name
         pattern = r'^(?!-)[A-Za-z0-9-]{1,63}(?<!-)\.[A-Za-z]{2,6}$'
 
         if re.match(pattern, data.reportCategory) is None:
-            breached_site = await db['breaches'].find_one({"Name": data.reportCategory})
+            breached_site = await db.get_collection('breaches', **report_read_options()).find_one({"Name": data.reportCategory})
 
             # checks the site in the db
             if breached_site:
                 # Removes the object id
                 breached_site.pop('_id', None)
                 return breached_site
+
+            headers = {"User-Agent": "spearow", "hibp-api-key": API_KEY}
+
+            client = get_hibp_client()
+            response = await hibp_get(client, f"{HIBP_API_URL}/breach/{data.reportCategory}", headers, "breach")
+
+            if response.status_code == 200:
+                # link new breached site to the db
+                await db['breaches'].insert_one(response.json())
+                catalog_cache.invalidate()
+                catalog_matrices.invalidate()
+                if breach_index.is_built:
+                    breach_index.add(response.json())
+                await refresh_breach_recommendations([response.json()])
+                await invalidation_bus.publish(BREACH_CATALOG)
+                background_tasks.add_task(background_job(ANALYTICS_JOB, refresh_catalog_analytics), *catalog_keys([response.json()]))
+                background_tasks.add_task(background_job(RESCORE_JOB, rescore_breach_users), response.json().get("Name"))
+                return response.json()
+            elif response.status_code == 404:
+                # Only once HIBP does not know the name, close catalog names are offered,
+                # never returned in place of the breach asked for
+                await ensure_breach_index()
+                matches = breach_index.search(data.reportCategory, limit=SUGGESTION_LIMIT, min_score=FUZZY_MATCH_THRESHOLD)
+                if matches:
+                    return {"suggestions": [search_result(match) for match in matches]}
+                return "Site not found"
+            else:
+                raise_for_hibp_status(response)
+        else:
+            # Domain names are looked up in the local catalog
+            await ensure_breach_index()
+            breaches = breach_index.lookup_domain(data.reportCategory)
+
+            if not breaches:
+                return "Site not found"
+            elif len(breaches) == 1:
+                return breaches[0]
             else:
-                headers = {"User-Agent": "spearow", "hibp-api-key": API_KEY}
-
-                async with httpx.AsyncClient() as client:
-                    response = await client.get(f"https://haveibeenpwned.com/api/v3/breach/{data.reportCategory}", headers=headers)
-
-                    if response.status_code == 200:
-                        # link new breached site to the db
-                        await db['breaches'].insert_one(response.json())
-                        return response.json()
-                    elif response.status_code == 404:
-                        return "Site not found"
-                    else:
-                        response.raise_for_status()
+                return breaches
+
+"""
+Fetch the whole breach catalog, from the db or from HIBP on first use.
+
+"""
+async def fetch_all_breaches(background_tasks: BackgroundTasks):
+    # Retrieves all the collection names in the db
+    collection_names = await db.list_collection_names()
+
+    if "breaches" in collection_names:
+        elements = db.get_collection('breaches', **report_read_options()).find({})
+        breached_data = []
+
+        async for element in elements:
+            # Removes the object id
+            element.pop('_id', None)
+            breached_data.append(element)
+        return breached_data
+    else:
+        headers = {"User-Agent": "spearow", "hibp-api-key": API_KEY}
+
+        client = get_hibp_client()
+        response = await hibp_get(client, HIBP_ALL_BREACHES_URL, headers, "breaches")
+
+        if response.status_code == 200:
+            # Create and link all breaches to the db
+            await db['breaches'].insert_many(response.json())
+            catalog_cache.invalidate()
+            catalog_matrices.invalidate()
+            breach_index.rebuild(response.json())
+            await refresh_breach_recommendations()
+            await invalidation_bus.publish(BREACH_CATALOG)
+            background_tasks.add_task(background_job(ANALYTICS_JOB, refresh_catalog_analytics))
+            background_tasks.add_task(background_job(RESCORE_JOB, rescore_breach_users))
+            return response.json()
         else:
-            return "Invalid site name"
+            raise_for_hibp_status(response)
 
 """
 Suggest mechanisms for better security of the user's account.
 
 """
-async def suggest_mechanisms():
-    return None
+async def suggest_mechanisms(report) -> dict:
+    # Union of the recommendations precomputed for each breach on catalog sync
+    return recommendation_fields(await breach_recommendations.for_breaches(breach_names(report)))
 
 """
 Request reset of account.
@@ -194,6 +318,13 @@ Generates pdf
 
 """
 async def generate_pdf(report_data: RequestData, json_data):
+    # ReportLab is only loaded by the first PDF report, not at startup
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib.units import inch
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+    from reportlab.lib.enums import TA_CENTER
+
     content = io.BytesIO()
     doc = SimpleDocTemplate(
         content,
@@ -226,6 +357,20 @@ async def generate_pdf(report_data: RequestData, json_data):
                 styles["Normal"],
             )
         )
+        if "RiskScore" in json_data:
+            elements.append(
+                Paragraph(
+                    f"<b>Risk:</b> {json_data['RiskScore']} ({json_data['RiskLevel']})",
+                    styles["Normal"],
+                )
+            )
+            if json_data.get("TopRisks"):
+                elements.append(
+                    Paragraph(
+                        f"<b>TopRisks:</b> {html.escape(', '.join(json_data['TopRisks']))}",
+                        styles["Normal"],
+                    )
+                )
         elements.append(Spacer(1, 0.2 * inch))
 
         # Check if the report data contains breaches
@@ -241,17 +386,27 @@ async def generate_pdf(report_data: RequestData, json_data):
                 elements.append(
                     Paragraph(f"<b>Report:</b> {json_data['Report']}", styles["Normal"])
                 )
+
+        if json_data.get("Recommendations"):
+            elements.append(Paragraph("<b>Recommendations:</b>", styles["Heading3"]))
+            for recommendation in json_data["Recommendations"]:
+                elements.append(Paragraph(f"- {html.escape(recommendation)}", styles["Normal"]))
     else:
         # If it's not a detailed report, just display the JSON data
         elements.append(Paragraph(str(json_data), styles["Normal"]))
 
+    render_start = time.perf_counter()
     doc.build(elements)
+    PDF_RENDER_DURATION.observe(time.perf_counter() - render_start)
     content.seek(0)
 
     return Response(content=content.getvalue(), media_type="application/pdf")
 
 
 async def process_data(data, level, elements, styles):
+    from reportlab.lib.units import inch
+    from reportlab.platypus import Paragraph, Spacer
+
     for key, value in data.items():
         if isinstance(value, dict):
             elements.append(Paragraph(f"<b>{key}:</b>", styles[f"Heading{level}"]))
@@ -288,7 +443,11 @@ async def generate_csv(report_data: RequestData, json_data):
 
         row_data = {}
         for name in fieldnames:
-           row_data[name] = json_data[name]
+           value = json_data[name]
+           # Lists of text (top risks, recommendations) get one line each in the cell
+           if isinstance(value, list) and all(isinstance(item, str) for item in value):
+               value = "\n".join(value)
+           row_data[name] = value
 
         writer.writerow(row_data)
         csv_content = content.getvalue()
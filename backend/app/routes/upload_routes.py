@@ -1,9 +1,16 @@
 import httpx
-from fastapi import APIRouter, File, UploadFile, HTTPException, Depends, BackgroundTasks
+from fastapi import APIRouter, File, UploadFile, HTTPException, Depends, BackgroundTasks, Request
 from typing import List, Optional, Dict
 from ..auth import get_current_user
 from ..db import db
+from ..hibp_client import get_hibp_client, hibp_get, raise_for_hibp_status, HIBP_API_URL
+from ..metrics import UPLOAD_BYTES, UPLOAD_RECORDS
+from ..shutdown import background_job, shutdown_coordinator
+from ..invalidation import DATA_CLASSES, invalidation_bus
+from ..profiling import span
+from ..serialization import CACHE_CONTROL, PayloadCache, json_response
 from bson import ObjectId
+from bson.errors import InvalidId
 import json
 import os
 import logging
@@ -11,44 +18,79 @@ from datetime import datetime, timedelta
 
 router = APIRouter()
 
-# Set up logging
-logging.basicConfig(level=logging.INFO)
+# Handlers and levels are set up by the entry point (app.serve), not on import
 logger = logging.getLogger(__name__)
 
 # Global variables for HIBP data classes
 HIBP_DATA_CLASSES: List[str] = []
 LAST_UPDATE_TIME: datetime = datetime.min
 
+# Encoded /dataclasses response, rebuilt after each update from HIBP
+data_classes_cache = PayloadCache()
+
+# The last list fetched by any worker, so only one of them calls HIBP each day
+DATA_CLASSES_COLLECTION = "hibp_data_classes"
+DATA_CLASSES_ID = "dataclasses"
+DATA_CLASSES_MAX_AGE = timedelta(days=1)
+
+def drop_data_classes():
+    # Another worker fetched a new list, it is read from the database on next use
+    global LAST_UPDATE_TIME
+    LAST_UPDATE_TIME = datetime.min
+    data_classes_cache.invalidate()
+
+invalidation_bus.subscribe(DATA_CLASSES, drop_data_classes)
+
 async def update_hibp_data_classes():
     global HIBP_DATA_CLASSES, LAST_UPDATE_TIME
     current_time = datetime.now()
     
     # Update only if it's been more than a day since the last update
-    if current_time - LAST_UPDATE_TIME > timedelta(days=1):
+    if current_time - LAST_UPDATE_TIME > DATA_CLASSES_MAX_AGE:
+        stored = await db[DATA_CLASSES_COLLECTION].find_one({"_id": DATA_CLASSES_ID})
+        if stored and datetime.utcnow() - stored["updated_at"] < DATA_CLASSES_MAX_AGE:
+            HIBP_DATA_CLASSES = stored["dataclasses"]
+            LAST_UPDATE_TIME = current_time
+            data_classes_cache.invalidate()
+            return
+
         hibp_api_key = os.getenv("HIBP_API_KEY")
         if not hibp_api_key:
             logger.error("HIBP_API_KEY is not set in the environment variables")
             raise HTTPException(status_code=500, detail="Server configuration error")
 
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    "https://haveibeenpwned.com/api/v3/dataclasses",
-                    headers={"hibp-api-key": hibp_api_key}
-                )
-                response.raise_for_status()
-                HIBP_DATA_CLASSES = response.json()
-                LAST_UPDATE_TIME = current_time
-                logger.info("HIBP data classes updated successfully")
+            client = get_hibp_client()
+            response = await hibp_get(
+                client,
+                f"{HIBP_API_URL}/dataclasses",
+                {"hibp-api-key": hibp_api_key},
+                "dataclasses",
+            )
+            raise_for_hibp_status(response)
+            HIBP_DATA_CLASSES = response.json()
+            LAST_UPDATE_TIME = current_time
+            data_classes_cache.invalidate()
+            await db[DATA_CLASSES_COLLECTION].replace_one(
+                {"_id": DATA_CLASSES_ID},
+                {"dataclasses": HIBP_DATA_CLASSES, "updated_at": datetime.utcnow()},
+                upsert=True,
+            )
+            await invalidation_bus.publish(DATA_CLASSES)
+            logger.info("HIBP data classes updated successfully")
         except httpx.HTTPError as e:
             logger.error(f"Error fetching HIBP data classes: {e}")
             raise HTTPException(status_code=500, detail="Failed to fetch data classes")
 
+async def data_classes_document():
+    return {"dataclasses": HIBP_DATA_CLASSES}
+
 @router.get("/dataclasses")
-async def get_dataclasses():
+async def get_dataclasses(request: Request):
     try:
         await update_hibp_data_classes()
-        return {"dataclasses": HIBP_DATA_CLASSES}
+        payload = await data_classes_cache.get_or_build(data_classes_document)
+        return json_response(request, payload, cache_control=CACHE_CONTROL)
     except HTTPException as e:
         raise e
     except Exception as e:
@@ -75,8 +117,10 @@ async def upload_data(
 
     # Read and process the file
     file_content = await file.read()
+    UPLOAD_BYTES.inc(len(file_content))
     try:
-        standard_data = json.loads(file_content.decode('utf-8'))
+        with span("parse"):
+            standard_data = json.loads(file_content.decode('utf-8'))
     except json.JSONDecodeError as e:
         raise HTTPException(status_code=400, detail=f"Invalid JSON format: {str(e)}")
 
@@ -88,29 +132,14 @@ async def upload_data(
         "file_type": 'json',
         "content": standard_data,
         "status": "unverified",
+        "processed": False,
     }
 
-    # Insert into Uploads collection
+    # Insert into Uploads collection, the single source of truth for a user's uploads
     upload_result = await db.uploads.insert_one(upload_doc)
 
-    # Update user
-    await db.users.update_one(
-        {"_id": user['_id']},
-        {
-            "$push": {
-                "uploaded_data": {
-                    "upload_id": upload_result.inserted_id,
-                    "upload_date": upload_doc["upload_date"],
-                    "file_name": file.filename,
-                    "file_type": 'json',
-                    "processed": False
-                }
-            }
-        }
-    )
-
     # Trigger asynchronous processing
-    background_tasks.add_task(process_upload_async, upload_result.inserted_id)
+    background_tasks.add_task(background_job("process_upload", process_upload_async), upload_result.inserted_id)
 
     return {
         "message": "Data uploaded successfully. It will be processed and added to reports as unverified data once reviewed.",
@@ -136,6 +165,7 @@ async def process_upload_async(upload_id: ObjectId):
 
         # Process the content (e.g., validate against HIBP data classes)
         processed_content = process_content(upload_doc['content'])
+        UPLOAD_RECORDS.inc(len(processed_content))
 
         # Update the upload document with processed content
         await db.uploads.update_one(
@@ -143,22 +173,12 @@ async def process_upload_async(upload_id: ObjectId):
             {
                 "$set": {
                     "processed_content": processed_content,
-                    "processing_completed_at": datetime.utcnow()
+                    "processing_completed_at": datetime.utcnow(),
+                    "processed": True,
                 }
             }
         )
 
-        # Update the user's doc
-        await db.users.update_one(
-            {"_id": upload_doc['user_id']},
-            {
-                "$set": {
-                    "uploaded_data.$[elem].processed": True,
-                }
-            },
-            array_filters=[{"elem.upload_id": upload_id}]
-        )
-
         logger.info(f"Upload {upload_id} processed successfully")
 
     except Exception as e:
@@ -174,6 +194,9 @@ async def process_upload_async(upload_id: ObjectId):
             }
         )
 
+# Rewrites the whole result, so an upload cut off at shutdown is simply processed again
+shutdown_coordinator.resumable("process_upload", process_upload_async)
+
 def process_content(content: Dict) -> Dict:
     processed_content = {}
     for key, value in content.items():
@@ -198,15 +221,69 @@ async def verify_upload(
         {"$set": {"status": "verified", "verified_at": datetime.utcnow()}}
     )
 
-    # Update user's uploaded_data
-    await db.users.update_one(
-        {"_id": upload["user_id"]},
-        {"$set": {"uploaded_data.$[elem].verified": True}},
-        array_filters=[{"elem.upload_id": ObjectId(upload_id)}]
-    )
-
     return {"message": "Upload verified successfully"}
 
+# Upload metadata shown in listings, never the uploaded content itself
+UPLOAD_LIST_PROJECTION = {
+    "file_name": 1,
+    "file_type": 1,
+    "upload_date": 1,
+    "status": 1,
+    "processed": 1,
+}
+
+MAX_UPLOADS_PAGE = 100
+
+@router.get("/my-uploads")
+async def get_my_uploads(
+    limit: int = 20,
+    before: Optional[str] = None,
+    current_user: str = Depends(get_current_user)
+):
+    if limit < 1 or limit > MAX_UPLOADS_PAGE:
+        raise HTTPException(status_code=400, detail=f"Limit must be between 1 and {MAX_UPLOADS_PAGE}")
+
+    user = await db.users.find_one({"email": current_user}, {"_id": 1})
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    # Newest first over the (user_id, upload_date) index, the cursor is the last item of the previous page
+    query = {"user_id": user["_id"]}
+    if before:
+        try:
+            upload_date, upload_id = before.split("|")
+            upload_date = datetime.fromisoformat(upload_date)
+            upload_id = ObjectId(upload_id)
+        except (ValueError, InvalidId):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+        query["$or"] = [
+            {"upload_date": {"$lt": upload_date}},
+            {"upload_date": upload_date, "_id": {"$lt": upload_id}},
+        ]
+
+    uploads = await db.uploads.find(query, UPLOAD_LIST_PROJECTION).sort(
+        [("upload_date", -1), ("_id", -1)]
+    ).limit(limit + 1).to_list(None)
+
+    has_more = len(uploads) > limit
+    uploads = uploads[:limit]
+
+    return {
+        "uploads": [
+            {
+                "id": str(upload["_id"]),
+                "file_name": upload.get("file_name"),
+                "file_type": upload.get("file_type"),
+                "upload_date": upload.get("upload_date"),
+                "status": upload.get("status"),
+                "processed": upload.get("processed", False),
+            }
+            for upload in uploads
+        ],
+        "next_cursor": f"{uploads[-1]['upload_date'].isoformat()}|{uploads[-1]['_id']}" if has_more else None,
+    }
+
 @router.get("/admin/unverified-uploads")
 async def get_unverified_uploads(current_user: str = Depends(get_current_user)):
     if not await is_admin(current_user):
@@ -0,0 +1,233 @@
+import html
+import re
+from bisect import insort
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from app.db import db, report_read_options
+
+# Weight of each catalog field when ranking a match
+FIELD_WEIGHTS = {"Name": 3.0, "Title": 3.0, "Domain": 2.0, "Description": 0.5}
+
+# Fields whose words are matched approximately (trigrams); the rest only match whole words
+FUZZY_FIELDS = {"Name", "Title", "Domain"}
+
+# Minimum trigram similarity for a word to count as a typo of another word
+MIN_TOKEN_SIMILARITY = 0.4
+
+TAG_PATTERN = re.compile(r"<[^>]+>")
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def normalise(text: str) -> str:
+    # Lowercase and strip the HTML markup HIBP puts in descriptions
+    return html.unescape(TAG_PATTERN.sub(" ", str(text))).lower()
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(normalise(text))
+
+
+def trigrams(token: str) -> set:
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def normalise_domain(domain: str) -> str:
+    domain = domain.strip().lower().rstrip(".")
+    if domain.startswith("www."):
+        domain = domain[4:]
+    return domain
+
+
+class BreachSearchIndex:
+    """
+    Typo-tolerant index over the local breach catalog.
+
+    Names, titles and domains are indexed by word trigrams so misspelt queries still
+    rank the intended breach first; descriptions only match on whole words. The index
+    is rebuilt from the catalog whenever it is synced, a single breach fetched on its
+    own is added in place, and it never calls out to HIBP.
+    """
+
+    def __init__(self):
+        self.built_at: Optional[datetime] = None
+        self._clear()
+
+    def _clear(self):
+        self.breaches: List[dict] = []
+        self._vocabulary: List[str] = []
+        self._token_ids: Dict[str, int] = {}
+        self._token_trigrams: List[int] = []
+        self._trigram_postings: Dict[str, List[int]] = {}
+        # token id -> {breach position: best field weight}
+        self._token_postings: List[Dict[int, float]] = []
+        # Exact name -> position, repeated names replace the breach in place
+        self._positions: Dict[str, int] = {}
+        self._by_name: Dict[str, int] = {}
+        self._by_domain: Dict[str, List[int]] = {}
+
+    @property
+    def is_built(self) -> bool:
+        return self.built_at is not None
+
+    def invalidate(self):
+        # Searches keep using the old catalog until the next ensure_breach_index reloads it
+        self.built_at = None
+
+    def rebuild(self, breaches: Iterable[dict]):
+        self._clear()
+        for breach in breaches:
+            self._index(breach)
+        self.built_at = datetime.utcnow()
+
+    def add(self, breach: dict):
+        # Only the new breach's words and trigrams are indexed
+        self._index(breach)
+
+    def _field_tokens(self, breach: dict):
+        for field, weight in FIELD_WEIGHTS.items():
+            value = breach.get(field)
+            if not value:
+                continue
+
+            tokens = tokenize(value)
+            if field == "Domain":
+                # Skip the top-level domain, "com" matches nearly everything
+                tokens = tokens[:-1] or tokens
+            for token in tokens:
+                yield field, weight, token
+
+    def _index(self, breach: dict):
+        # Later entries of a name win (the catalog may hold repeated inserts)
+        breach = {key: value for key, value in breach.items() if key != "_id"}
+        name = str(breach.get("Name", ""))
+        position = self._positions.get(name)
+        if position is None:
+            position = len(self.breaches)
+            self.breaches.append(breach)
+            self._positions[name] = position
+        else:
+            self._unindex(position)
+            self.breaches[position] = breach
+        self._by_name[name.lower()] = position
+
+        for field, weight, token in self._field_tokens(breach):
+            token_id = self._token_ids.get(token)
+            if token_id is None:
+                token_id = len(self._vocabulary)
+                self._token_ids[token] = token_id
+                self._vocabulary.append(token)
+                self._token_trigrams.append(0)
+                self._token_postings.append({})
+
+            postings = self._token_postings[token_id]
+            if postings.get(position, 0.0) < weight:
+                postings[position] = weight
+
+            # Only words that appear in a fuzzy field get trigram postings, once
+            if field in FUZZY_FIELDS and not self._token_trigrams[token_id]:
+                grams = trigrams(token)
+                self._token_trigrams[token_id] = len(grams)
+                for gram in grams:
+                    self._trigram_postings.setdefault(gram, []).append(token_id)
+
+        if breach.get("Domain"):
+            insort(self._by_domain.setdefault(normalise_domain(breach["Domain"]), []), position)
+
+    def _unindex(self, position: int):
+        # Drop the postings of the breach being replaced, its words stay in the vocabulary
+        breach = self.breaches[position]
+        for _, _, token in self._field_tokens(breach):
+            self._token_postings[self._token_ids[token]].pop(position, None)
+        if breach.get("Domain"):
+            positions = self._by_domain.get(normalise_domain(breach["Domain"]), [])
+            if position in positions:
+                positions.remove(position)
+
+    def _similar_tokens(self, token: str) -> Dict[int, float]:
+        similar: Dict[int, float] = {}
+
+        exact = self._token_ids.get(token)
+        if exact is not None:
+            similar[exact] = 1.0
+
+        grams = trigrams(token)
+        shared: Dict[int, int] = defaultdict(int)
+        for gram in grams:
+            for token_id in self._trigram_postings.get(gram, ()):
+                shared[token_id] += 1
+
+        for token_id, count in shared.items():
+            # Dice coefficient over the two trigram sets
+            score = 2.0 * count / (len(grams) + self._token_trigrams[token_id])
+            if score >= MIN_TOKEN_SIMILARITY and score > similar.get(token_id, 0.0):
+                similar[token_id] = score
+
+        return similar
+
+    def search(self, query: str, limit: int = 10, min_score: float = 0.0) -> List[dict]:
+        """
+        Rank catalog breaches against a free-text query.
+
+        Returns up to ``limit`` results as ``{"score": float, "breach": dict}`` with the
+        score normalised to 0..1 and sorted best first.
+        """
+        query_tokens = tokenize(query)
+        if not query_tokens or not self.breaches:
+            return []
+
+        max_weight = max(FIELD_WEIGHTS.values())
+        scores: Dict[int, float] = defaultdict(float)
+
+        for token in query_tokens:
+            best: Dict[int, float] = {}
+            for token_id, similarity in self._similar_tokens(token).items():
+                for position, weight in self._token_postings[token_id].items():
+                    score = similarity * weight
+                    if score > best.get(position, 0.0):
+                        best[position] = score
+
+            for position, score in best.items():
+                scores[position] += score
+
+        # Exact name matches always outrank partial matches
+        exact = self._by_name.get(normalise(query).strip())
+        if exact is not None:
+            scores[exact] = len(query_tokens) * max_weight
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        results = []
+        for position, score in ranked[:limit]:
+            score = score / (len(query_tokens) * max_weight)
+            if score < min_score:
+                break
+            results.append({"score": round(score, 4), "breach": self.breaches[position]})
+
+        return results
+
+    def lookup_domain(self, domain: str) -> List[dict]:
+        """
+        Find breaches registered for a domain or any of its parent domains.
+        """
+        labels = normalise_domain(domain).split(".")
+        for start in range(len(labels) - 1):
+            positions = self._by_domain.get(".".join(labels[start:]))
+            if positions:
+                return [self.breaches[position] for position in positions]
+        return []
+
+
+# Shared index for the process, loaded lazily from the catalog
+breach_index = BreachSearchIndex()
+
+
+async def refresh_breach_index():
+    breaches = await db.get_collection("breaches", **report_read_options()).find({}, {"_id": 0}).to_list(None)
+    breach_index.rebuild(breaches)
+
+
+async def ensure_breach_index():
+    if not breach_index.is_built:
+        await refresh_breach_index()
@@ -0,0 +1,134 @@
+"""
+Fast JSON responses for large report payloads.
+
+FastAPI's default path walks every nested dict through ``jsonable_encoder`` before the
+stdlib encoder walks it again. Report and catalog payloads are plain JSON-like
+documents, so they are encoded once with orjson and sent as raw bytes.
+
+Read-mostly payloads (the breach catalog, HIBP data classes) are cached encoded and
+pre-gzipped between syncs, with an ETag derived from their content: a client sending
+it back in If-None-Match gets a 304 without the database being touched. Other large
+responses are compressed by the GZip middleware.
+"""
+import asyncio
+import gzip
+import hashlib
+from typing import Awaitable, Callable, NamedTuple, Optional
+
+import orjson
+from bson import ObjectId
+from fastapi import Request, Response
+from app.profiling import span
+
+# Bodies smaller than this are not worth compressing, shared with the GZip middleware
+GZIP_MIN_SIZE = 1024
+GZIP_LEVEL = 6
+
+# Clients may reuse cached payloads for a few minutes, then revalidate with the ETag
+CACHE_CONTROL = "public, max-age=300, must-revalidate"
+
+
+class EncodedPayload(NamedTuple):
+    body: bytes
+    gzipped: Optional[bytes] = None
+    etag: Optional[str] = None
+
+
+def default(value):
+    # Mongo documents can still carry ObjectIds
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dumps(content) -> bytes:
+    return orjson.dumps(content, default=default)
+
+
+def encode_payload(content, cacheable: bool = False) -> EncodedPayload:
+    """
+    Encode ``content`` once. Payloads that are ``cacheable`` (cached and served many
+    times) also get their gzipped body and an ETag computed up front.
+    """
+    with span("serialise"):
+        body = dumps(content)
+        if not cacheable:
+            return EncodedPayload(body)
+        gzipped = gzip.compress(body, GZIP_LEVEL) if len(body) >= GZIP_MIN_SIZE else None
+        etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+    return EncodedPayload(body, gzipped, etag)
+
+
+def accepts_gzip(request: Request) -> bool:
+    accept_encoding = request.headers.get("accept-encoding", "")
+    for coding in accept_encoding.split(","):
+        name, _, params = coding.strip().partition(";")
+        if name.strip().lower() in ("gzip", "*"):
+            return params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+    return False
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison: a W/ prefix added by a proxy still matches
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+def json_response(request: Request, payload: EncodedPayload, headers: Optional[dict] = None,
+                  cache_control: Optional[str] = None) -> Response:
+    """
+    Send an encoded payload, pre-gzipped when available and accepted. Payloads with an
+    ETag answer a matching If-None-Match on GET/HEAD with 304.
+    """
+    headers = {"Vary": "Accept-Encoding", **(headers or {})}
+    if cache_control:
+        headers["Cache-Control"] = cache_control
+    if payload.etag:
+        headers["ETag"] = payload.etag
+        if request.method in ("GET", "HEAD") and etag_matches(request, payload.etag):
+            return Response(status_code=304, headers=headers)
+
+    if payload.gzipped is not None and accepts_gzip(request):
+        headers["Content-Encoding"] = "gzip"
+        return Response(content=payload.gzipped, media_type="application/json", headers=headers)
+    return Response(content=payload.body, media_type="application/json", headers=headers)
+
+
+class PayloadCache:
+    """
+    Encoded (and pre-gzipped) payload kept until the next sync of its source, e.g. the
+    breach catalog.
+
+    The generation is bumped on every invalidation, a build that raced with a sync is
+    returned to its caller but not cached.
+    """
+
+    def __init__(self):
+        self.generation = 0
+        self._payload: Optional[EncodedPayload] = None
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        self.generation += 1
+        self._payload = None
+
+    async def get_or_build(self, build: Callable[[], Awaitable[object]]) -> EncodedPayload:
+        if self._payload is not None:
+            return self._payload
+
+        # One request rebuilds the payload, concurrent ones wait for its result
+        async with self._lock:
+            if self._payload is not None:
+                return self._payload
+            generation = self.generation
+            payload = encode_payload(await build(), cacheable=True)
+            if generation == self.generation:
+                self._payload = payload
+            return payload
+
+
+catalog_cache = PayloadCache()
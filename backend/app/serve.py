@@ -0,0 +1,133 @@
+"""
+Production entry point.
+
+    python -m app.serve                       # one worker per core, settings from SERVER_*
+    python -m app.serve --workers 4 --port 8080
+
+Runs uvicorn with uvloop and httptools (when installed), a tuned keep-alive and listen
+backlog, worker recycling and proxy header support. Every worker is a separate process
+running the app lifespan, so each opens its own MongoDB pool and HIBP client after it
+starts; nothing is shared across the fork. The MongoDB pool budget is split between the
+workers through WEB_CONCURRENCY, and SECRET_KEY must be the same in every worker for
+tokens to be accepted by all of them.
+"""
+import argparse
+import importlib.util
+import logging
+import os
+import secrets
+from typing import List, Optional
+
+import uvicorn
+from uvicorn.supervisors import Multiprocess
+
+from app.config import ServerSettings, get_server_settings
+from app.log_pipeline import configure_logging, logging_config
+
+logger = logging.getLogger(__name__)
+
+APP = "app.main:app"
+
+
+def available_cores() -> int:
+    # Respects CPU affinity (taskset, container cpusets) where the platform exposes it
+    if hasattr(os, "sched_getaffinity"):
+        return max(1, len(os.sched_getaffinity(0)))
+    return max(1, os.cpu_count() or 1)
+
+
+def resolve_loop(loop: str) -> str:
+    if loop == "auto":
+        return "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+    return loop
+
+
+def resolve_http(http: str) -> str:
+    if http == "auto":
+        return "httptools" if importlib.util.find_spec("httptools") else "h11"
+    return http
+
+
+def supervised(options: dict) -> bool:
+    # Worker processes are spawned (and respawned after max_requests) by the supervisor
+    return options["workers"] > 1 or bool(options["limit_max_requests"])
+
+
+def prepare_environment(options: dict):
+    """
+    Environment inherited by the workers, set before they are spawned.
+    """
+    # DatabaseSettings gives each worker its share of MONGO_POOL_BUDGET
+    os.environ["WEB_CONCURRENCY"] = str(options["workers"])
+    if supervised(options) and not os.getenv("SECRET_KEY"):
+        # Shared by this run's workers, also the ones replacing recycled workers; tokens
+        # still do not survive a restart
+        os.environ["SECRET_KEY"] = secrets.token_hex(32)
+        logger.warning("SECRET_KEY is not set, generated one for this run; tokens are invalidated on restart")
+
+
+def uvicorn_options(settings: ServerSettings, app: str = APP) -> dict:
+    workers = settings.workers or available_cores()
+    return {
+        "app": app,
+        "host": settings.host,
+        "port": settings.port,
+        "workers": workers,
+        "loop": resolve_loop(settings.loop),
+        "http": resolve_http(settings.http),
+        "backlog": settings.backlog,
+        "timeout_keep_alive": settings.keep_alive_seconds,
+        "limit_concurrency": settings.limit_concurrency,
+        "limit_max_requests": settings.max_requests,
+        "timeout_graceful_shutdown": settings.graceful_shutdown_seconds,
+        "proxy_headers": settings.proxy_headers,
+        "forwarded_allow_ips": settings.forwarded_allow_ips,
+        # Every worker sets up the queued JSON log pipeline before importing the app,
+        # the level applies to uvicorn's own loggers
+        "log_config": logging_config(),
+        "log_level": settings.log_level,
+        "access_log": settings.access_log,
+        # The app opens its clients in the lifespan, startup fails if they cannot be
+        "lifespan": "on",
+    }
+
+
+def serve(options: dict):
+    config = uvicorn.Config(**options)
+    server = uvicorn.Server(config)
+    if not supervised(options):
+        server.run()
+        return
+    # The supervisor restarts workers that exit after max_requests, also a single one
+    # (a plain uvicorn server would just stop)
+    Multiprocess(config, target=server.run, sockets=[config.bind_socket()]).run()
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Run the Spearow backend")
+    parser.add_argument("--host", default=None)
+    parser.add_argument("--port", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument("--max-requests", type=int, default=None, help="recycle a worker after this many requests")
+    parser.add_argument("--app", default=APP, help="ASGI app import string")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    overrides = {
+        key: value
+        for key, value in (("host", args.host), ("port", args.port), ("workers", args.workers), ("max_requests", args.max_requests))
+        if value is not None
+    }
+    settings = get_server_settings().model_copy(update=overrides)
+
+    configure_logging()
+    options = uvicorn_options(settings, args.app)
+    prepare_environment(options)
+    logger.info(f"Starting {options['workers']} workers ({options['loop']}, {options['http']}) on {settings.host}:{settings.port}")
+    serve(options)
+
+
+if __name__ == "__main__":
+    main()
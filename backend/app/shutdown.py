@@ -0,0 +1,163 @@
+"""
+Graceful shutdown of the background work of a worker.
+
+Background jobs (upload processing, emails, ID previews) are started through
+``background_job`` and run as tasks the coordinator tracks. On shutdown the coordinator
+stops taking new jobs and gives the running ones until the drain deadline to finish,
+before the lifespan closes the MongoDB and HIBP clients under them. Jobs registered as
+resumable that are still running at the deadline, or that arrive once shutdown started,
+are checkpointed to the ``deferred_jobs`` collection and picked up by the next worker
+that starts, so a rolling deploy does not drop them. Resumed jobs run again from the
+start and must be safe to repeat.
+"""
+import asyncio
+import functools
+import logging
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+from app.config import ShutdownSettings, get_shutdown_settings
+from app.db import db
+from app.metrics import Counter, Gauge, queued_job
+
+logger = logging.getLogger(__name__)
+
+DEFERRED_COLLECTION = "deferred_jobs"
+
+JOBS_RUNNING = Gauge("background_jobs_running", "Background jobs tracked for graceful shutdown")
+SHUTDOWN_JOBS = Counter("shutdown_jobs_total", "Background jobs at shutdown by outcome", ("job", "outcome"))
+
+
+class ShutdownCoordinator:
+    """
+    Tracks running background jobs, drains them on shutdown and checkpoints the ones
+    that cannot finish in time.
+    """
+
+    def __init__(self, settings: Optional[ShutdownSettings] = None):
+        self._settings = settings
+        self._tasks: Set[asyncio.Task] = set()
+        self._resumable: Dict[str, Callable[..., Awaitable]] = {}
+        self._closing = False
+
+    @property
+    def settings(self) -> ShutdownSettings:
+        return self._settings or get_shutdown_settings()
+
+    @property
+    def closing(self) -> bool:
+        return self._closing
+
+    @property
+    def running(self) -> int:
+        return len(self._tasks)
+
+    def resumable(self, name: str, func: Callable[..., Awaitable]):
+        """
+        Register the function run for deferred jobs of this name, at import so it is
+        known before the deferred jobs are resumed. Its arguments are stored in MongoDB,
+        so they must be BSON values.
+        """
+        self._resumable[name] = func
+
+    async def run(self, name: str, func: Callable[..., Awaitable], *args):
+        if self._closing:
+            # Shutdown started, the job is left to the next worker
+            await self.defer(name, args)
+            return None
+
+        task = asyncio.create_task(self._guard(name, func, args))
+        self._tasks.add(task)
+        JOBS_RUNNING.set(len(self._tasks))
+        task.add_done_callback(self._forget)
+        # The job outlives the request it came from if the server cancels the request
+        return await asyncio.shield(task)
+
+    def _forget(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        JOBS_RUNNING.set(len(self._tasks))
+
+    async def _guard(self, name: str, func: Callable[..., Awaitable], args: tuple):
+        try:
+            return await func(*args)
+        except asyncio.CancelledError:
+            # Cut off by the drain deadline, the database is still open at this point
+            await self.defer(name, args)
+            raise
+
+    async def defer(self, name: str, args) -> bool:
+        if name not in self._resumable:
+            logger.warning(f"Background job {name} dropped at shutdown")
+            SHUTDOWN_JOBS.labels(name, "dropped").inc()
+            return False
+        try:
+            await db[DEFERRED_COLLECTION].insert_one({"job": name, "args": list(args), "deferred_at": datetime.utcnow()})
+        except Exception as e:
+            logger.error(f"Could not checkpoint background job {name}: {e}")
+            SHUTDOWN_JOBS.labels(name, "dropped").inc()
+            return False
+        SHUTDOWN_JOBS.labels(name, "checkpointed").inc()
+        return True
+
+    async def drain(self, timeout: Optional[float] = None) -> int:
+        """
+        Stop taking new jobs and wait for the running ones until the deadline. Jobs
+        still running then are cancelled and checkpointed. Returns how many were cut off.
+        """
+        self._closing = True
+        timeout = self.settings.drain_seconds if timeout is None else timeout
+        if not self._tasks:
+            return 0
+
+        logger.info(f"Waiting up to {timeout}s for {len(self._tasks)} background jobs")
+        _, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.warning(f"Checkpointing {len(pending)} background jobs still running at the drain deadline")
+            # Bounded as well, a worker that hangs here is killed without any checkpoint
+            await asyncio.wait(pending, timeout=self.settings.checkpoint_seconds)
+        return len(pending)
+
+    async def resume_deferred(self) -> int:
+        """
+        Run the jobs checkpointed by workers that shut down earlier. Each is claimed by
+        deleting it, so concurrent workers never run the same job twice.
+        """
+        resumed = 0
+        collection = db[DEFERRED_COLLECTION]
+        while not self._closing:
+            document = await collection.find_one_and_delete({}, sort=[("_id", 1)])
+            if document is None:
+                break
+            func = self._resumable.get(document["job"])
+            if func is None:
+                logger.error(f"No handler for the deferred background job {document['job']}")
+                continue
+            asyncio.create_task(self._resume(document["job"], func, document["args"]))
+            resumed += 1
+        if resumed:
+            logger.info(f"Resumed {resumed} deferred background jobs")
+        return resumed
+
+    async def _resume(self, name: str, func: Callable[..., Awaitable], args: list):
+        try:
+            await queued_job(name, functools.partial(self.run, name, func))(*args)
+        except Exception as e:
+            logger.error(f"Deferred background job {name} failed: {e}")
+
+    def start(self) -> asyncio.Task:
+        # Taking jobs again matters when one process runs several lifespans (tests)
+        self._closing = False
+        return asyncio.create_task(self.resume_deferred())
+
+
+shutdown_coordinator = ShutdownCoordinator()
+
+
+def background_job(name: str, func: Callable[..., Awaitable]):
+    """
+    Wrap a function for ``BackgroundTasks.add_task``: counted in the job queue depth and
+    tracked for graceful shutdown, checkpointed if it is resumable and cannot finish.
+    """
+    return queued_job(name, functools.partial(shutdown_coordinator.run, name, func))
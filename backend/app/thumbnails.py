@@ -0,0 +1,211 @@
+"""
+Previews of uploaded ID images.
+
+After an ID image is stored, a downscaled copy without EXIF metadata is rendered in a
+process pool (decoding and resizing is CPU bound and would stall the event loop) and
+its path is stored on the user as ``id_preview``. Previews are content-addressed like
+the documents, so they never change. They are kept outside the public storage
+directory (``ID_UPLOAD_PREVIEW_DIR``) and served to admins with immutable, private
+cache headers (shared caches must not keep an ID image); the full-size file is only
+fetched when an admin opens it.
+
+    python -m app.thumbnails backfill    # previews for documents uploaded before, and
+                                         # older ones moved out of the storage directory
+"""
+import argparse
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from app.config import IdUploadSettings, get_id_upload_settings
+from app.db import db, connect_to_mongo, close_mongo_connection
+from app.id_storage import PUBLIC_PREFIX, StoredDocument, sniff_type
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_ROUTE = "id-previews"
+# Where previews were written before they moved out of the public storage directory
+LEGACY_PREVIEW_DIR = "previews"
+
+# Previews are immutable: a new upload gets a new content hash and a new url. They are
+# ID images behind the admin check, only the admin's browser may cache them
+PREVIEW_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+PREVIEWABLE_TYPES = {"image/jpeg", "image/png", "image/webp"}
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def preview_name(sha256: str, settings: IdUploadSettings) -> str:
+    extension = "webp" if settings.preview_format == "webp" else "jpg"
+    return f"{sha256}-{settings.preview_max_size}.{extension}"
+
+
+def preview_file(sha256: str, settings: IdUploadSettings) -> str:
+    return os.path.join(settings.preview_dir, sha256[:2], preview_name(sha256, settings))
+
+
+def document_file(path: str, settings: IdUploadSettings) -> str:
+    # "uploaded_ids/ab/ab12....jpg" -> file under the storage directory
+    relative = path.split(f"{PUBLIC_PREFIX}/", 1)[-1]
+    return os.path.join(settings.dir, *relative.split("/"))
+
+
+def render_preview(source: str, target: str, max_size: int, image_format: str, quality: int) -> tuple:
+    """
+    Downscale ``source`` into ``target``. Runs in a worker process.
+    """
+    # Pillow is loaded by the preview workers, not by every web worker at startup
+    from PIL import Image, ImageOps
+
+    with Image.open(source) as image:
+        # JPEGs can be decoded straight at a reduced scale
+        image.draft("RGB", (max_size, max_size))
+        # Apply the EXIF orientation, the metadata itself is not copied
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_size, max_size), Image.LANCZOS)
+        if image_format == "jpeg" or image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGB")
+
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(target), prefix=".preview-")
+        try:
+            with os.fdopen(descriptor, "wb") as output:
+                image.save(output, format=image_format.upper(), quality=quality, optimize=image_format == "jpeg")
+            os.replace(temp_path, target)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+        return image.size
+
+
+def get_pool(settings: IdUploadSettings) -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: forking a process that runs the event loop and Motor's threads is unsafe
+        _pool = ProcessPoolExecutor(max_workers=settings.preview_workers, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def shutdown_preview_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+async def create_preview(document: StoredDocument, settings: Optional[IdUploadSettings] = None) -> Optional[str]:
+    """
+    Render the preview of a stored document, returning its url path, or None for
+    documents that are not images.
+    """
+    settings = settings or get_id_upload_settings()
+    if document.content_type not in PREVIEWABLE_TYPES:
+        return None
+
+    target = preview_file(document.sha256, settings)
+    if not os.path.exists(target):
+        await asyncio.get_running_loop().run_in_executor(
+            get_pool(settings),
+            render_preview,
+            document_file(document.path, settings),
+            target,
+            settings.preview_max_size,
+            settings.preview_format,
+            settings.preview_quality,
+        )
+    return f"{PREVIEW_ROUTE}/{document.sha256[:2]}/{preview_name(document.sha256, settings)}"
+
+
+async def store_preview(user_email: str, document: StoredDocument):
+    # Background task run after an ID upload
+    try:
+        preview = await create_preview(document)
+    except Exception as e:
+        logger.error(f"Could not create the ID preview of {user_email}: {e}")
+        return
+    if preview:
+        # Only if the user has not uploaded another document in the meantime
+        await db.users.update_one({"email": user_email, "id_file": document.path}, {"$set": {"id_preview": preview}})
+
+
+# -------------------------- Backfill --------------------------
+
+def describe_document(path: str, settings: IdUploadSettings) -> Optional[StoredDocument]:
+    # Documents uploaded before content addressing, hashed from disk
+    filename = document_file(path, settings)
+    if not os.path.isfile(filename):
+        return None
+    digest = hashlib.sha256()
+    with open(filename, "rb") as document:
+        head = document.read(64 * 1024)
+        digest.update(head)
+        for chunk in iter(lambda: document.read(64 * 1024), b""):
+            digest.update(chunk)
+
+    detected = sniff_type(head)
+    if detected is None:
+        return None
+    return StoredDocument(path, digest.hexdigest(), os.path.getsize(filename), detected[0])
+
+
+def move_legacy_previews(settings: IdUploadSettings, dry_run: bool = False) -> int:
+    # Previews rendered into the public storage directory are moved to the private one
+    legacy = os.path.join(settings.dir, LEGACY_PREVIEW_DIR)
+    moved = 0
+    for root, _, files in os.walk(legacy):
+        for name in files:
+            if name.startswith(".preview-"):
+                continue
+            moved += 1
+            if not dry_run:
+                target = os.path.join(settings.preview_dir, os.path.relpath(os.path.join(root, name), legacy))
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(os.path.join(root, name), target)
+    if not dry_run and os.path.isdir(legacy):
+        shutil.rmtree(legacy)
+    return moved
+
+
+async def backfill(dry_run: bool = False) -> int:
+    settings = get_id_upload_settings()
+    created = 0
+    users = db.users.find({"id_file": {"$exists": True}, "id_preview": {"$exists": False}}, {"email": 1, "id_file": 1})
+    async for user in users:
+        document = await asyncio.to_thread(describe_document, user["id_file"], settings)
+        if document is None or document.content_type not in PREVIEWABLE_TYPES:
+            continue
+        created += 1
+        if not dry_run:
+            await store_preview(user["email"], document)
+    return created
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ID document previews")
+    parser.add_argument("command", choices=["backfill"])
+    parser.add_argument("--dry-run", action="store_true", help="count the documents without rendering")
+    args = parser.parse_args()
+
+    async def run():
+        await connect_to_mongo()
+        try:
+            moved = await asyncio.to_thread(move_legacy_previews, get_id_upload_settings(), args.dry_run)
+            created = await backfill(args.dry_run)
+            print(f"{'Would move' if args.dry_run else 'Moved'} {moved} and {'would create' if args.dry_run else 'created'} {created} previews")
+        finally:
+            shutdown_preview_pool()
+            await close_mongo_connection()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
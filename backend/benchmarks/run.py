@@ -0,0 +1,319 @@
+"""
+Benchmark runner for the backend's hot paths.
+
+The app runs against local stand-ins only: a fake HIBP API, an SMTP sink and either an
+in-memory mongomock database or a local mongod. Each scenario is warmed up, run with a
+fixed number of requests at a given concurrency, and reported as throughput plus
+p50/p95/p99 latency, with the HIBP calls it made. Results are compared against a stored
+baseline and the run fails when a scenario regresses past the tolerance, or when an
+upload fails its background processing.
+
+    python -m benchmarks.run                              # in-process, mongomock
+    python -m benchmarks.run --mongo real                 # local mongod from MONGO_URL
+    python -m benchmarks.run --scenario allbreaches -n 500 -c 20
+    python -m benchmarks.run --scenario site_miss --hibp-latency-ms 200 --hibp-429-ratio 0.1
+    python -m benchmarks.run --save-baseline              # record a new baseline
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import platform
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from benchmarks.scenarios import (
+    MAX_CONCURRENCY, MAX_REQUESTS, PREPARE, SCENARIOS, BenchContext, authenticate, seed_database, seed_documents, upload_body,
+)
+from benchmarks.standins import AsyncMongoMockClient, FakeHibp, SmtpSink
+
+BASELINE_PATH = Path(__file__).with_name("baseline.json")
+BENCH_DB_NAME = "spearow_bench"
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    # Nearest-rank percentile over the raw samples
+    if not sorted_values:
+        return 0.0
+    rank = max(1, min(len(sorted_values), math.ceil(q * len(sorted_values))))
+    return sorted_values[rank - 1]
+
+
+def summarise(latencies: List[float], elapsed: float, errors: int) -> dict:
+    ordered = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(ordered, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 2),
+    }
+
+
+async def run_scenario(context: BenchContext, name: str, requests: int, concurrency: int, warmup: int) -> dict:
+    scenario = SCENARIOS[name]
+    prepare = PREPARE.get(name)
+    concurrency = min(concurrency, MAX_CONCURRENCY.get(name, concurrency))
+    if name in MAX_REQUESTS:
+        requests = min(requests, MAX_REQUESTS[name])
+        warmup = min(warmup, max(1, requests // 10))
+
+    for sequence in range(warmup):
+        if prepare:
+            await prepare(context, sequence)
+        await scenario(context, sequence)
+
+    latencies: List[float] = []
+    errors = 0
+    sequences = iter(range(warmup, warmup + requests))
+
+    async def worker():
+        nonlocal errors
+        for sequence in sequences:
+            if prepare:
+                await prepare(context, sequence)
+            start = time.perf_counter()
+            response = await scenario(context, sequence)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarise(latencies, time.perf_counter() - start, errors)
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    """
+    Scenarios whose p95 latency grew, or whose throughput dropped, by more than ``tolerance``.
+    """
+    regressions = []
+    for name, result in results.items():
+        expected = baseline.get(name)
+        if not expected:
+            continue
+        if result["p95_ms"] > expected["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {result['p95_ms']}ms vs baseline {expected['p95_ms']}ms")
+        if result["throughput_rps"] < expected["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{name}: {result['throughput_rps']} req/s vs baseline {expected['throughput_rps']} req/s")
+    return regressions
+
+
+def print_table(results: Dict[str, dict], baseline: Dict[str, dict]):
+    header = (f"{'scenario':<22} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7} "
+              f"{'HIBP':>6} {'p95 vs base':>12}")
+    print(header)
+    print("-" * len(header))
+    for name, result in results.items():
+        expected = baseline.get(name)
+        delta = f"{(result['p95_ms'] / expected['p95_ms'] - 1) * 100:+.1f}%" if expected and expected["p95_ms"] else "-"
+        print(f"{name:<22} {result['throughput_rps']:>9} {result['p50_ms']:>9} {result['p95_ms']:>9} "
+              f"{result['p99_ms']:>9} {result['errors']:>7} {result.get('hibp_calls', 0):>6} {delta:>12}")
+
+
+async def failed_uploads(database, user_ids: list, timeout: float = 30.0) -> int:
+    """
+    Uploads of the run whose background processing failed, or had not finished within
+    ``timeout`` (a server run processes them after answering).
+    """
+    scope = {"user_id": {"$in": user_ids}}
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if not await database.uploads.count_documents({**scope, "processed": False, "status": {"$ne": "error"}}):
+            break
+        await asyncio.sleep(0.1)
+    return await database.uploads.count_documents({**scope, "processed": {"$ne": True}})
+
+
+def configure_environment(args, hibp: FakeHibp, smtp: SmtpSink):
+    # Must run before the app is imported: these are read at import time
+    os.environ.update({
+        "HIBP_API_URL": hibp.url,
+        "API_KEY": "bench",
+        "MAIL_SERVER": "127.0.0.1",
+        "MAIL_PORT": str(smtp.port),
+        "MAIL_STARTTLS": "false",
+        "MAIL_USE_CREDENTIALS": "false",
+        "MAIL_VALIDATE_CERTS": "false",
+        # Every simulated login comes from one address and asks for an OTP email
+        "LOGIN_THROTTLE_OTP_EMAILS_PER_WINDOW": "1000000",
+    })
+    os.environ.setdefault("MONGO_DB_NAME", BENCH_DB_NAME)
+    if args.mongo == "real":
+        os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+
+
+def install_mongomock():
+    import app.db
+
+    settings = app.db.get_database_settings()
+    app.db.client = AsyncMongoMockClient()
+    app.db.database = app.db.client[settings.db_name]
+
+
+async def run_in_process(args, context_factory) -> Tuple[Dict[str, dict], int]:
+    from asgi_lifespan import LifespanManager
+
+    if args.mongo == "mock":
+        install_mongomock()
+    from app.main import app
+    from app.db import db
+
+    # connect_to_mongo keeps an already installed client
+    async with LifespanManager(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            return await context_factory(client, db)
+
+
+async def run_external(args, context_factory) -> Tuple[Dict[str, dict], int]:
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    mongo = AsyncIOMotorClient(os.environ["MONGO_URL"])
+    try:
+        async with httpx.AsyncClient(base_url=args.base_url, timeout=60) as client:
+            return await context_factory(client, mongo[os.environ["MONGO_DB_NAME"]])
+    finally:
+        mongo.close()
+
+
+async def main_async(args) -> int:
+    hibp = FakeHibp(
+        latency_ms=args.hibp_latency_ms,
+        rate_limit_ratio=args.hibp_429_ratio,
+        retry_after=args.hibp_retry_after,
+        catalog_size=args.catalog_size,
+        account_breaches=args.hibp_account_breaches,
+        description_words=args.hibp_description_words,
+        port=args.hibp_port,
+    )
+    smtp = SmtpSink(port=args.smtp_port)
+    hibp.start()
+    await smtp.start()
+    configure_environment(args, hibp, smtp)
+    if args.base_url:
+        print(f"Fake HIBP on {hibp.url}, SMTP sink on 127.0.0.1:{smtp.port}; start the server with "
+              f"HIBP_API_URL, MAIL_SERVER/MAIL_PORT and MONGO_URL pointing at them")
+
+    names = args.scenario or list(SCENARIOS)
+
+    async def run_all(client: httpx.AsyncClient, database) -> Tuple[Dict[str, dict], int]:
+        users, admin, catalog = seed_documents(args.users, hibp.catalog)
+        await seed_database(database, users, admin, catalog)
+        context = BenchContext(
+            client=client,
+            users=[user["email"] for user in users],
+            admin_email=admin["email"],
+            database=database,
+            upload_body=upload_body(args.upload_records),
+        )
+        await authenticate(context)
+
+        results = {}
+        for name in names:
+            calls, rate_limited = hibp.requests, hibp.rate_limited
+            results[name] = await run_scenario(context, name, args.requests, args.concurrency, args.warmup)
+            # Warm-up included, the calls a scenario makes do not depend on the timing
+            results[name]["hibp_calls"] = hibp.requests - calls
+            results[name]["hibp_rate_limited"] = hibp.rate_limited - rate_limited
+            print(f"  {name}: done", file=sys.stderr)
+        return results, await failed_uploads(database, [user["_id"] for user in users])
+
+    try:
+        if args.base_url:
+            results, upload_failures = await run_external(args, run_all)
+        else:
+            results, upload_failures = await run_in_process(args, run_all)
+    finally:
+        await smtp.stop()
+        hibp.stop()
+
+    baseline_file = Path(args.baseline)
+    stored = json.loads(baseline_file.read_text()) if baseline_file.exists() else {}
+    baseline = stored.get("scenarios", {})
+
+    print_table(results, baseline)
+    print(f"\nHIBP calls: {hibp.requests} ({hibp.rate_limited} rate limited), emails sent: {smtp.messages}")
+
+    if upload_failures:
+        # The timings of a run whose uploads failed to process are not comparable
+        print(f"\n{upload_failures} uploads failed background processing, see the server log")
+        return 1
+
+    if args.output:
+        Path(args.output).write_text(json.dumps({"scenarios": results}, indent=2) + "\n")
+
+    if args.save_baseline:
+        baseline_file.write_text(json.dumps({
+            "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "environment": {
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "mongo": args.mongo if not args.base_url else "external",
+                "requests": args.requests,
+                "concurrency": args.concurrency,
+                "users": args.users,
+                "catalog_size": args.catalog_size,
+                "hibp_latency_ms": args.hibp_latency_ms,
+                "hibp_429_ratio": args.hibp_429_ratio,
+                "hibp_retry_after": args.hibp_retry_after,
+                "hibp_account_breaches": args.hibp_account_breaches,
+                "hibp_description_words": args.hibp_description_words,
+            },
+            "scenarios": {**baseline, **results},
+        }, indent=2) + "\n")
+        print(f"Baseline saved to {baseline_file}")
+        return 0
+
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print("\nRegressions against baseline:")
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1
+    return 0
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Benchmark the backend against local stand-ins.")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="scenario to run, repeatable (default: all)")
+    parser.add_argument("-n", "--requests", type=int, default=200, help="timed requests per scenario")
+    parser.add_argument("-c", "--concurrency", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=20, help="untimed requests per scenario")
+    parser.add_argument("--users", type=int, default=20, help="seeded users to spread requests over")
+    parser.add_argument("--upload-records", type=int, default=200, help="records in the data upload payload")
+    parser.add_argument("--catalog-size", type=int, default=800, help="breaches in the fake HIBP catalog")
+    parser.add_argument("--hibp-latency-ms", type=float, default=20.0, help="added latency of the fake HIBP API")
+    parser.add_argument("--hibp-429-ratio", type=float, default=0.0, help="share of HIBP calls answered with 429")
+    parser.add_argument("--hibp-retry-after", type=int, default=0, help="Retry-After seconds of the fake 429s")
+    parser.add_argument("--hibp-account-breaches", type=int, default=10, help="breaches per breached account lookup")
+    parser.add_argument("--hibp-description-words", type=int, default=40, help="words per breach description, sizes the catalog payload")
+    parser.add_argument("--hibp-port", type=int, default=None)
+    parser.add_argument("--smtp-port", type=int, default=None)
+    parser.add_argument("--mongo", choices=("mock", "real"), default="mock", help="mongomock in memory or a local mongod (MONGO_URL)")
+    parser.add_argument("--base-url", default=None, help="benchmark a running server instead of the app in-process")
+    parser.add_argument("--baseline", default=str(BASELINE_PATH))
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative regression before failing")
+    parser.add_argument("--output", default=None, help="also write the results as JSON to this path")
+    args = parser.parse_args(argv)
+    if args.base_url and args.mongo == "mock":
+        parser.error("--base-url needs --mongo real, the server and the runner must share a database")
+    return args
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    # Per-request client logging would dominate the output and the timings
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    return asyncio.run(main_async(parse_args(argv)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,229 @@
+"""
+Request scenarios exercised by the benchmark runner, plus the seed data they rely on.
+
+Every scenario is an async callable taking the shared ``BenchContext`` and a sequence
+number, returning the HTTP response of the request that is being timed. Scenarios that
+need the database in a given state (an unscanned user, no catalog yet) have a ``PREPARE``
+step, run before each request outside the timing.
+"""
+import asyncio
+import json
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List
+
+import httpx
+import pyotp
+from bson import ObjectId
+from passlib.context import CryptContext
+
+PASSWORD = "bench-password"
+OTP_SECRET = "JBSWY3DPEHPK3PXP"
+
+
+@dataclass
+class BenchContext:
+    client: httpx.AsyncClient
+    users: List[str]
+    admin_email: str
+    database: Any = None
+    tokens: Dict[str, str] = field(default_factory=dict)
+    admin_token: str = ""
+    upload_body: bytes = b""
+    catalog_etag: str = ""
+
+    def user(self, sequence: int) -> str:
+        return self.users[sequence % len(self.users)]
+
+    def token(self, sequence: int) -> str:
+        return self.tokens[self.user(sequence)]
+
+
+# -------------------------- Seed data --------------------------
+
+def user_breaches(email: str, name: str, catalog: list, count: int) -> dict:
+    start = sum(email.encode()) % max(1, len(catalog) - count)
+    return {
+        "Name": name,
+        "Email": email,
+        "ReportGeneratedAt": datetime.utcnow().date().isoformat(),
+        "Report": [{"Name": breach["Name"]} for breach in catalog[start:start + count]],
+    }
+
+
+def seed_documents(user_count: int, catalog: list, breaches_per_user: int = 10):
+    """
+    Users (sharing one bcrypt hash and OTP secret), one admin and the breach catalog.
+    """
+    password_hash = CryptContext(schemes=["bcrypt"], deprecated="auto").hash(PASSWORD)
+    users = []
+    for index in range(user_count):
+        email = f"user{index}@bench.example.com"
+        users.append({
+            "_id": ObjectId(),
+            "name": f"Bench User {index}",
+            "email": email,
+            "password": password_hash,
+            "secret_key": OTP_SECRET,
+            "user_type": "standard",
+            "verified": True,
+            "breaches": user_breaches(email, f"Bench User {index}", catalog, breaches_per_user),
+        })
+    admin = {
+        "_id": ObjectId(),
+        "name": "Bench Admin",
+        "email": "admin@bench.example.com",
+        "password": password_hash,
+        "secret_key": OTP_SECRET,
+        "user_type": "admin",
+        "verified": True,
+    }
+    return users, admin, [dict(breach) for breach in catalog]
+
+
+async def seed_database(database, users: list, admin: dict, catalog: list):
+    await database.users.delete_many({"email": {"$regex": "@bench\\.example\\.com$"}})
+    await database.users.insert_many(users + [admin])
+    await database.breaches.delete_many({})
+    await database.breaches.insert_many(catalog)
+
+
+def upload_body(records: int) -> bytes:
+    # Keyed by HIBP data class, the shape process_content keeps
+    return json.dumps({
+        "Email addresses": [f"leak{index}@example.com" for index in range(records)],
+        "Passwords": ["hunter2"] * records,
+        "Usernames": [f"leak{index}" for index in range(records)],
+    }).encode()
+
+
+# -------------------------- Authentication --------------------------
+
+async def login(client: httpx.AsyncClient, email: str) -> httpx.Response:
+    # Two stage login: the password triggers an OTP email, the second call carries the OTP
+    response = await client.post("/login", json={"email": email, "password": PASSWORD})
+    response.raise_for_status()
+    return await client.post("/login", json={"email": email, "password": PASSWORD, "otp": pyotp.TOTP(OTP_SECRET).now()})
+
+
+async def authenticate(context: BenchContext):
+    for email in context.users:
+        response = await login(context.client, email)
+        response.raise_for_status()
+        context.tokens[email] = response.json()["token"]
+    response = await login(context.client, context.admin_email)
+    response.raise_for_status()
+    context.admin_token = response.json()["token"]
+
+
+# -------------------------- Scenarios --------------------------
+
+async def login_otp(context: BenchContext, sequence: int) -> httpx.Response:
+    return await login(context.client, context.user(sequence))
+
+
+def user_report(report_format: str):
+    async def scenario(context: BenchContext, sequence: int) -> httpx.Response:
+        return await context.client.post("/reports", json={
+            "reportType": "user",
+            "reportFormat": report_format,
+            "token": context.token(sequence),
+        })
+    return scenario
+
+
+async def allbreaches(context: BenchContext, sequence: int) -> httpx.Response:
+    return await context.client.post("/reports", json={
+        "reportType": "detailed",
+        "reportCategory": "allbreaches",
+        "reportFormat": "json",
+        "token": context.token(sequence),
+    })
+
+
+async def site_miss(context: BenchContext, sequence: int) -> httpx.Response:
+    # Not in the catalog and too far from any name to fuzzy match, so HIBP answers 404
+    return await context.client.post("/reports", json={
+        "reportType": "detailed",
+        "reportCategory": f"Unlisted{sequence}",
+        "reportFormat": "json",
+        "token": context.token(sequence),
+    })
+
+
+async def catalog_revalidate(context: BenchContext, sequence: int) -> httpx.Response:
+    # A repeat client sending back the catalog's ETag
+    headers = {"Accept-Encoding": "gzip"}
+    if context.catalog_etag:
+        headers["If-None-Match"] = context.catalog_etag
+    response = await context.client.get("/breaches", headers=headers)
+    context.catalog_etag = response.headers.get("etag", "")
+    return response
+
+
+async def data_upload(context: BenchContext, sequence: int) -> httpx.Response:
+    return await context.client.post(
+        "/data-upload",
+        files={"file": ("leak.json", context.upload_body, "application/json")},
+        headers={"Authorization": f"Bearer {context.token(sequence)}"},
+    )
+
+
+async def admin_listing(context: BenchContext, sequence: int) -> httpx.Response:
+    return await context.client.get(
+        "/admin/users",
+        params={"limit": 50},
+        headers={"Authorization": f"Bearer {context.admin_token}"},
+    )
+
+
+# -------------------------- Preparation --------------------------
+
+async def forget_user_report(context: BenchContext, sequence: int):
+    # The next report of the user is looked up on HIBP
+    await context.database.users.update_one({"email": context.user(sequence)}, {"$unset": {"breaches": ""}})
+
+
+async def drop_catalog(context: BenchContext, sequence: int):
+    # The next allbreaches fetches and stores the whole catalog from HIBP. The encoded
+    # catalog cached by the app is dropped through the invalidation bus, as a catalog
+    # sync of another worker would, and the wait lets the bus deliver it
+    from app.invalidation import BREACH_CATALOG
+    from app.config import get_invalidation_settings
+
+    settings = get_invalidation_settings()
+    await context.database.breaches.drop()
+    await context.database[settings.collection].insert_one(
+        {"key": BREACH_CATALOG, "origin": "benchmark", "published_at": datetime.utcnow()},
+    )
+    await asyncio.sleep(settings.poll_seconds * 2)
+
+
+SCENARIOS: Dict[str, Callable[[BenchContext, int], Awaitable[httpx.Response]]] = {
+    "login_otp": login_otp,
+    "user_report_json": user_report("json"),
+    "user_report_pdf": user_report("pdf"),
+    "user_report_csv": user_report("csv"),
+    "user_report_unscanned": user_report("json"),
+    "allbreaches": allbreaches,
+    "allbreaches_cold": allbreaches,
+    "site_miss": site_miss,
+    "catalog_revalidate": catalog_revalidate,
+    "data_upload": data_upload,
+    "admin_listing": admin_listing,
+}
+
+PREPARE: Dict[str, Callable[[BenchContext, int], Awaitable[None]]] = {
+    "user_report_unscanned": forget_user_report,
+    "allbreaches_cold": drop_catalog,
+}
+
+# Scenarios that cannot overlap: concurrent cold fetches would each store the catalog
+MAX_CONCURRENCY: Dict[str, int] = {
+    "allbreaches_cold": 1,
+}
+
+# Scenarios whose preparation is slow run fewer requests, and a tenth as many warm-ups
+MAX_REQUESTS: Dict[str, int] = {
+    "allbreaches_cold": 20,
+}
@@ -0,0 +1,73 @@
+"""
+Serialisation CPU per request for report payloads.
+
+Compares FastAPI's default JSON path (jsonable_encoder + stdlib json, as in
+JSONResponse) against the orjson path used by /reports, with and without gzip, and the
+cached catalog. Times are CPU time per response.
+
+    python -m benchmarks.serialization
+    python -m benchmarks.serialization --catalog-size 2000 --iterations 50
+"""
+import argparse
+import gzip
+import json
+import time
+from typing import Callable, List, Optional
+
+from fastapi.encoders import jsonable_encoder
+
+from app.models.report import UserReport
+from app.serialization import GZIP_LEVEL, dumps
+from benchmarks.standins import make_catalog
+
+
+def stdlib_render(content) -> bytes:
+    # What FastAPI does for a plain return value
+    return json.dumps(jsonable_encoder(content), ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def cpu_per_call(func: Callable[[], bytes], iterations: int) -> float:
+    func()
+    start = time.process_time()
+    for _ in range(iterations):
+        func()
+    return (time.process_time() - start) / iterations
+
+
+def run(catalog_size: int, iterations: int) -> List[tuple]:
+    catalog = make_catalog(catalog_size)
+    report = UserReport(Name="Bench User", Email="user@bench.example.com", Report=[{"Name": breach["Name"]} for breach in catalog[:25]])
+    cached_body = dumps(catalog)
+    cached_gzip = gzip.compress(cached_body, GZIP_LEVEL)
+
+    cases = [
+        ("catalog", "jsonable_encoder + json", lambda: stdlib_render(catalog)),
+        ("catalog", "orjson", lambda: dumps(catalog)),
+        ("catalog", "orjson + gzip", lambda: gzip.compress(dumps(catalog), GZIP_LEVEL)),
+        ("catalog", "cached bytes (gzip)", lambda: cached_gzip),
+        # The user report used to be returned as model_dump_json() and encoded again
+        ("user report", "model_dump_json + json", lambda: stdlib_render(report.model_dump_json())),
+        ("user report", "model_dump + orjson", lambda: dumps(report.model_dump())),
+    ]
+
+    results = []
+    for payload, method, func in cases:
+        body = func()
+        results.append((payload, method, cpu_per_call(func, iterations) * 1000, len(body)))
+    return results
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Measure serialisation CPU per report response.")
+    parser.add_argument("--catalog-size", type=int, default=800)
+    parser.add_argument("--iterations", type=int, default=30)
+    args = parser.parse_args(argv)
+
+    print(f"{'payload':<12} {'method':<26} {'CPU ms/req':>11} {'bytes':>10}")
+    print("-" * 62)
+    for payload, method, cpu_ms, size in run(args.catalog_size, args.iterations):
+        print(f"{payload:<12} {method:<26} {cpu_ms:>11.3f} {size:>10}")
+
+
+if __name__ == "__main__":
+    main()
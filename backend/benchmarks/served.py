@@ -0,0 +1,38 @@
+"""
+The app over an in-memory database that is seeded when the worker imports it, so the
+launcher can be benchmarked without a mongod:
+
+    python -m app.serve --app benchmarks.served:app
+
+Every worker seeds its own copy from the same deterministic users and catalog
+(BENCH_USERS, BENCH_CATALOG_SIZE), which suits the read and login scenarios. Writes
+made through one worker are not seen by the others.
+"""
+import os
+
+import app.db as app_db
+from app.config import get_database_settings
+from benchmarks.scenarios import seed_documents
+from benchmarks.standins import AsyncMongoMockClient, make_catalog
+
+
+def install_seeded_mongomock():
+    settings = get_database_settings()
+    client = AsyncMongoMockClient()
+    users, admin, catalog = seed_documents(
+        int(os.getenv("BENCH_USERS", "20")),
+        make_catalog(int(os.getenv("BENCH_CATALOG_SIZE", "800"))),
+    )
+    # Seeded through the synchronous mongomock client, there is no event loop yet
+    database = client._client[settings.db_name]
+    database.users.insert_many(users + [admin])
+    database.breaches.insert_many(catalog)
+
+    # connect_to_mongo keeps an already installed client
+    app_db.client = client
+    app_db.database = client[settings.db_name]
+
+
+install_seeded_mongomock()
+
+from app.main import app  # noqa: E402
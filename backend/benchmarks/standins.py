@@ -0,0 +1,321 @@
+"""
+Local stand-ins for the services the backend talks to: a fake HIBP API, an SMTP sink
+and an in-memory MongoDB built on mongomock.
+"""
+import asyncio
+import random
+import socket
+import threading
+import time
+from typing import Optional
+
+import mongomock
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+DATA_CLASSES = [
+    "Email addresses", "Passwords", "Usernames", "IP addresses", "Names", "Phone numbers",
+    "Dates of birth", "Physical addresses", "Security questions and answers", "Genders",
+]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def make_breach(index: int, description_words: int = 40) -> dict:
+    name = f"Breach{index:05d}"
+    rng = random.Random(index)
+    return {
+        "Name": name,
+        "Title": f"Breach {index}",
+        "Domain": f"breach{index}.example.com",
+        "BreachDate": f"{2010 + index % 14}-0{1 + index % 9}-1{index % 9}",
+        "AddedDate": "2024-01-01T00:00:00Z",
+        "ModifiedDate": "2024-01-01T00:00:00Z",
+        "PwnCount": rng.randint(1_000, 50_000_000),
+        "Description": " ".join(rng.choice(["<a href='#'>data</a>", "breach", "accounts", "exposed", "passwords"]) for _ in range(description_words)),
+        "LogoPath": f"https://logos.example.com/{name}.png",
+        "DataClasses": rng.sample(DATA_CLASSES, 4),
+        "IsVerified": index % 5 != 0,
+        "IsFabricated": False,
+        "IsSensitive": index % 17 == 0,
+        "IsRetired": False,
+        "IsSpamList": False,
+        "IsMalware": False,
+        "IsSubscriptionFree": False,
+    }
+
+
+def make_catalog(size: int, description_words: int = 40) -> list:
+    return [make_breach(index, description_words) for index in range(size)]
+
+
+# -------------------------- Fake HIBP API --------------------------
+
+class FakeHibp:
+    """
+    HIBP v3 API stand-in with configurable latency, 429 responses and payload sizes.
+    """
+
+    def __init__(self, latency_ms: float = 0.0, rate_limit_ratio: float = 0.0, retry_after: int = 0,
+                 catalog_size: int = 800, account_breaches: int = 10, description_words: int = 40,
+                 port: Optional[int] = None):
+        self.latency = latency_ms / 1000
+        self.rate_limit_ratio = rate_limit_ratio
+        self.retry_after = retry_after
+        self.catalog = make_catalog(catalog_size, description_words)
+        self.by_name = {breach["Name"]: breach for breach in self.catalog}
+        self.account_breaches = account_breaches
+        self.requests = 0
+        self.rate_limited = 0
+        self._random = random.Random(0)
+        self.app = Starlette(routes=[
+            Route("/api/v3/breaches", self.breaches),
+            Route("/api/v3/breach/{name}", self.breach),
+            Route("/api/v3/latestbreach", self.latest_breach),
+            Route("/api/v3/breachedaccount/{account}", self.breached_account),
+            Route("/api/v3/dataclasses", self.data_classes),
+        ])
+        self._server: Optional[uvicorn.Server] = None
+        self._thread: Optional[threading.Thread] = None
+        self.port = port or free_port()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/api/v3"
+
+    async def _respond(self, payload, status_code: int = 200) -> Response:
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.rate_limit_ratio and self._random.random() < self.rate_limit_ratio:
+            self.rate_limited += 1
+            return JSONResponse({"statusCode": 429}, status_code=429, headers={"Retry-After": str(self.retry_after)})
+        return JSONResponse(payload, status_code=status_code)
+
+    async def breaches(self, request: Request):
+        return await self._respond(self.catalog)
+
+    async def breach(self, request: Request):
+        breach = self.by_name.get(request.path_params["name"])
+        return await self._respond(breach, 200) if breach else await self._respond(None, 404)
+
+    async def latest_breach(self, request: Request):
+        return await self._respond(self.catalog[-1])
+
+    async def breached_account(self, request: Request):
+        account = request.path_params["account"]
+        if account.startswith("clean"):
+            return await self._respond(None, 404)
+        start = sum(account.encode()) % max(1, len(self.catalog) - self.account_breaches)
+        return await self._respond([{"Name": breach["Name"]} for breach in self.catalog[start:start + self.account_breaches]])
+
+    async def data_classes(self, request: Request):
+        return await self._respond(DATA_CLASSES)
+
+    def start(self):
+        config = uvicorn.Config(self.app, host="127.0.0.1", port=self.port, log_level="warning", lifespan="off")
+        self._server = uvicorn.Server(config)
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+        self._thread.start()
+        deadline = time.monotonic() + 10
+        while not self._server.started:
+            if time.monotonic() > deadline:
+                raise RuntimeError("Fake HIBP server did not start")
+            time.sleep(0.01)
+
+    def stop(self):
+        if self._server is not None:
+            self._server.should_exit = True
+            self._thread.join(timeout=5)
+
+
+# -------------------------- SMTP sink --------------------------
+
+class SmtpSink:
+    """
+    Minimal SMTP server that accepts and counts every message without delivering it.
+    """
+
+    def __init__(self, port: Optional[int] = None):
+        self.port = port or free_port()
+        self.messages = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", self.port)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        writer.write(b"220 sink ESMTP\r\n")
+        await writer.drain()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.decode(errors="replace").strip().upper()
+                if command.startswith(("EHLO", "HELO")):
+                    writer.write(b"250-sink\r\n250 8BITMIME\r\n")
+                elif command == "DATA":
+                    writer.write(b"354 End data with <CR><LF>.<CR><LF>\r\n")
+                    await writer.drain()
+                    while (await reader.readline()) not in (b".\r\n", b""):
+                        pass
+                    self.messages += 1
+                    writer.write(b"250 OK\r\n")
+                elif command == "QUIT":
+                    writer.write(b"221 Bye\r\n")
+                    await writer.drain()
+                    break
+                else:
+                    writer.write(b"250 OK\r\n")
+                await writer.drain()
+        finally:
+            writer.close()
+
+
+# -------------------------- In-memory MongoDB --------------------------
+
+class AsyncCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def sort(self, *args, **kwargs):
+        self._cursor = self._cursor.sort(*args, **kwargs)
+        return self
+
+    def limit(self, count):
+        self._cursor = self._cursor.limit(count)
+        return self
+
+    def skip(self, count):
+        self._cursor = self._cursor.skip(count)
+        return self
+
+    def batch_size(self, size):
+        return self
+
+    async def to_list(self, length=None):
+        items = list(self._cursor)
+        return items if length is None else items[:length]
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for item in self._cursor:
+            yield item
+
+
+# Newer aggregation aliases spelt the way mongomock knows them
+OPERATOR_ALIASES = {"$substrBytes": "$substr"}
+
+
+def mongomock_expression(expression):
+    if isinstance(expression, dict):
+        return {OPERATOR_ALIASES.get(key, key): mongomock_expression(value) for key, value in expression.items()}
+    if isinstance(expression, list):
+        return [mongomock_expression(value) for value in expression]
+    return expression
+
+
+def mongomock_stage(stage: dict) -> dict:
+    if "$replaceWith" in stage:
+        return {"$replaceRoot": {"newRoot": stage["$replaceWith"]}}
+    if "$set" in stage:
+        return {"$addFields": mongomock_expression(stage["$set"])}
+    return mongomock_expression(stage)
+
+
+class AsyncCollection:
+    """
+    Motor-style awaitable facade over a mongomock collection.
+    """
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def find(self, *args, **kwargs):
+        return AsyncCursor(self._collection.find(*args, **kwargs))
+
+    def aggregate(self, pipeline, **kwargs):
+        pipeline = [mongomock_stage(stage) for stage in pipeline]
+        if pipeline and "$merge" in pipeline[-1]:
+            return AsyncCursor(iter(self._merge(pipeline[:-1], pipeline[-1]["$merge"], **kwargs)))
+        return AsyncCursor(self._collection.aggregate(pipeline, **kwargs))
+
+    def _merge(self, pipeline, merge, **kwargs) -> list:
+        # mongomock has no $merge: run the stages before it and write the output by _id
+        target = self._collection.database[merge["into"]]
+        for document in self._collection.aggregate(pipeline, **kwargs):
+            existing = target.find_one({"_id": document["_id"]})
+            if existing is None:
+                if merge.get("whenNotMatched", "insert") == "insert":
+                    target.insert_one(document)
+            elif merge.get("whenMatched", "merge") == "replace":
+                target.replace_one({"_id": document["_id"]}, document)
+            else:
+                target.update_one({"_id": document["_id"]}, {"$set": document})
+        return []
+
+    def with_options(self, **options):
+        return self
+
+    def __getattr__(self, name):
+        attribute = getattr(self._collection, name)
+        if not callable(attribute):
+            return attribute
+
+        async def call(*args, **kwargs):
+            return attribute(*args, **kwargs)
+
+        return call
+
+
+class AsyncDatabase:
+    def __init__(self, database):
+        self._database = database
+
+    def get_collection(self, name, **options):
+        return AsyncCollection(self._database[name])
+
+    def __getitem__(self, name):
+        return self.get_collection(name)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self.get_collection(name)
+
+    async def command(self, command, *args, **kwargs):
+        return self._database.command(command, *args, **kwargs)
+
+    async def list_collection_names(self):
+        return self._database.list_collection_names()
+
+    async def create_collection(self, name, **options):
+        # mongomock has no capped collections and raises for them like for any option
+        return AsyncCollection(self._database.create_collection(name, **options))
+
+
+class AsyncMongoMockClient:
+    def __init__(self):
+        self._client = mongomock.MongoClient()
+        self.admin = AsyncDatabase(self._client.admin)
+
+    def __getitem__(self, name):
+        return AsyncDatabase(self._client[name])
+
+    def close(self):
+        self._client.close()
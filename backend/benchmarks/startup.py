@@ -0,0 +1,112 @@
+"""
+Cold start benchmark: how long a fresh worker takes to import the app and to answer its
+first request.
+
+Each run starts a new interpreter that imports ``app.main``, runs the lifespan and
+requests ``/home`` in-process. The median of the runs is reported and compared against
+the stored startup baseline.
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --runs 10 --save-baseline
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+BASELINE_PATH = Path(__file__).with_name("startup_baseline.json")
+METRICS = ("import_ms", "first_response_ms", "process_ms")
+
+
+async def measure_child(mongo: str):
+    start = time.perf_counter()
+    import app.main
+    imported = time.perf_counter()
+
+    # Benchmark tooling is imported after the measurement
+    import httpx
+    from asgi_lifespan import LifespanManager
+    from benchmarks.run import install_mongomock
+
+    if mongo == "mock":
+        install_mongomock()
+    async with LifespanManager(app.main.app):
+        transport = httpx.ASGITransport(app=app.main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://startup") as client:
+            response = await client.get("/home")
+            response.raise_for_status()
+        responded = time.perf_counter()
+
+    print(json.dumps({
+        "import_ms": round((imported - start) * 1000, 1),
+        "first_response_ms": round((responded - start) * 1000, 1),
+    }))
+
+
+def run_once(mongo: str) -> Dict[str, float]:
+    start = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.startup", "--child", "--mongo", mongo],
+        capture_output=True, text=True, check=True, env={**os.environ, "PYTHONDONTWRITEBYTECODE": "1"},
+    ).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    # Interpreter start included, as a recycled or newly scaled worker sees it
+    result["process_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    return result
+
+
+def compare(results: Dict[str, float], baseline: Dict[str, float], tolerance: float) -> List[str]:
+    return [
+        f"{metric}: {results[metric]}ms vs baseline {baseline[metric]}ms"
+        for metric in METRICS
+        if metric in baseline and results[metric] > baseline[metric] * (1 + tolerance)
+    ]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Measure app import time and time to the first response.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--mongo", choices=("mock", "real"), default="mock")
+    parser.add_argument("--baseline", default=str(BASELINE_PATH))
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        asyncio.run(measure_child(args.mongo))
+        return 0
+
+    runs = [run_once(args.mongo) for _ in range(args.runs)]
+    results = {metric: round(statistics.median(run[metric] for run in runs), 1) for metric in METRICS}
+
+    baseline_file = Path(args.baseline)
+    baseline = json.loads(baseline_file.read_text()).get("startup", {}) if baseline_file.exists() else {}
+    for metric in METRICS:
+        expected = baseline.get(metric)
+        delta = f"{(results[metric] / expected - 1) * 100:+.1f}%" if expected else "-"
+        print(f"{metric:<18} {results[metric]:>9} ms   vs base {delta}")
+
+    if args.save_baseline:
+        baseline_file.write_text(json.dumps({
+            "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "runs": args.runs,
+            "startup": results,
+        }, indent=2) + "\n")
+        print(f"Baseline saved to {baseline_file}")
+        return 0
+
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"  regression: {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
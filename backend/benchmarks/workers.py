@@ -0,0 +1,148 @@
+"""
+Throughput of the production launcher (``python -m app.serve``) by worker count.
+
+For every worker count a real server is started on a free port, the scenarios are run
+against it over HTTP and the server is stopped again. The fake HIBP API and SMTP sink
+from the regular runner are shared by all runs.
+
+    python -m benchmarks.workers --workers 1 2 4
+    python -m benchmarks.workers --mongo real --workers 1 4    # local mongod from MONGO_URL
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+from benchmarks.run import BENCH_DB_NAME, configure_environment, run_scenario
+from benchmarks.scenarios import BenchContext, authenticate, seed_database, seed_documents
+from benchmarks.standins import FakeHibp, SmtpSink, free_port
+
+# Read and login paths, each worker of the in-memory setup has its own database
+DEFAULT_SCENARIOS = ["user_report_json", "user_report_pdf", "allbreaches", "login_otp"]
+
+
+def start_server(workers: int, port: int, app: str) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "app.serve", "--app", app, "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers)],
+        env={**os.environ, "SERVER_ACCESS_LOG": "false", "SERVER_LOG_LEVEL": "warning"},
+    )
+
+
+async def wait_until_ready(client: httpx.AsyncClient, server: subprocess.Popen, workers: int, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Server exited with {server.returncode}")
+        try:
+            if (await client.get("/home")).status_code == 200:
+                # The first worker answers while the others may still be importing
+                await asyncio.sleep(1.0 * workers)
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("Server did not start")
+
+
+def stop_server(server: subprocess.Popen):
+    server.terminate()
+    try:
+        server.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        server.kill()
+
+
+async def run_workers(args, workers: int, hibp: FakeHibp) -> Dict[str, dict]:
+    port = free_port()
+    app = "benchmarks.served:app" if args.mongo == "mock" else "app.main:app"
+    users, admin, catalog = seed_documents(args.users, hibp.catalog)
+    if args.mongo == "real":
+        from motor.motor_asyncio import AsyncIOMotorClient
+
+        mongo = AsyncIOMotorClient(os.environ["MONGO_URL"])
+        await seed_database(mongo[os.environ["MONGO_DB_NAME"]], users, admin, catalog)
+        mongo.close()
+
+    server = start_server(workers, port, app)
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=120) as client:
+            await wait_until_ready(client, server, workers)
+            context = BenchContext(client=client, users=[user["email"] for user in users], admin_email=admin["email"])
+            await authenticate(context)
+            results = {}
+            for name in args.scenario or DEFAULT_SCENARIOS:
+                results[name] = await run_scenario(context, name, args.requests, args.concurrency, args.warmup)
+                print(f"  {workers} workers, {name}: done", file=sys.stderr)
+            return results
+    finally:
+        stop_server(server)
+
+
+def print_comparison(results: Dict[int, Dict[str, dict]]):
+    counts = sorted(results)
+    header = f"{'scenario':<18}" + "".join(f"{f'{count}w req/s':>12}{f'{count}w p95 ms':>13}" for count in counts)
+    print(header)
+    print("-" * len(header))
+    for name in results[counts[0]]:
+        row = f"{name:<18}"
+        for count in counts:
+            result = results[count][name]
+            row += f"{result['throughput_rps']:>12}{result['p95_ms']:>13}"
+        print(row)
+
+
+async def main_async(args) -> int:
+    hibp = FakeHibp(latency_ms=args.hibp_latency_ms, catalog_size=args.catalog_size)
+    smtp = SmtpSink()
+    hibp.start()
+    await smtp.start()
+    configure_environment(args, hibp, smtp)
+    os.environ.update({
+        "BENCH_USERS": str(args.users),
+        "BENCH_CATALOG_SIZE": str(args.catalog_size),
+        # Any worker must accept the tokens issued by another
+        "SECRET_KEY": os.getenv("SECRET_KEY", "bench-secret-key"),
+    })
+
+    results = {}
+    try:
+        for workers in args.workers:
+            results[workers] = await run_workers(args, workers, hibp)
+    finally:
+        await smtp.stop()
+        hibp.stop()
+
+    print(f"\n{os.cpu_count()} CPUs, {args.requests} requests per scenario at concurrency {args.concurrency}, "
+          f"{args.mongo} mongo\n")
+    print_comparison(results)
+    return 0
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Compare server throughput by worker count.")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, os.cpu_count() or 1])
+    parser.add_argument("--scenario", action="append", help=f"scenario to run, repeatable (default: {', '.join(DEFAULT_SCENARIOS)})")
+    parser.add_argument("-n", "--requests", type=int, default=200)
+    parser.add_argument("-c", "--concurrency", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--catalog-size", type=int, default=800)
+    parser.add_argument("--hibp-latency-ms", type=float, default=20.0)
+    parser.add_argument("--mongo", choices=("mock", "real"), default="mock")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    os.environ.setdefault("MONGO_DB_NAME", BENCH_DB_NAME)
+    return asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
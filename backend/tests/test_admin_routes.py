@@ -1,10 +1,13 @@
 import pytest
+from bson import ObjectId
 from fastapi.testclient import TestClient
 from fastapi import HTTPException
-from app.routes.admin_routes import fetch_user_data
+from pymongo.errors import BulkWriteError
+from app.models.admin import BulkVerifyStatusUpdate
+from app.routes.admin_routes import fetch_user_data, list_users, bulk_update_verify_status, DIRECTORY_PROJECTION
 from app.db import db
 from jose import jwt
-from unittest.mock import patch, AsyncMock
+from unittest.mock import patch, AsyncMock, MagicMock
 
 client = TestClient(fetch_user_data)
 
@@ -43,3 +46,134 @@ async def test_fetch_user_data_invalid_token(mock_jwt_decode, mock_invalid_reque
     assert exc_info.value.status_code == 403
     assert exc_info.value.detail == "Invalid token"
 
+
+# ------------------------------------------------------------------- User directory tests --------------------------------------------------------------------------- #
+
+ADMIN = {"email": "admin@example.com", "user_type": "admin"}
+
+
+def mock_directory(mock_db, users, total):
+    mock_db.users.count_documents = AsyncMock(return_value=total)
+    mock_db.users.find.return_value.sort.return_value.limit.return_value.to_list = AsyncMock(return_value=users)
+
+
+@pytest.mark.asyncio
+@patch("app.routes.admin_routes.load_risk_summaries")
+@patch("app.routes.admin_routes.db")
+async def test_list_users_pages_with_cursor(mock_db, mock_load_risk_summaries):
+    users = [{"_id": ObjectId(), "name": f"User {i}", "email": f"user{i}@example.com"} for i in range(3)]
+    mock_directory(mock_db, users, total=10)
+    mock_load_risk_summaries.return_value = {users[0]["_id"]: {"_id": users[0]["_id"], "score": 62.5, "level": "high"}}
+
+    result = await list_users(q=None, verified=None, admin=None, has_id_file=None, after=None, limit=2, admin_user=ADMIN)
+
+    assert result["total"] == 10
+    assert [user["email"] for user in result["users"]] == ["user0@example.com", "user1@example.com"]
+    assert result["next_cursor"] == str(users[1]["_id"])
+    assert [(user["risk_score"], user["risk_level"]) for user in result["users"]] == [(62.5, "high"), (None, None)]
+    mock_load_risk_summaries.assert_awaited_once_with([users[0]["_id"], users[1]["_id"]])
+    mock_db.users.find.assert_called_once_with({}, DIRECTORY_PROJECTION)
+    mock_db.users.find.return_value.sort.return_value.limit.assert_called_once_with(3)
+
+
+@pytest.mark.asyncio
+@patch("app.routes.admin_routes.db")
+async def test_list_users_search_and_filters(mock_db):
+    mock_directory(mock_db, [], total=0)
+    after = ObjectId()
+
+    result = await list_users(q="jo.", verified=False, admin=True, has_id_file=True, after=str(after), limit=50, admin_user=ADMIN)
+
+    assert result == {"users": [], "total": 0, "next_cursor": None}
+    count_query = mock_db.users.count_documents.call_args[0][0]
+    assert count_query == {
+        "$or": [{"email": {"$regex": "^jo\\."}}, {"name": {"$regex": "^jo\\."}}],
+        "verified": {"$ne": True},
+        "user_type": "admin",
+        "id_file": {"$exists": True},
+    }
+    page_query = mock_db.users.find.call_args[0][0]
+    assert page_query["_id"] == {"$gt": after}
+
+
+@pytest.mark.asyncio
+async def test_list_users_rejects_bad_cursor():
+    with pytest.raises(HTTPException) as exc_info:
+        await list_users(q=None, verified=None, admin=None, has_id_file=None, after="nope", limit=50, admin_user=ADMIN)
+    assert exc_info.value.status_code == 400
+
+# ------------------------------------------------------------------- Bulk admin operation tests --------------------------------------------------------------------------- #
+
+@pytest.mark.asyncio
+@patch("app.routes.admin_routes.db")
+async def test_bulk_verify_status_reports_per_item_results(mock_db):
+    known, other, missing = ObjectId(), ObjectId(), ObjectId()
+    mock_db.users.find.return_value.to_list = AsyncMock(
+        return_value=[{"_id": known, "email": "known@example.com"}, {"_id": other, "email": "other@example.com"}]
+    )
+    mock_db.users.with_options.return_value.bulk_write = AsyncMock()
+    background_tasks = MagicMock()
+
+    data = BulkVerifyStatusUpdate(
+        updates=[
+            {"user_id": str(known), "verified": True},
+            {"user_id": str(other), "verified": False},
+            {"user_id": str(missing), "verified": True},
+            {"user_id": "not-an-id", "verified": True},
+            {"user_id": str(known), "verified": True},
+        ],
+        notify=True,
+    )
+    result = await bulk_update_verify_status(data, background_tasks, admin_user=ADMIN)
+
+    assert [item["status"] for item in result["results"]] == ["updated", "updated", "not_found", "invalid_id", "duplicate"]
+    assert result["succeeded"] == 2
+    operations = mock_db.users.with_options.return_value.bulk_write.call_args[0][0]
+    assert len(operations) == 2
+    mock_db.users.with_options.return_value.bulk_write.assert_awaited_once()
+    background_tasks.add_task.assert_called_once()
+    assert background_tasks.add_task.call_args[0][1] == ["known@example.com"]
+
+
+@pytest.mark.asyncio
+@patch("app.routes.admin_routes.db")
+async def test_bulk_verify_status_maps_write_errors(mock_db):
+    first, second = ObjectId(), ObjectId()
+    mock_db.users.find.return_value.to_list = AsyncMock(return_value=[{"_id": first}, {"_id": second}])
+    mock_db.users.with_options.return_value.bulk_write = AsyncMock(
+        side_effect=BulkWriteError({"writeErrors": [{"index": 1, "errmsg": "boom"}]})
+    )
+
+    data = BulkVerifyStatusUpdate(
+        updates=[{"user_id": str(first), "verified": True}, {"user_id": str(second), "verified": True}]
+    )
+    result = await bulk_update_verify_status(data, MagicMock(), admin_user=ADMIN)
+
+    assert [item["status"] for item in result["results"]] == ["updated", "error"]
+    assert result["results"][1]["detail"] == "boom"
+
+
+@pytest.mark.asyncio
+@patch("app.routes.admin_routes.db")
+async def test_bulk_verify_status_normalises_ids_and_emails_newly_verified(mock_db):
+    new, already = ObjectId(), ObjectId()
+    mock_db.users.find.return_value.to_list = AsyncMock(return_value=[
+        {"_id": new, "email": "new@example.com", "verified": False},
+        {"_id": already, "email": "already@example.com", "verified": True},
+    ])
+    mock_db.users.with_options.return_value.bulk_write = AsyncMock()
+    background_tasks = MagicMock()
+
+    data = BulkVerifyStatusUpdate(
+        updates=[
+            {"user_id": str(new).upper(), "verified": True},
+            {"user_id": str(already), "verified": True},
+            {"user_id": str(new), "verified": True},
+        ],
+        notify=True,
+    )
+    result = await bulk_update_verify_status(data, background_tasks, admin_user=ADMIN)
+
+    assert [item["status"] for item in result["results"]] == ["updated", "updated", "duplicate"]
+    # The user that was verified already is not emailed again
+    assert background_tasks.add_task.call_args[0][1] == ["new@example.com"]
@@ -0,0 +1,114 @@
+import pytest
+from datetime import datetime
+from fastapi import FastAPI
+from httpx import AsyncClient
+from unittest.mock import patch, AsyncMock, MagicMock
+from benchmarks.standins import AsyncMongoMockClient
+from app.auth import get_current_admin
+from app.analytics_service import (
+    BREACHES_PER_YEAR,
+    DATA_CLASS_STATS,
+    breach_names,
+    catalog_keys,
+    refresh_affected_users,
+    refresh_catalog_analytics,
+    store_rows,
+)
+from app.routes.analytics_routes import router
+
+app = FastAPI()
+app.include_router(router)
+
+# ------------------------------------------------------------------- Analytics Test cases --------------------------------------------------------------------------- #
+
+@pytest.fixture
+def client():
+    return AsyncClient(app=app, base_url="http://test")
+
+
+@pytest.fixture
+def as_admin():
+    app.dependency_overrides[get_current_admin] = lambda: {"email": "admin@example.com", "user_type": "admin"}
+    yield
+    app.dependency_overrides.clear()
+
+
+def test_breach_names_skips_clean_reports():
+    assert breach_names({"Report": [{"Name": "Adobe"}, {"Name": "LinkedIn"}]}) == ["Adobe", "LinkedIn"]
+    assert breach_names({"Report": "Email address not found in any breaches."}) == []
+
+
+@pytest.mark.asyncio
+@patch("app.analytics_service.db")
+async def test_refresh_affected_users_only_recounts_given_breaches(mock_db):
+    aggregate = MagicMock()
+    aggregate.return_value.to_list = AsyncMock(return_value=[])
+    mock_db.users.aggregate = aggregate
+    mock_db.__getitem__.return_value.delete_many = AsyncMock()
+
+    await refresh_affected_users(["Adobe", "Adobe", "LinkedIn"])
+
+    pipeline = aggregate.call_args[0][0]
+    assert {"$match": {"breaches.Report.Name": {"$in": ["Adobe", "LinkedIn"]}}} in pipeline
+    mock_db.__getitem__.assert_called_with("analytics_breach_users")
+    stale = mock_db.__getitem__.return_value.delete_many.call_args[0][0]
+    assert stale["_id"] == {"$in": ["Adobe", "LinkedIn"]}
+
+
+@pytest.mark.asyncio
+async def test_an_older_refresh_finishing_last_keeps_the_newer_rows():
+    database = AsyncMongoMockClient()["analytics_overlap_test"]
+    older, newer = datetime(2024, 1, 1, 12, 0, 0), datetime(2024, 1, 1, 12, 0, 1)
+    with patch("app.analytics_service.db", database):
+        await store_rows(BREACHES_PER_YEAR, [{"_id": "2013", "breaches": 2}, {"_id": "2016", "breaches": 1}], newer)
+        # The refresh that started first writes and cleans up after the newer one
+        await store_rows(BREACHES_PER_YEAR, [{"_id": "2013", "breaches": 1}], older)
+
+    rows = await database[BREACHES_PER_YEAR].find({}).sort("_id", 1).to_list(None)
+    assert rows == [
+        {"_id": "2013", "breaches": 2, "updated_at": newer},
+        {"_id": "2016", "breaches": 1, "updated_at": newer},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_an_added_breach_only_recounts_its_rows():
+    database = AsyncMongoMockClient()["analytics_scoped_test"]
+    await database.breaches.insert_many([
+        {"Name": "Adobe", "BreachDate": "2013-10-04", "PwnCount": 100, "DataClasses": ["Passwords"]},
+        {"Name": "LinkedIn", "BreachDate": "2016-05-05", "PwnCount": 50, "DataClasses": ["Emails"]},
+    ])
+    with patch("app.analytics_service.db", database):
+        await refresh_catalog_analytics()
+        first = {row["_id"]: row for row in await database[BREACHES_PER_YEAR].find({}).to_list(None)}
+
+        added = {"Name": "Dropbox", "BreachDate": "2016-08-31", "PwnCount": 10, "DataClasses": ["Passwords"]}
+        await database.breaches.insert_one(dict(added))
+        await refresh_catalog_analytics(*catalog_keys([added]))
+
+    years = {row["_id"]: row for row in await database[BREACHES_PER_YEAR].find({}).to_list(None)}
+    classes = {row["_id"]: row for row in await database[DATA_CLASS_STATS].find({}).to_list(None)}
+    assert (years["2016"]["breaches"], years["2016"]["pwn_count"]) == (2, 60)
+    assert (classes["Passwords"]["breaches"], classes["Passwords"]["pwn_count"]) == (2, 110)
+    # Rows of other years and data classes were not rewritten
+    assert years["2013"] == first["2013"]
+    assert classes["Emails"]["breaches"] == 1
+
+
+@pytest.mark.asyncio
+async def test_analytics_requires_authentication(client):
+    response = await client.get("/admin/analytics/breaches-per-year")
+
+    assert response.status_code == 401
+
+
+@pytest.mark.asyncio
+@patch("app.routes.analytics_routes.db")
+async def test_top_data_classes(mock_db, client, as_admin):
+    rows = [{"_id": "Passwords", "breaches": 2, "pwn_count": 300}]
+    mock_db.get_collection.return_value.find.return_value.sort.return_value.limit.return_value.to_list = AsyncMock(return_value=rows)
+
+    response = await client.get("/admin/analytics/data-classes?limit=5")
+
+    assert response.status_code == 200
+    assert response.json() == {"data_classes": [{"data_class": "Passwords", "breaches": 2, "pwn_count": 300}]}
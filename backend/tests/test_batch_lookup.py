@@ -0,0 +1,110 @@
+import json
+import time
+import httpx
+import pytest
+from fastapi import FastAPI
+from httpx import AsyncClient
+from unittest.mock import patch, AsyncMock
+from benchmarks.standins import AsyncMongoMockClient
+from app.auth import get_current_admin
+from app.batch_lookup import LOOKUP_JOBS, RateLimiter, claim_job, parse_roster
+from app.config import BatchLookupSettings
+from app.routes.lookup_routes import router
+
+app = FastAPI()
+app.include_router(router)
+app.dependency_overrides[get_current_admin] = lambda: {"email": "admin@example.com", "user_type": "admin"}
+
+SETTINGS = BatchLookupSettings(requests_per_minute=60_000, concurrency=2)
+
+
+def ndjson(response) -> list:
+    return [json.loads(line) for line in response.text.splitlines()]
+
+# ------------------------------------------------------------------- Batch lookup tests --------------------------------------------------------------------------- #
+
+def test_rosters_are_normalised_and_deduplicated():
+    csv_roster = b"Name,Email\nAda,Ada@Example.com\nBob,not-an-email\nAda again,ada@example.com\nCy,cy@example.com\n"
+    assert parse_roster(csv_roster, "staff.csv") == (["ada@example.com", "cy@example.com"], 1, 1)
+
+    headerless = b"ada@example.com,Ada\ncy@example.com,Cy\n"
+    assert parse_roster(headerless).emails == ["ada@example.com", "cy@example.com"]
+
+    ndjson_roster = b'{"email": "ada@example.com"}\n"cy@example.com"\n{broken\n'
+    assert parse_roster(ndjson_roster, "staff.ndjson") == (["ada@example.com", "cy@example.com"], 0, 1)
+
+    with pytest.raises(ValueError):
+        parse_roster(csv_roster, "staff.csv", max_emails=1)
+
+
+def test_workers_split_the_key_rate_limit(monkeypatch):
+    monkeypatch.setenv("WEB_CONCURRENCY", "4")
+    settings = BatchLookupSettings(requests_per_minute=100, request_path_share=0.2)
+
+    # A fifth is left to the report routes, the rest split between the four workers
+    assert settings.worker_requests_per_minute == 20
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_spaces_calls():
+    limiter = RateLimiter(per_minute=1200)
+    started = time.monotonic()
+    for _ in range(3):
+        await limiter.wait()
+    # The first call goes straight through, the next two wait 50ms each
+    assert time.monotonic() - started >= 0.09
+
+
+@pytest.mark.asyncio
+async def test_lookups_stream_and_resume_by_job_id():
+    database = AsyncMongoMockClient()["batch_lookup_test"]
+    await database.users.insert_one({"email": "local@example.com", "breaches": {"Report": [{"Name": "Adobe"}]}})
+    answers = {
+        "pwned@example.com": [httpx.Response(200, json=[{"Name": "LinkedIn"}])],
+        "clean@example.com": [httpx.Response(404)],
+        "flaky@example.com": [httpx.Response(503), httpx.Response(404)],
+        # Answered once, a resume must not ask again
+        "refused@example.com": [httpx.Response(400)],
+    }
+
+    async def fake_hibp_get(client, url, headers, endpoint, retries=0):
+        return answers[url.rsplit("/", 1)[1].replace("%40", "@")].pop(0)
+
+    roster = b"email\nlocal@example.com\npwned@example.com\nPWNED@example.com\nclean@example.com\nflaky@example.com\nrefused@example.com\nnope\n"
+    with patch("app.batch_lookup.db", database), \
+            patch("app.batch_lookup.hibp_get", AsyncMock(side_effect=fake_hibp_get)) as mock_hibp_get, \
+            patch("app.batch_lookup.get_batch_lookup_settings", return_value=SETTINGS), \
+            patch("app.routes.lookup_routes.get_batch_lookup_settings", return_value=SETTINGS):
+        async with AsyncClient(app=app, base_url="http://test") as client:
+            response = await client.post("/admin/lookups", files={"file": ("staff.csv", roster, "text/csv")})
+            lines = ndjson(response)
+            job_id = response.headers["X-Lookup-Job"]
+
+            assert response.headers["content-type"] == "application/x-ndjson"
+            assert lines[0] == {"job": job_id, "total": 5, "duplicates": 1, "invalid": 1}
+            # Answered from the stored report, no HIBP call
+            assert lines[1] == {"email": "local@example.com", "status": "breached", "breaches": ["Adobe"], "source": "local"}
+            by_email = {line["email"]: line for line in lines[2:-1]}
+            assert by_email["pwned@example.com"]["breaches"] == ["LinkedIn"]
+            assert by_email["clean@example.com"]["status"] == "clean"
+            assert by_email["flaky@example.com"]["status"] == "error"
+            assert by_email["refused@example.com"]["status"] == "rejected"
+            assert lines[-1] == {"job": job_id, "done": False, "breached": 2, "clean": 1, "rejected": 1, "error": 1}
+            assert mock_hibp_get.await_count == 4
+
+            # Another stream holds the job
+            await claim_job(job_id, SETTINGS)
+            busy = await client.get(f"/admin/lookups/{job_id}")
+            assert busy.status_code == 409
+            await database[LOOKUP_JOBS].update_one({"_id": job_id}, {"$set": {"lease_until": None}})
+
+            resumed = ndjson(await client.get(f"/admin/lookups/{job_id}"))
+            missing = await client.get("/admin/lookups/unknown")
+
+    # Stored results are replayed in roster order, only the transient failure is retried
+    assert [line["email"] for line in resumed[1:-1]] == [
+        "local@example.com", "pwned@example.com", "clean@example.com", "refused@example.com", "flaky@example.com",
+    ]
+    assert resumed[-1] == {"job": job_id, "done": True, "breached": 2, "clean": 2, "rejected": 1, "error": 0}
+    assert mock_hibp_get.await_count == 5
+    assert missing.status_code == 404
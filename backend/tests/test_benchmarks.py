@@ -0,0 +1,65 @@
+import asyncio
+import json
+from unittest.mock import patch
+from app.routes.upload_routes import process_content
+from benchmarks.run import compare, percentile, summarise
+from benchmarks.scenarios import upload_body
+from benchmarks.standins import DATA_CLASSES, AsyncMongoMockClient
+
+# ------------------------------------------------------------------- Benchmark runner tests --------------------------------------------------------------------------- #
+
+def test_percentiles_use_nearest_rank():
+    samples = [index / 1000 for index in range(1, 101)]
+
+    assert percentile(samples, 0.5) == 0.05
+    assert percentile(samples, 0.99) == 0.099
+    assert percentile([], 0.5) == 0.0
+
+
+def test_summary_reports_throughput_and_percentiles():
+    summary = summarise([0.01, 0.02, 0.03, 0.04], elapsed=0.5, errors=1)
+
+    assert summary["throughput_rps"] == 8.0
+    assert summary["p50_ms"] == 20.0
+    assert summary["p99_ms"] == 40.0
+    assert summary["errors"] == 1
+
+
+def test_regressions_past_the_tolerance_are_reported():
+    baseline = {"allbreaches": {"p95_ms": 100.0, "throughput_rps": 50.0}}
+
+    assert compare({"allbreaches": {"p95_ms": 120.0, "throughput_rps": 45.0}}, baseline, 0.25) == []
+    regressions = compare({"allbreaches": {"p95_ms": 130.0, "throughput_rps": 30.0}, "new": {"p95_ms": 1, "throughput_rps": 1}}, baseline, 0.25)
+    assert len(regressions) == 2
+
+
+def test_upload_body_is_kept_by_upload_processing():
+    content = json.loads(upload_body(3))
+
+    with patch("app.routes.upload_routes.HIBP_DATA_CLASSES", DATA_CLASSES):
+        assert process_content(content) == content
+    assert len(content["Email addresses"]) == 3
+
+
+def test_mongomock_standin_merges_aggregation_output():
+    database = AsyncMongoMockClient()["merge_test"]
+
+    async def run():
+        await database.breaches.insert_many([
+            {"Name": "A", "BreachDate": "2019-01-01"}, {"Name": "A", "BreachDate": "2019-01-01"},
+            {"Name": "B", "BreachDate": "2020-05-05"},
+        ])
+        await database.per_year.insert_one({"_id": "2019", "breaches": 9})
+        await database.breaches.aggregate([
+            {"$group": {"_id": "$Name", "breach": {"$first": "$$ROOT"}}},
+            {"$replaceWith": "$breach"},
+            {"$group": {"_id": {"$substrBytes": ["$BreachDate", 0, 4]}, "breaches": {"$sum": 1}}},
+            {"$set": {"counted": True}},
+            {"$merge": {"into": "per_year", "on": "_id", "whenMatched": "replace", "whenNotMatched": "insert"}},
+        ]).to_list(None)
+        return await database.per_year.find({}).sort("_id", 1).to_list(None)
+
+    assert asyncio.run(run()) == [
+        {"_id": "2019", "breaches": 1, "counted": True},
+        {"_id": "2020", "breaches": 1, "counted": True},
+    ]
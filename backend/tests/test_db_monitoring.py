@@ -0,0 +1,52 @@
+import pytest
+from types import SimpleNamespace
+from fastapi import FastAPI
+from httpx import AsyncClient
+from app.db_monitoring import CommandMonitor, DbStatsMiddleware, COMMAND_DURATION, REQUEST_ROUND_TRIPS, query_shape
+
+# ------------------------------------------------------------------- Command monitoring tests --------------------------------------------------------------------------- #
+
+monitor = CommandMonitor(slow_command_ms=50)
+
+
+def run_command(command_name, command, duration_micros, request_id):
+    monitor.started(SimpleNamespace(command_name=command_name, command=command, connection_id=("db", 1), request_id=request_id))
+    monitor.succeeded(SimpleNamespace(command_name=command_name, connection_id=("db", 1), request_id=request_id, duration_micros=duration_micros))
+
+
+app = FastAPI()
+app.add_middleware(DbStatsMiddleware, debug_headers=True)
+
+
+@app.get("/items/{item_id}")
+async def get_item(item_id: str):
+    run_command("find", {"find": "items", "filter": {"_id": item_id}}, 2000, 1)
+    run_command("update", {"update": "items", "updates": [{"q": {"_id": item_id}}]}, 3000, 2)
+    return {"id": item_id}
+
+
+def test_query_shape_hides_values():
+    assert query_shape({"email": "a@b.c", "age": {"$gt": 3}, "tags": ["x", "y"]}) == {
+        "email": "str",
+        "age": {"$gt": "int"},
+        "tags": ["str"],
+    }
+
+
+def test_slow_commands_are_logged_with_filter_shape(caplog):
+    run_command("find", {"find": "users", "filter": {"email": "secret@example.com"}}, 75_000, 10)
+
+    assert "Slow MongoDB command find on users took 75.0ms" in caplog.text
+    assert "{'email': 'str'}" in caplog.text
+    assert "secret@example.com" not in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_requests_get_db_time_headers_and_round_trips():
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        response = await client.get("/items/42")
+
+    assert response.headers["x-db-round-trips"] == "2"
+    assert response.headers["x-db-time"] == "5.00"
+    assert REQUEST_ROUND_TRIPS.labels("/items/{item_id}").count >= 1
+    assert COMMAND_DURATION.labels("items", "update", "ok").count >= 1
@@ -0,0 +1,130 @@
+import io
+import os
+import pytest
+from fastapi import FastAPI, HTTPException
+from httpx import AsyncClient
+from unittest.mock import patch, AsyncMock
+from app.config import IdUploadSettings
+from fastapi import Request
+from app.id_storage import receive_id_document, sniff_type, write_document
+from app.routes.home_routes import router
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 100
+ALLOWED = {"image/png", "image/jpeg"}
+
+app = FastAPI()
+app.include_router(router)
+
+BOUNDARY = "spearowboundary"
+
+
+def multipart_body(content: bytes, extra_field: bool = False) -> bytes:
+    parts = []
+    if extra_field:
+        parts.append(f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="note"\r\n\r\nhello\r\n'.encode())
+    parts.append(
+        f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="id.png"\r\n'
+        f'Content-Type: image/png\r\n\r\n'.encode() + content + b"\r\n"
+    )
+    return b"".join(parts) + f"--{BOUNDARY}--\r\n".encode()
+
+
+def streamed_request(chunks: list) -> Request:
+    """
+    Request whose body arrives in ``chunks``, recording how many were read.
+    """
+    scope = {
+        "type": "http", "method": "POST", "path": "/uploadID", "query_string": b"",
+        "headers": [(b"content-type", f"multipart/form-data; boundary={BOUNDARY}".encode())],
+    }
+    remaining = list(chunks)
+
+    async def receive():
+        body = remaining.pop(0)
+        return {"type": "http.request", "body": body, "more_body": bool(remaining)}
+
+    request = Request(scope, receive)
+    request.unread = remaining
+    return request
+
+# ------------------------------------------------------------------- ID storage tests --------------------------------------------------------------------------- #
+
+def test_file_types_are_sniffed_from_signatures():
+    assert sniff_type(PNG) == ("image/png", ".png")
+    assert sniff_type(b"RIFF\x00\x00\x00\x00WEBPVP8 ") == ("image/webp", ".webp")
+    assert sniff_type(b"MZ\x90\x00") is None
+
+
+def test_documents_are_stored_by_content_hash(tmp_path):
+    first = write_document(io.BytesIO(PNG), str(tmp_path), 1024, ALLOWED)
+    second = write_document(io.BytesIO(PNG), str(tmp_path), 1024, ALLOWED)
+
+    assert first == second
+    assert first.path == f"uploaded_ids/{first.sha256[:2]}/{first.sha256}.png"
+    assert (tmp_path / first.sha256[:2] / f"{first.sha256}.png").read_bytes() == PNG
+    assert first.size == len(PNG)
+    assert not [name for name in os.listdir(tmp_path) if name.startswith(".upload-")]
+
+
+@pytest.mark.parametrize("content, max_bytes, status", [
+    (b"MZ\x90\x00" * 10, 1024, 415),
+    (PNG, 50, 413),
+    (b"", 1024, 400),
+])
+def test_rejected_documents_leave_nothing_behind(tmp_path, content, max_bytes, status):
+    with pytest.raises(HTTPException) as error:
+        write_document(io.BytesIO(content), str(tmp_path), max_bytes, ALLOWED)
+
+    assert error.value.status_code == status
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.mark.asyncio
+@patch("app.routes.home_routes.verification_digest")
+@patch("app.routes.home_routes.db")
+@patch("app.routes.home_routes.jwt.decode")
+async def test_upload_id_stores_file_and_queues_admin_digest(mock_jwt_decode, mock_db, mock_digest, tmp_path):
+    mock_jwt_decode.return_value = {"sub": "user@example.com"}
+    mock_db.users.find_one = AsyncMock(return_value={"email": "user@example.com"})
+    mock_db.users.update_one = AsyncMock()
+    settings = IdUploadSettings(dir=str(tmp_path), max_bytes=1024, allowed_types="image/png")
+
+    with patch("app.routes.home_routes.get_id_upload_settings", return_value=settings):
+        async with AsyncClient(app=app, base_url="http://test") as client:
+            response = await client.post("/uploadID", files={"file": ("id.png", PNG, "image/png")}, headers={"Authorization": "Bearer token"})
+            too_large = await client.post("/uploadID", files={"file": ("id.png", PNG * 20, "image/png")}, headers={"Authorization": "Bearer token"})
+
+    assert response.status_code == 200
+    update = mock_db.users.update_one.await_args.args[1]["$set"]
+    assert update["id_file"].startswith("uploaded_ids/")
+    assert update["id_file_info"]["content_type"] == "image/png"
+    mock_digest.add.assert_called_once_with("user@example.com")
+    assert too_large.status_code == 413
+
+
+@pytest.mark.asyncio
+async def test_bad_signature_is_rejected_before_the_body_is_read(tmp_path):
+    body = multipart_body(b"MZ\x90\x00" * 10_000)
+    chunks = [body[start:start + 1024] for start in range(0, len(body), 1024)]
+    request = streamed_request(chunks)
+    settings = IdUploadSettings(dir=str(tmp_path), max_bytes=10 ** 6, allowed_types="image/png")
+
+    with pytest.raises(HTTPException) as error:
+        await receive_id_document(request, settings)
+
+    assert error.value.status_code == 415
+    # Rejected on the first chunk, no temporary file was created
+    assert len(request.unread) == len(chunks) - 1
+    assert not os.path.exists(tmp_path) or os.listdir(tmp_path) == []
+
+
+@pytest.mark.asyncio
+async def test_streamed_upload_survives_any_chunking(tmp_path):
+    body = multipart_body(PNG, extra_field=True)
+    request = streamed_request([body[start:start + 5] for start in range(0, len(body), 5)])
+    settings = IdUploadSettings(dir=str(tmp_path), max_bytes=1024, allowed_types="image/png")
+
+    document = await receive_id_document(request, settings)
+
+    assert document.size == len(PNG)
+    assert (tmp_path / document.sha256[:2] / f"{document.sha256}.png").read_bytes() == PNG
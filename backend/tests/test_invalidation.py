@@ -0,0 +1,52 @@
+import asyncio
+import pytest
+from unittest.mock import patch, MagicMock
+from benchmarks.standins import AsyncMongoMockClient
+from app.config import InvalidationSettings
+from app.invalidation import InvalidationBus, BREACH_CATALOG, ADMIN_RECIPIENTS
+
+SETTINGS = InvalidationSettings(poll_seconds=0.01)
+
+# ------------------------------------------------------------------- Invalidation tests --------------------------------------------------------------------------- #
+
+@pytest.mark.asyncio
+async def test_published_keys_are_applied_by_the_other_workers():
+    database = AsyncMongoMockClient()["invalidation_test"]
+    with patch("app.invalidation.db", database):
+        publisher, listener = InvalidationBus(SETTINGS), InvalidationBus(SETTINGS)
+        own, other, unrelated = MagicMock(), MagicMock(), MagicMock()
+        publisher.subscribe(BREACH_CATALOG, own)
+        listener.subscribe(BREACH_CATALOG, other)
+        listener.subscribe(ADMIN_RECIPIENTS, unrelated)
+        publisher.start()
+        listener.start()
+        await asyncio.sleep(0.05)
+
+        await publisher.publish(BREACH_CATALOG)
+        for _ in range(50):
+            if other.called:
+                break
+            await asyncio.sleep(0.01)
+        # Messages are read again on every pass, each is applied once
+        await asyncio.sleep(0.05)
+        await publisher.stop()
+        await listener.stop()
+
+    # The mongomock collection cannot be capped, the bus polls it
+    assert listener.tailable is False
+    other.assert_called_once_with()
+    own.assert_not_called()
+    unrelated.assert_not_called()
+
+
+def test_messages_are_deduplicated_and_failing_handlers_do_not_stop_the_others():
+    bus = InvalidationBus(SETTINGS)
+    failing, handler = MagicMock(side_effect=RuntimeError("boom")), MagicMock()
+    bus.subscribe(ADMIN_RECIPIENTS, failing)
+    bus.subscribe(ADMIN_RECIPIENTS, handler)
+    message = {"_id": "message-1", "key": ADMIN_RECIPIENTS, "origin": "another-worker"}
+
+    assert bus.apply(message) is True
+    assert bus.apply(message) is False
+    assert bus.apply({"_id": "message-2", "key": ADMIN_RECIPIENTS, "origin": bus.origin}) is False
+    handler.assert_called_once_with()
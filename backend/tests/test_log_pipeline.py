@@ -0,0 +1,116 @@
+import json
+import logging
+import queue
+import pytest
+from fastapi import FastAPI
+from httpx import AsyncClient
+from app.config import LoggingSettings
+from unittest.mock import patch, AsyncMock
+from app.log_pipeline import (
+    ContextFilter, JsonFormatter, LogContextMiddleware, LogQueueHandler, SamplingFilter, RECORDS_DROPPED,
+    bind_user, ensure_logging, logging_config, stop_logging,
+)
+from app.routes.home_routes import router as home_router
+
+
+def queued_logger(name: str, log_queue: queue.Queue) -> logging.Logger:
+    handler = LogQueueHandler(log_queue)
+    handler.addFilter(ContextFilter())
+    logger = logging.getLogger(name)
+    logger.handlers = [handler]
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    return logger
+
+
+def info_record(name: str, level: int = logging.INFO) -> logging.LogRecord:
+    return logging.LogRecord(name, level, __file__, 0, "message", None, None)
+
+# ------------------------------------------------------------------- Log pipeline tests --------------------------------------------------------------------------- #
+
+@pytest.mark.asyncio
+async def test_records_carry_request_id_route_and_user():
+    log_queue = queue.Queue()
+    logger = queued_logger("tests.log_pipeline.request", log_queue)
+    app = FastAPI()
+    app.add_middleware(LogContextMiddleware)
+
+    @app.get("/uploads/{upload_id}")
+    async def read_upload(upload_id: str):
+        bind_user("user@example.com")
+        logger.info("Reading upload %s", upload_id, extra={"upload_id": upload_id})
+        return {}
+
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        response = await client.get("/uploads/42", headers={"X-Request-ID": "req-1"})
+        generated = await client.get("/uploads/43", headers={"X-Request-ID": "not valid!"})
+
+    assert response.headers["X-Request-ID"] == "req-1"
+    assert len(generated.headers["X-Request-ID"]) == 32
+
+    entry = json.loads(JsonFormatter().format(log_queue.get_nowait()))
+    assert entry["message"] == "Reading upload 42"
+    assert (entry["request_id"], entry["route"], entry["user_id"]) == ("req-1", "/uploads/{upload_id}", "user@example.com")
+    assert entry["upload_id"] == "42"
+    assert json.loads(JsonFormatter().format(log_queue.get_nowait()))["request_id"] == generated.headers["X-Request-ID"]
+
+
+def test_full_queue_drops_records_instead_of_blocking():
+    logger = queued_logger("tests.log_pipeline.full", queue.Queue(maxsize=1))
+    dropped = RECORDS_DROPPED.labels().value
+
+    logger.info("kept")
+    logger.info("dropped")
+
+    assert RECORDS_DROPPED.labels().value == dropped + 1
+
+
+def test_sampling_keeps_a_fraction_of_info_and_every_warning():
+    sampling = SamplingFilter({"uvicorn.access": 0.1})
+
+    kept = sum(sampling.filter(info_record("uvicorn.access")) for _ in range(100))
+    assert kept == 10
+    assert all(sampling.filter(info_record("uvicorn.access", logging.WARNING)) for _ in range(5))
+    assert all(sampling.filter(info_record("app.routes.report_routes")) for _ in range(5))
+
+
+def test_per_module_levels_and_sampling_are_configured():
+    config = logging_config(LoggingSettings(level="warning", levels="app.db=DEBUG, app.routes=ERROR", sample="uvicorn.access=0.25"))
+
+    assert config["root"] == {"level": "WARNING", "handlers": ["queue"]}
+    assert config["loggers"]["app.db"] == {"level": "DEBUG"}
+    assert config["loggers"]["app.routes"] == {"level": "ERROR"}
+    assert config["filters"]["sample"]["rates"] == {"uvicorn.access": 0.25}
+    assert config["handlers"]["queue"]["filters"] == ["sample", "context"]
+
+
+def test_pipeline_is_installed_once_at_startup():
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    try:
+        assert ensure_logging(LoggingSettings(format="text")) is True
+        # A second lifespan in the process, or the pipeline uvicorn already installed
+        assert ensure_logging(LoggingSettings(format="text")) is False
+        assert [type(handler) for handler in root.handlers].count(LogQueueHandler) == 1
+    finally:
+        stop_logging()
+        root.handlers[:] = handlers
+        root.setLevel(level)
+
+
+@pytest.mark.asyncio
+@patch("app.routes.home_routes.db")
+@patch("app.routes.home_routes.jwt.decode")
+async def test_routes_decoding_the_token_bind_the_user(mock_jwt_decode, mock_db):
+    mock_jwt_decode.return_value = {"sub": "user@example.com"}
+    mock_db.users.find_one = AsyncMock(return_value={"name": "User", "user_type": "standard", "verified": True})
+    app = FastAPI()
+    app.include_router(home_router)
+    app.add_middleware(LogContextMiddleware)
+
+    with patch("app.routes.home_routes.bind_user", wraps=bind_user) as mock_bind_user:
+        async with AsyncClient(app=app, base_url="http://test") as client:
+            response = await client.get("/get-user-info", headers={"Authorization": "Bearer token"})
+
+    assert response.status_code == 200
+    mock_bind_user.assert_called_once_with("user@example.com")
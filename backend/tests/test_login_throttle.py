@@ -0,0 +1,128 @@
+import asyncio
+import pytest
+from fastapi import FastAPI, HTTPException
+from httpx import AsyncClient
+from unittest.mock import patch, AsyncMock
+from benchmarks.standins import AsyncMongoMockClient
+from app.config import LoginThrottleSettings
+from app.login_throttle import LoginThrottle, MemoryThrottleStore, MongoThrottleStore, retry_delay, get_login_throttle
+from app.routes.login_routes import router, pwd_context
+
+SETTINGS = LoginThrottleSettings(
+    window_seconds=900, base_delay_seconds=1, max_delay_seconds=60, lockout_seconds=900,
+    email_free_failures=2, email_lockout=5, ip_free_failures=10, ip_lockout=50, otp_emails_per_window=2,
+)
+
+
+def throttled_app(throttle: LoginThrottle) -> FastAPI:
+    app = FastAPI()
+    app.include_router(router)
+    app.dependency_overrides[get_login_throttle] = lambda: throttle
+    return app
+
+# ------------------------------------------------------------------- Login throttle tests --------------------------------------------------------------------------- #
+
+def test_retry_delay_doubles_then_locks_out():
+    now = 1000.0
+    assert retry_delay([now - 1] * 2, now, 2, 5, SETTINGS) == (0.0, None)
+    assert retry_delay([now - 0.5] * 3, now, 2, 5, SETTINGS) == (0.5, "delay")
+    assert retry_delay([now - 0.5] * 4, now, 2, 5, SETTINGS) == (1.5, "delay")
+    assert retry_delay([now - 100] * 5, now, 2, 5, SETTINGS) == (800.0, "lockout")
+
+
+@pytest.mark.asyncio
+@patch("app.db.db.users")
+async def test_throttled_login_is_rejected_before_bcrypt(mock_users):
+    mock_users.find_one = AsyncMock(return_value={"email": "user@example.com", "name": "User", "password": "hash", "verified": True})
+    throttle = LoginThrottle(SETTINGS, MemoryThrottleStore())
+
+    with patch.object(pwd_context, "verify", return_value=False) as mock_verify:
+        async with AsyncClient(app=throttled_app(throttle), base_url="http://test") as client:
+            failures = [await client.post("/login", json={"email": "user@example.com", "password": "wrong"}) for _ in range(3)]
+            throttled = await client.post("/login", json={"email": "USER@example.com", "password": "wrong"})
+
+    assert [response.status_code for response in failures] == [400, 400, 400]
+    assert throttled.status_code == 429
+    assert int(throttled.headers["Retry-After"]) >= 1
+    # The throttled attempt neither looked the user up nor ran bcrypt
+    assert mock_users.find_one.await_count == 3
+    assert mock_verify.call_count == 3
+
+
+@pytest.mark.asyncio
+@patch("app.routes.login_routes.send_otp_email", new_callable=AsyncMock)
+@patch("app.routes.login_routes.generate_otp", new_callable=AsyncMock)
+@patch("app.db.db.users")
+async def test_otp_emails_are_capped_per_address(mock_users, mock_generate_otp, mock_send_otp_email):
+    mock_users.find_one = AsyncMock(return_value={"email": "user@example.com", "name": "User", "password": "hash", "verified": True})
+    mock_generate_otp.return_value = "123456"
+    throttle = LoginThrottle(SETTINGS, MemoryThrottleStore())
+
+    with patch.object(pwd_context, "verify", return_value=True):
+        async with AsyncClient(app=throttled_app(throttle), base_url="http://test") as client:
+            responses = [await client.post("/login", json={"email": "user@example.com", "password": "right"}) for _ in range(3)]
+
+    assert [response.status_code for response in responses] == [200, 200, 429]
+    assert mock_send_otp_email.await_count == 2
+
+
+@pytest.mark.asyncio
+@patch("app.db.db.users")
+async def test_concurrent_burst_is_rejected_before_bcrypt(mock_users):
+    async def find_user(query):
+        # Every attempt of the burst is in flight before any has failed
+        await asyncio.sleep(0.05)
+        return {"email": "user@example.com", "name": "User", "password": "hash", "verified": True}
+
+    mock_users.find_one = AsyncMock(side_effect=find_user)
+    throttle = LoginThrottle(SETTINGS, MemoryThrottleStore())
+
+    with patch.object(pwd_context, "verify", return_value=False) as mock_verify:
+        async with AsyncClient(app=throttled_app(throttle), base_url="http://test") as client:
+            responses = await asyncio.gather(*[
+                client.post("/login", json={"email": "user@example.com", "password": "wrong"}) for _ in range(50)
+            ])
+
+    codes = [response.status_code for response in responses]
+    # The free failures get through, the attempts in flight count against the rest
+    assert codes.count(400) == SETTINGS.email_free_failures + 1
+    assert codes.count(429) == 50 - codes.count(400)
+    assert mock_verify.call_count == codes.count(400)
+
+
+@pytest.mark.asyncio
+async def test_mongo_store_shares_counts_between_throttles():
+    database = AsyncMongoMockClient()["throttle_test"]
+    with patch("app.login_throttle.db", database), patch("app.login_throttle.time.time") as mock_time:
+        mock_time.return_value = 1000.0
+        first = LoginThrottle(SETTINGS, MongoThrottleStore())
+        second = LoginThrottle(SETTINGS, MongoThrottleStore())
+        for _ in range(3):
+            attempt = await first.check("user@example.com", "10.0.0.1")
+            await first.record_failure(attempt, "password")
+
+        with pytest.raises(HTTPException) as error:
+            await second.check("user@example.com", "10.0.0.2")
+        assert error.value.status_code == 429
+
+        # Once the delay has passed a login clears the failures of the address
+        mock_time.return_value = 1002.0
+        await second.record_success(await second.check("user@example.com", "10.0.0.2"))
+        await first.check("user@example.com", "10.0.0.1")
+
+
+@pytest.mark.asyncio
+async def test_mongo_store_counts_concurrent_checks():
+    database = AsyncMongoMockClient()["throttle_burst_test"]
+    with patch("app.login_throttle.db", database):
+        throttles = [LoginThrottle(SETTINGS, MongoThrottleStore()) for _ in range(2)]
+        results = await asyncio.gather(
+            *[throttles[position % 2].check("user@example.com", "10.0.0.1") for position in range(20)],
+            return_exceptions=True,
+        )
+
+    admitted = [result for result in results if not isinstance(result, HTTPException)]
+    assert len(admitted) == SETTINGS.email_free_failures + 1
+    # Rejected checks are taken back, only the admitted attempts stay counted
+    document = await database.login_throttle.find_one({"_id": "email:user@example.com"})
+    assert sorted(document["hits"]) == sorted(attempt.at for attempt in admitted)
@@ -0,0 +1,112 @@
+import httpx
+import pytest
+from fastapi import FastAPI
+from httpx import AsyncClient
+from unittest.mock import patch, AsyncMock
+from app.config import MetricsSettings
+from app.metrics import Counter, Histogram, MetricsMiddleware, HIBP_RATE_LIMIT_WAIT, render_metrics
+from app.hibp_client import hibp_get
+from app.routes.report_routes import generate_report
+from app.routes.metrics_routes import router
+
+app = FastAPI()
+app.add_middleware(MetricsMiddleware)
+app.include_router(router)
+
+
+@app.get("/items/{item_id}")
+async def get_item(item_id: str):
+    return {"id": item_id}
+
+# ------------------------------------------------------------------- Metrics tests --------------------------------------------------------------------------- #
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram("test_latency_seconds", "Test latency", ("route",), buckets=(0.1, 1.0))
+    histogram.labels("/a").observe(0.05)
+    histogram.labels("/a").observe(0.5)
+    histogram.labels("/a").observe(5)
+
+    assert histogram.render() == [
+        "# HELP test_latency_seconds Test latency",
+        "# TYPE test_latency_seconds histogram",
+        'test_latency_seconds_bucket{route="/a",le="0.1"} 1',
+        'test_latency_seconds_bucket{route="/a",le="1"} 2',
+        'test_latency_seconds_bucket{route="/a",le="+Inf"} 3',
+        'test_latency_seconds_sum{route="/a"} 5.55',
+        'test_latency_seconds_count{route="/a"} 3',
+    ]
+
+
+def test_label_values_are_escaped():
+    counter = Counter("test_escaped_total", "Escaping", ("value",))
+    counter.labels('say "hi"\n').inc()
+
+    assert 'test_escaped_total{value="say \\"hi\\"\\n"} 1' in counter.render()
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint_reports_route_templates():
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        await client.get("/items/1")
+        await client.get("/items/2")
+        response = await client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert 'http_requests_total{method="GET",route="/items/{item_id}",status="200"} 2' in response.text
+    assert "/items/1" not in response.text
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint_is_restricted_to_allowed_ips_or_the_token():
+    settings = MetricsSettings(allow_ips="10.0.0.0/8", token="scrape-token")
+    with patch("app.routes.metrics_routes.get_metrics_settings", return_value=settings):
+        async with AsyncClient(app=app, base_url="http://test") as client:
+            # The test client connects from 127.0.0.1
+            denied = await client.get("/metrics")
+            wrong_token = await client.get("/metrics", headers={"Authorization": "Bearer guess"})
+            with_token = await client.get("/metrics", headers={"Authorization": "Bearer scrape-token"})
+
+    assert denied.status_code == 403
+    assert wrong_token.status_code == 403
+    assert with_token.status_code == 200
+
+
+@pytest.mark.asyncio
+@patch("app.hibp_client.asyncio.sleep", new_callable=AsyncMock)
+async def test_hibp_get_waits_out_rate_limits(mock_sleep):
+    responses = iter([
+        httpx.Response(429, headers={"retry-after": "2"}),
+        httpx.Response(200, json=[]),
+    ])
+    transport = httpx.MockTransport(lambda request: next(responses))
+
+    async with httpx.AsyncClient(transport=transport) as client:
+        response = await hibp_get(client, "https://hibp.test/api/v3/breaches", {}, "breaches", retries=2)
+
+    assert response.status_code == 200
+    mock_sleep.assert_awaited_once_with(2.0)
+    assert HIBP_RATE_LIMIT_WAIT.labels("breaches").count >= 1
+    assert 'hibp_request_duration_seconds_count{endpoint="breaches",status="429"}' in render_metrics()
+
+
+@pytest.mark.asyncio
+@patch("app.hibp_client.asyncio.sleep", new_callable=AsyncMock)
+@patch("app.routes.report_routes.API_KEY", "test-key")
+@patch("app.routes.report_routes.db")
+async def test_request_handlers_answer_hibp_rate_limits_without_waiting(mock_db, mock_sleep):
+    mock_db.list_collection_names = AsyncMock(return_value=[])
+    transport = httpx.MockTransport(lambda request: httpx.Response(429, headers={"retry-after": "3"}))
+    report_app = FastAPI()
+    report_app.post("/reports")(generate_report)
+
+    async with httpx.AsyncClient(transport=transport) as hibp:
+        with patch("app.routes.report_routes.get_hibp_client", return_value=hibp):
+            async with AsyncClient(app=report_app, base_url="http://test") as client:
+                response = await client.post("/reports", json={
+                    "token": "", "reportType": "detailed", "reportCategory": "allbreaches", "reportFormat": "pdf",
+                })
+
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "3"
+    mock_sleep.assert_not_awaited()
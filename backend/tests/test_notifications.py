@@ -0,0 +1,104 @@
+import asyncio
+import pytest
+from unittest.mock import patch, AsyncMock, MagicMock
+from app.config import NotificationSettings
+from app.notifications import AdminRecipients, VerificationDigest
+
+
+def admin_cursor(emails):
+    cursor = MagicMock()
+    cursor.to_list = AsyncMock(return_value=[{"email": email} for email in emails])
+    return cursor
+
+# ------------------------------------------------------------------- Notification tests --------------------------------------------------------------------------- #
+
+@pytest.mark.asyncio
+@patch("app.notifications.db")
+async def test_admin_recipients_are_cached_until_invalidated(mock_db):
+    mock_db.users.find = MagicMock(return_value=admin_cursor(["admin@example.com"]))
+    recipients = AdminRecipients(ttl=600)
+
+    assert await recipients.get() == ["admin@example.com"]
+    assert await recipients.get() == ["admin@example.com"]
+    assert mock_db.users.find.call_count == 1
+
+    mock_db.users.find.return_value = admin_cursor(["admin@example.com", "new@example.com"])
+    recipients.invalidate()
+    assert await recipients.get() == ["admin@example.com", "new@example.com"]
+    assert mock_db.users.find.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_digest_batches_uploads_and_flushes_on_threshold():
+    send = AsyncMock()
+    recipients = MagicMock(get=AsyncMock(return_value=["admin@example.com"]))
+    settings = NotificationSettings(digest_interval_seconds=3600, digest_max_events=3)
+    digest = VerificationDigest(send, recipients, settings)
+    digest.start()
+
+    digest.add("a@example.com")
+    digest.add("b@example.com")
+    digest.add("a@example.com")  # the same user uploading again is listed once
+    await asyncio.sleep(0)
+    send.assert_not_awaited()
+
+    digest.add("c@example.com")
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+    send.assert_awaited_once_with(["admin@example.com"], ["a@example.com", "b@example.com", "c@example.com"])
+    assert digest.pending == []
+    await digest.stop()
+
+
+@pytest.mark.asyncio
+async def test_failed_digest_keeps_events_and_stop_flushes():
+    send = AsyncMock(side_effect=[ConnectionError("SMTP down"), None])
+    recipients = MagicMock(get=AsyncMock(return_value=["admin@example.com"]))
+    digest = VerificationDigest(send, recipients, NotificationSettings(digest_interval_seconds=3600))
+
+    digest.add("a@example.com")
+    assert await digest.flush() == 0
+    assert digest.pending == ["a@example.com"]
+
+    digest.add("b@example.com")
+    await digest.stop()
+    send.assert_awaited_with(["admin@example.com"], ["a@example.com", "b@example.com"])
+    assert digest.pending == []
+
+
+@pytest.mark.asyncio
+async def test_stop_during_a_send_keeps_the_batch():
+    sending = asyncio.Event()
+
+    async def first_send_hangs(admins, users):
+        if not sending.is_set():
+            sending.set()
+            await asyncio.sleep(3600)
+
+    send = AsyncMock(side_effect=first_send_hangs)
+    recipients = MagicMock(get=AsyncMock(return_value=["admin@example.com"]))
+    digest = VerificationDigest(send, recipients, NotificationSettings(digest_interval_seconds=3600, digest_max_events=1))
+    digest.start()
+    digest.add("a@example.com")
+    await sending.wait()
+
+    # Cancelling the send in flight puts the batch back, and stop() sends it
+    await digest.stop()
+    assert send.await_count == 2
+    send.assert_awaited_with(["admin@example.com"], ["a@example.com"])
+    assert digest.pending == []
+
+
+@pytest.mark.asyncio
+async def test_digest_without_admins_keeps_events():
+    send = AsyncMock()
+    recipients = MagicMock(get=AsyncMock(side_effect=[[], ["admin@example.com"]]))
+    digest = VerificationDigest(send, recipients, NotificationSettings(digest_interval_seconds=3600))
+
+    digest.add("a@example.com")
+    assert await digest.flush() == 0
+    assert digest.pending == ["a@example.com"]
+
+    assert await digest.flush() == 1
+    send.assert_awaited_once_with(["admin@example.com"], ["a@example.com"])
@@ -0,0 +1,86 @@
+import marshal
+import pytest
+from fastapi import FastAPI
+from httpx import AsyncClient
+from unittest.mock import patch, AsyncMock
+from app.auth import create_access_token, get_current_admin
+from app.db_monitoring import DbStatsMiddleware
+from app.profiling import ProfileBuffer, ProfilingMiddleware, span
+from app.routes.metrics_routes import router
+
+# ------------------------------------------------------------------- Profiling tests --------------------------------------------------------------------------- #
+
+def build_app(sample_rate, buffer):
+    app = FastAPI()
+    app.add_middleware(ProfilingMiddleware, sample_rate=sample_rate, buffer=buffer, buffer_size=2)
+    app.add_middleware(DbStatsMiddleware)
+
+    @app.get("/reports/{report_id}")
+    async def report(report_id: str):
+        with span("hibp"):
+            pass
+        with span("render"):
+            sum(range(1000))
+        return {"id": report_id}
+
+    return app
+
+
+@pytest.mark.asyncio
+async def test_sampled_requests_are_profiled_into_a_ring_buffer():
+    buffer = ProfileBuffer()
+    async with AsyncClient(app=build_app(1.0, buffer), base_url="http://test") as client:
+        responses = [await client.get(f"/reports/{index}") for index in range(3)]
+
+    summaries = buffer.summaries()
+    assert len(summaries) == 2
+    assert summaries[0]["id"] == responses[2].headers["x-profile-id"]
+    assert summaries[0]["route"] == "/reports/{report_id}"
+    assert summaries[0]["trigger"] == "sample"
+    assert {"hibp", "render", "db", "other"} <= set(summaries[0]["spans_ms"])
+    assert buffer.get(responses[0].headers["x-profile-id"]) is None
+
+    profile = buffer.get(summaries[0]["id"])
+    assert profile["functions"]
+    assert isinstance(marshal.loads(profile["stats"]), dict)
+
+
+@pytest.mark.asyncio
+async def test_profile_header_requires_an_admin():
+    buffer = ProfileBuffer()
+    app = build_app(0.0, buffer)
+    token = create_access_token({"sub": "user@example.com"})
+
+    with patch("app.profiling.db") as mock_db:
+        mock_db.users.find_one = AsyncMock(return_value={"user_type": "standard"})
+        async with AsyncClient(app=app, base_url="http://test") as client:
+            anonymous = await client.get("/reports/1", headers={"X-Profile": "1"})
+            standard = await client.get("/reports/1", headers={"X-Profile": "1", "Authorization": f"Bearer {token}"})
+
+        mock_db.users.find_one = AsyncMock(return_value={"user_type": "admin"})
+        async with AsyncClient(app=app, base_url="http://test") as client:
+            admin = await client.get("/reports/1", headers={"X-Profile": "1", "Authorization": f"Bearer {token}"})
+
+    assert "x-profile-id" not in anonymous.headers
+    assert "x-profile-id" not in standard.headers
+    assert buffer.get(admin.headers["x-profile-id"])["trigger"] == "header"
+
+
+@pytest.mark.asyncio
+@patch("app.routes.metrics_routes.profile_buffer", new_callable=ProfileBuffer)
+async def test_admin_can_fetch_profiles(mock_buffer):
+    mock_buffer.add({"id": "abc", "path": "/reports", "functions": [], "stats": marshal.dumps({})})
+    app = FastAPI()
+    app.include_router(router)
+    app.dependency_overrides[get_current_admin] = lambda: {"user_type": "admin"}
+
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        listing = await client.get("/admin/profiles")
+        detail = await client.get("/admin/profiles/abc")
+        raw = await client.get("/admin/profiles/abc", params={"format": "pstats"})
+        missing = await client.get("/admin/profiles/nope")
+
+    assert listing.json()["profiles"] == [{"id": "abc", "path": "/reports"}]
+    assert detail.json() == {"id": "abc", "path": "/reports", "functions": []}
+    assert marshal.loads(raw.content) == {}
+    assert missing.status_code == 404
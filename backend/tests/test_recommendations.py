@@ -0,0 +1,57 @@
+import pytest
+from datetime import datetime
+from unittest.mock import patch
+from benchmarks.standins import AsyncMongoMockClient
+from app.models.report import RequestData
+from app.recommendations import BreachRecommendations, recommendations_for_breach, refresh_breach_recommendations
+from app.routes.report_routes import generate_csv
+
+CATALOG = [
+    {"Name": "Adobe", "DataClasses": ["Email addresses", "Password hints", "Passwords", "Usernames"]},
+    {"Name": "Ashley", "DataClasses": ["Credit cards", "Email addresses", "Phone numbers"], "IsSensitive": True},
+]
+
+# ------------------------------------------------------------------- Recommendation tests --------------------------------------------------------------------------- #
+
+def test_breaches_map_to_recommendations_by_data_class():
+    assert recommendations_for_breach(CATALOG[0]) == [
+        "change-passwords", "enable-2fa", "password-manager", "phishing", "review-account",
+    ]
+    assert recommendations_for_breach(CATALOG[1]) == [
+        "contact-bank", "sim-pin", "sensitive-breach", "phishing", "review-account",
+    ]
+    assert recommendations_for_breach({"Name": "Empty"}) == ["review-account"]
+
+
+@pytest.mark.asyncio
+async def test_reports_union_the_precomputed_recommendations():
+    database = AsyncMongoMockClient()["recommendations_test"]
+    await database.breaches.insert_many([dict(breach) for breach in CATALOG])
+    recommendations = BreachRecommendations()
+
+    with patch("app.recommendations.db", database), patch("app.recommendations.breach_recommendations", recommendations):
+        await database.breach_recommendations.insert_one({"_id": "Removed", "recommendations": ["sim-pin"], "updated_at": datetime(2020, 1, 1)})
+        await refresh_breach_recommendations()
+        assert await database.breach_recommendations.count_documents({}) == 2
+
+        union = await recommendations.for_breaches(["Adobe", "Ashley", "NotInCatalog"])
+        assert union == [
+            "change-passwords", "contact-bank", "enable-2fa", "password-manager", "sim-pin",
+            "sensitive-breach", "phishing", "review-account",
+        ]
+
+        # Served from the cache until the next sync
+        await database.breach_recommendations.delete_many({})
+        assert await recommendations.for_breaches(["Adobe"]) == recommendations_for_breach(CATALOG[0])
+        await refresh_breach_recommendations([{"Name": "Adobe", "DataClasses": ["Auth tokens"]}])
+        assert await recommendations.for_breaches(["Adobe", "Ashley"]) == ["revoke-sessions", "enable-2fa", "review-account"]
+
+
+@pytest.mark.asyncio
+async def test_csv_reports_list_one_recommendation_per_line():
+    data = RequestData(token="fake_token", reportType="user", reportFormat="csv")
+    report = {"Name": "Test", "Email": "test@example.com", "Report": [], "Recommendations": ["First: a.", "Second: b."]}
+
+    response = await generate_csv(data, report)
+
+    assert '"First: a.\nSecond: b."' in response.body.decode()
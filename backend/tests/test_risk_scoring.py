@@ -0,0 +1,82 @@
+import pytest
+from datetime import datetime
+from unittest.mock import patch
+from benchmarks.standins import AsyncMongoMockClient
+from app.risk_scoring import USER_RISK, CatalogMatrices, build_catalog_matrix, catalog_matrices, refresh_risk_scores, report_fields, score_users
+
+NOW = datetime(2024, 6, 1)
+
+CATALOG = [
+    {"Name": "Recent", "DataClasses": ["Email addresses", "Passwords"], "BreachDate": "2024-01-10", "IsVerified": True, "PwnCount": 1000},
+    {"Name": "Old", "DataClasses": ["Email addresses", "Passwords"], "BreachDate": "2012-01-10", "IsVerified": True, "PwnCount": 1000},
+    {"Name": "Minor", "DataClasses": ["Email addresses", "Genders"], "BreachDate": "2024-01-10", "IsVerified": True, "PwnCount": 1000},
+    {"Name": "Unverified", "DataClasses": ["Email addresses", "Passwords"], "BreachDate": "2024-01-10", "IsVerified": False, "PwnCount": 1000},
+]
+
+
+def user_in(*names, user_id=None):
+    return {"_id": user_id or "-".join(names), "email": "user@example.com", "breaches": {"Report": [{"Name": name} for name in names]}}
+
+# ------------------------------------------------------------------- Risk scoring tests --------------------------------------------------------------------------- #
+
+def test_recent_sensitive_and_verified_breaches_score_higher():
+    catalog = build_catalog_matrix(CATALOG, NOW)
+    scores = {
+        summary["_id"]: summary["score"]
+        for summary in score_users([user_in(name) for name in ("Recent", "Old", "Minor", "Unverified")], catalog, NOW)
+    }
+
+    assert scores["Recent"] > scores["Old"]
+    assert scores["Recent"] > scores["Minor"]
+    assert scores["Recent"] > scores["Unverified"]
+    # More breaches never lower the score
+    both = score_users([user_in("Recent", "Old")], catalog, NOW)[0]
+    assert both["score"] > scores["Recent"]
+    assert both["top_breaches"] == ["Recent", "Old"]
+    assert both["sensitive_data_classes"] == ["Passwords"]
+
+
+def test_clean_users_and_unknown_breaches():
+    catalog = build_catalog_matrix(CATALOG, NOW)
+    clean = {"_id": "clean", "breaches": {"Report": "Email address not found in any breaches."}}
+
+    clean_summary, unknown_summary = score_users([clean, user_in("NotInCatalog")], catalog, NOW)
+
+    assert (clean_summary["score"], clean_summary["level"], clean_summary["breaches"]) == (0.0, "low", 0)
+    assert unknown_summary["score"] > 0
+    assert unknown_summary["breaches"] == 1
+    assert unknown_summary["top_breaches"] == []
+    assert report_fields(None) == {}
+
+
+@pytest.mark.asyncio
+async def test_refresh_stores_summaries_of_scanned_users():
+    database = AsyncMongoMockClient()["risk_test"]
+    await database.breaches.insert_many([dict(breach) for breach in CATALOG])
+    await database.users.insert_many([user_in("Recent", user_id=1), user_in("Minor", user_id=2), {"_id": 3, "email": "new@example.com"}])
+
+    catalog_matrices.invalidate()
+    with patch("app.risk_scoring.db", database):
+        assert await refresh_risk_scores() == 2
+        assert await refresh_risk_scores({"breaches.Report.Name": "Minor"}) == 1
+
+    summaries = {summary["_id"]: summary for summary in await database[USER_RISK].find({}).to_list(None)}
+    assert set(summaries) == {1, 2}
+    assert summaries[1]["score"] > summaries[2]["score"]
+    assert report_fields(summaries[1])["RiskLevel"] == summaries[1]["level"]
+
+
+@pytest.mark.asyncio
+async def test_catalog_matrix_is_built_once_per_catalog_generation():
+    database = AsyncMongoMockClient()["risk_matrix_test"]
+    await database.breaches.insert_many([dict(breach) for breach in CATALOG])
+    matrices = CatalogMatrices()
+
+    with patch("app.risk_scoring.db", database):
+        first = await matrices.get()
+        await database.breaches.insert_one({"Name": "Synced", "DataClasses": ["Passwords"], "BreachDate": "2024-05-01"})
+        assert await matrices.get() is first
+
+        # A catalog sync drops it
+        matrices.invalidate()
+        assert "Synced" in (await matrices.get()).names
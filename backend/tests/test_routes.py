@@ -1,4 +1,5 @@
 
+import httpx
 import pytest
 from unittest.mock import patch, AsyncMock
 from app.models.report import RequestData, UserReport
@@ -7,9 +8,9 @@ from app.routes.report_routes import generate_report_on_auth_user
 
 @pytest.mark.asyncio
 @patch("app.routes.report_routes.db")
-@patch("app.routes.report_routes.httpx.AsyncClient")
+@patch("app.routes.report_routes.hibp_get", new_callable=AsyncMock)
 @patch("app.routes.report_routes.jwt.decode")
-async def test_generate_report_on_auth_user_local_data(mock_jwt_decode, mock_httpx_client, mock_db):
+async def test_generate_report_on_auth_user_local_data(mock_jwt_decode, mock_hibp_get, mock_db):
     # Mock data
     mock_jwt_decode.return_value = {"sub": "test@example.com"}
     mock_db.users.find_one = AsyncMock(return_value={"email": "test@example.com", "breaches": "local breach data"})
@@ -23,6 +24,33 @@ async def test_generate_report_on_auth_user_local_data(mock_jwt_decode, mock_htt
     assert result == "local breach data"
     mock_jwt_decode.assert_called_once_with("fake_token", key=None, algorithms=["HS256"], options={"verify_signature": False})
     mock_db.users.find_one.assert_called_once_with({"email": "test@example.com"})
-    mock_httpx_client.assert_not_called()
+    mock_hibp_get.assert_not_awaited()
 
 
+
+@pytest.mark.asyncio
+@patch("app.routes.report_routes.breach_recommendations.for_breaches", new_callable=AsyncMock)
+@patch("app.routes.report_routes.refresh_user_risk", new_callable=AsyncMock)
+@patch("app.routes.report_routes.refresh_affected_users", new_callable=AsyncMock)
+@patch("app.routes.report_routes.hibp_get", new_callable=AsyncMock)
+@patch("app.routes.report_routes.db")
+@patch("app.routes.report_routes.jwt.decode")
+async def test_generate_report_on_auth_user_returns_report_object(mock_jwt_decode, mock_db, mock_hibp_get, mock_refresh, mock_refresh_risk, mock_recommendations):
+    mock_jwt_decode.return_value = {"sub": "test@example.com"}
+    mock_db.users.find_one = AsyncMock(return_value={"_id": "user-1", "email": "test@example.com", "name": "Test"})
+    mock_recommendations.return_value = ["change-passwords"]
+    mock_refresh_risk.return_value = {"score": 41.3, "level": "medium", "top_breaches": ["Adobe"], "sensitive_data_classes": ["Passwords"]}
+    mock_db.users.find_one_and_update = AsyncMock()
+    mock_hibp_get.return_value = httpx.Response(200, json=[{"Name": "Adobe"}])
+
+    data = RequestData(token="fake_token", reportType="user", reportFormat="json")
+    result = await generate_report_on_auth_user(data)
+
+    # A dict, not a JSON string that would be encoded a second time
+    assert result["Report"] == [{"Name": "Adobe"}]
+    assert result["Email"] == "test@example.com"
+    mock_refresh.assert_awaited_once_with(["Adobe"])
+    mock_refresh_risk.assert_awaited_once_with("user-1")
+    assert (result["RiskScore"], result["RiskLevel"], result["TopRisks"]) == (41.3, "medium", ["Adobe"])
+    mock_recommendations.assert_awaited_once_with(["Adobe"])
+    assert result["Recommendations"][0].startswith("Change exposed passwords: ")
@@ -0,0 +1,124 @@
+import httpx
+import pytest
+from fastapi import BackgroundTasks
+from unittest.mock import patch, AsyncMock
+from app.models.report import RequestData
+from app.routes.report_routes import generate_detailed_report
+from app.search_service import BreachSearchIndex
+
+CATALOG = [
+    {
+        "Name": "LinkedIn",
+        "Title": "LinkedIn",
+        "Domain": "linkedin.com",
+        "Description": "In May 2016, <a href=\"https://example.com\">LinkedIn</a> had 164 million email addresses and passwords exposed.",
+    },
+    {
+        "Name": "Adobe",
+        "Title": "Adobe",
+        "Domain": "adobe.com",
+        "Description": "In October 2013, 153 million Adobe accounts were breached.",
+    },
+    {
+        "Name": "Dropbox",
+        "Title": "Dropbox",
+        "Domain": "dropbox.com",
+        "Description": "In mid-2012, Dropbox suffered a data breach which exposed the stored credentials.",
+    },
+]
+
+# ------------------------------------------------------------------- Breach search index tests --------------------------------------------------------------------------- #
+
+@pytest.fixture
+def index():
+    index = BreachSearchIndex()
+    index.rebuild(CATALOG)
+    return index
+
+
+def test_search_tolerates_typos(index):
+    results = index.search("linkdin")
+
+    assert results[0]["breach"]["Name"] == "LinkedIn"
+    assert results[0]["score"] > 0.6
+
+
+def test_search_exact_name_scores_highest(index):
+    results = index.search("adobe")
+
+    assert results[0]["breach"]["Name"] == "Adobe"
+    assert results[0]["score"] == 1.0
+
+
+def test_search_matches_description_words(index):
+    results = index.search("credentials")
+
+    assert [result["breach"]["Name"] for result in results] == ["Dropbox"]
+
+
+def test_lookup_domain_matches_parent_domain(index):
+    assert index.lookup_domain("www.mail.adobe.com")[0]["Name"] == "Adobe"
+    assert index.lookup_domain("unknown.org") == []
+
+
+def test_added_breaches_match_a_rebuild(index):
+    canva = {"Name": "Canva", "Title": "Canva", "Domain": "canva.com", "Description": "Canva credentials were exposed."}
+    moved = {**CATALOG[1], "Domain": "adobe.net", "Description": "Re-fetched."}
+    index.add(canva)
+    index.add(moved)
+
+    rebuilt = BreachSearchIndex()
+    rebuilt.rebuild(CATALOG + [canva, moved])
+
+    assert index.breaches == rebuilt.breaches
+    for query in ("canvaa", "credentials", "adobe", "october"):
+        assert index.search(query) == rebuilt.search(query)
+    # The replaced breach no longer matches its old domain
+    assert index.lookup_domain("adobe.com") == []
+    assert index.lookup_domain("adobe.net")[0]["Description"] == "Re-fetched."
+
+
+@pytest.fixture
+def route_index(index):
+    # The route searches a fresh index, the shared one is left untouched
+    with patch("app.routes.report_routes.breach_index", index), \
+            patch("app.routes.report_routes.ensure_breach_index", new_callable=AsyncMock):
+        yield index
+
+
+@pytest.mark.asyncio
+@patch("app.routes.report_routes.hibp_get", new_callable=AsyncMock)
+@patch("app.routes.report_routes.db")
+async def test_detailed_report_suggests_close_sites_hibp_does_not_know(mock_db, mock_hibp_get, route_index):
+    mock_db.get_collection.return_value.find_one = AsyncMock(return_value=None)
+    mock_hibp_get.return_value = httpx.Response(404)
+
+    data = RequestData(token="fake_token", reportType="detailed", reportFormat="json", reportCategory="Dropbx")
+    result = await generate_detailed_report(data, BackgroundTasks())
+
+    # HIBP is asked first, the close catalog breach is only a labelled suggestion
+    mock_hibp_get.assert_awaited_once()
+    assert [suggestion["Name"] for suggestion in result["suggestions"]] == ["Dropbox"]
+    assert "Description" not in result["suggestions"][0]
+
+
+@pytest.mark.asyncio
+@patch("app.routes.report_routes.hibp_get", new_callable=AsyncMock)
+@patch("app.routes.report_routes.db")
+async def test_detailed_report_reports_unknown_sites_without_suggestions(mock_db, mock_hibp_get, route_index):
+    mock_db.get_collection.return_value.find_one = AsyncMock(return_value=None)
+    mock_hibp_get.return_value = httpx.Response(404)
+
+    data = RequestData(token="fake_token", reportType="detailed", reportFormat="json", reportCategory="Zyxwvut")
+
+    assert await generate_detailed_report(data, BackgroundTasks()) == "Site not found"
+
+
+@pytest.mark.asyncio
+@patch("app.routes.report_routes.hibp_get", new_callable=AsyncMock)
+async def test_detailed_report_looks_up_domains(mock_hibp_get, route_index):
+    data = RequestData(token="fake_token", reportType="detailed", reportFormat="json", reportCategory="linkedin.com")
+    result = await generate_detailed_report(data, BackgroundTasks())
+
+    assert result["Name"] == "LinkedIn"
+    mock_hibp_get.assert_not_awaited()
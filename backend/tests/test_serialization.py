@@ -0,0 +1,142 @@
+import gzip
+import orjson
+import pytest
+from bson import ObjectId
+from fastapi import FastAPI, Request
+from httpx import AsyncClient
+from unittest.mock import patch, AsyncMock
+from app.routes import report_routes, upload_routes
+from app.serialization import CACHE_CONTROL, PayloadCache, accepts_gzip, encode_payload, json_response
+
+app = FastAPI()
+catalog = [{"Name": f"Breach{index}", "Description": "exposed " * 20} for index in range(50)]
+
+
+@app.get("/catalog")
+async def get_catalog(request: Request):
+    return json_response(request, encode_payload(catalog, cacheable=True))
+
+
+@app.get("/small")
+async def get_small(request: Request):
+    return json_response(request, encode_payload({"_id": ObjectId("0123456789ab0123456789ab")}))
+
+
+report_app = FastAPI()
+report_app.include_router(report_routes.router)
+report_app.include_router(upload_routes.router)
+
+
+class AsyncCursor:
+    def __init__(self, items):
+        self.items = items
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for item in self.items:
+            yield dict(item)
+
+
+def request_with(accept_encoding):
+    return Request({"type": "http", "headers": [(b"accept-encoding", accept_encoding.encode())]})
+
+# ------------------------------------------------------------------- Serialization tests --------------------------------------------------------------------------- #
+
+def test_accept_encoding_parsing():
+    assert accepts_gzip(request_with("gzip, deflate, br"))
+    assert accepts_gzip(request_with("br;q=1.0, *;q=0.5"))
+    assert not accepts_gzip(request_with("gzip;q=0, br"))
+    assert not accepts_gzip(request_with("identity"))
+
+
+@pytest.mark.asyncio
+async def test_large_payloads_are_gzipped_when_accepted():
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        plain = await client.get("/catalog", headers={"Accept-Encoding": "identity"})
+        compressed = await client.get("/catalog", headers={"Accept-Encoding": "gzip"})
+        small = await client.get("/small", headers={"Accept-Encoding": "gzip"})
+
+    assert "content-encoding" not in plain.headers
+    assert orjson.loads(plain.content) == catalog
+    assert compressed.headers["content-encoding"] == "gzip"
+    assert compressed.headers["vary"] == "Accept-Encoding"
+    assert orjson.loads(compressed.content) == catalog
+    assert int(compressed.headers["content-length"]) < len(plain.content)
+    assert "content-encoding" not in small.headers
+    assert small.json() == {"_id": "0123456789ab0123456789ab"}
+
+
+@pytest.mark.asyncio
+async def test_catalog_cache_is_kept_until_invalidated():
+    cache = PayloadCache()
+    builds = []
+
+    async def build():
+        builds.append(1)
+        return catalog
+
+    first = await cache.get_or_build(build)
+    second = await cache.get_or_build(build)
+    cache.invalidate()
+    third = await cache.get_or_build(build)
+
+    assert first is second
+    assert len(builds) == 2
+    assert gzip.decompress(third.gzipped) == third.body
+
+
+@pytest.mark.asyncio
+async def test_catalog_build_racing_a_sync_is_not_cached():
+    cache = PayloadCache()
+
+    async def build_during_sync():
+        cache.invalidate()
+        return catalog
+
+    await cache.get_or_build(build_during_sync)
+
+    assert cache._payload is None
+
+
+@pytest.mark.asyncio
+@patch("app.routes.report_routes.db")
+async def test_catalog_revalidation_skips_the_database(mock_db):
+    mock_db.list_collection_names = AsyncMock(return_value=["breaches"])
+    mock_db.get_collection.return_value.find.return_value = AsyncCursor([{"_id": 1, "Name": "Adobe"}])
+    report_routes.catalog_cache.invalidate()
+
+    async with AsyncClient(app=report_app, base_url="http://test") as client:
+        first = await client.get("/breaches")
+        etag = first.headers["etag"]
+        revalidated = await client.get("/breaches", headers={"If-None-Match": f'W/{etag}'})
+        posted = await client.post("/reports", json={"reportType": "detailed", "reportCategory": "allbreaches", "reportFormat": "json", "token": "t"}, headers={"If-None-Match": etag})
+
+    assert first.json() == [{"Name": "Adobe"}]
+    assert first.headers["cache-control"] == CACHE_CONTROL
+    assert revalidated.status_code == 304
+    assert revalidated.headers["etag"] == etag
+    assert revalidated.content == b""
+    # Conditional requests only short-circuit GET and HEAD
+    assert posted.status_code == 200
+    assert mock_db.list_collection_names.await_count == 1
+    report_routes.catalog_cache.invalidate()
+
+
+@pytest.mark.asyncio
+async def test_data_classes_etag_changes_after_an_update():
+    upload_routes.HIBP_DATA_CLASSES = ["Email addresses"]
+    upload_routes.data_classes_cache.invalidate()
+    with patch("app.routes.upload_routes.update_hibp_data_classes", new_callable=AsyncMock):
+        async with AsyncClient(app=report_app, base_url="http://test") as client:
+            first = await client.get("/dataclasses")
+            upload_routes.HIBP_DATA_CLASSES = ["Email addresses", "Passwords"]
+            upload_routes.data_classes_cache.invalidate()
+            second = await client.get("/dataclasses", headers={"If-None-Match": first.headers["etag"]})
+
+    assert first.json() == {"dataclasses": ["Email addresses"]}
+    assert second.status_code == 200
+    assert second.headers["etag"] != first.headers["etag"]
+    upload_routes.HIBP_DATA_CLASSES = []
+    upload_routes.data_classes_cache.invalidate()
@@ -0,0 +1,54 @@
+import os
+from unittest.mock import patch
+from app.config import ServerSettings
+from app.serve import parse_args, prepare_environment, uvicorn_options
+
+# ------------------------------------------------------------------- Launcher tests --------------------------------------------------------------------------- #
+
+def test_workers_default_to_available_cores():
+    with patch("app.serve.available_cores", return_value=6):
+        options = uvicorn_options(ServerSettings())
+
+    assert options["app"] == "app.main:app"
+    assert options["workers"] == 6
+    assert options["limit_max_requests"] == 10_000
+    assert options["proxy_headers"] is True
+    assert options["loop"] in ("uvloop", "asyncio")
+    assert options["http"] in ("httptools", "h11")
+
+
+def test_explicit_settings_are_passed_through():
+    settings = ServerSettings(workers=2, loop="asyncio", http="h11", keep_alive_seconds=30, backlog=512,
+                              forwarded_allow_ips="10.0.0.0/8")
+    options = uvicorn_options(settings)
+
+    assert (options["workers"], options["loop"], options["http"]) == (2, "asyncio", "h11")
+    assert (options["timeout_keep_alive"], options["backlog"]) == (30, 512)
+    assert options["forwarded_allow_ips"] == "10.0.0.0/8"
+
+
+def test_workers_share_pool_budget_and_secret_key():
+    with patch.dict(os.environ, {}, clear=False):
+        os.environ.pop("SECRET_KEY", None)
+        prepare_environment(uvicorn_options(ServerSettings(workers=4)))
+
+        assert os.environ["WEB_CONCURRENCY"] == "4"
+        # Generated once in the launcher, inherited by every worker
+        assert len(os.environ["SECRET_KEY"]) == 64
+
+
+def test_recycled_single_worker_keeps_the_secret_key():
+    with patch.dict(os.environ, {}, clear=False):
+        os.environ.pop("SECRET_KEY", None)
+        prepare_environment(uvicorn_options(ServerSettings(workers=1, max_requests=None)))
+        # A plain single server keeps the key it generates for its lifetime
+        assert "SECRET_KEY" not in os.environ
+
+        # Workers replaced after max_requests must accept the tokens of the one before
+        prepare_environment(uvicorn_options(ServerSettings(workers=1)))
+        assert len(os.environ["SECRET_KEY"]) == 64
+
+
+def test_command_line_overrides():
+    args = parse_args(["--workers", "3", "--port", "9000", "--max-requests", "500"])
+    assert (args.workers, args.port, args.max_requests, args.host) == (3, 9000, 500, None)
@@ -0,0 +1,70 @@
+import asyncio
+import pytest
+from unittest.mock import patch, AsyncMock
+from benchmarks.standins import AsyncMongoMockClient
+from app.config import ShutdownSettings
+from app.shutdown import ShutdownCoordinator, DEFERRED_COLLECTION
+
+SETTINGS = ShutdownSettings(drain_seconds=1, checkpoint_seconds=1)
+
+# ------------------------------------------------------------------- Shutdown tests --------------------------------------------------------------------------- #
+
+@pytest.mark.asyncio
+async def test_drain_waits_for_running_jobs():
+    coordinator = ShutdownCoordinator(SETTINGS)
+    finished = []
+
+    async def job(upload_id):
+        await asyncio.sleep(0.05)
+        finished.append(upload_id)
+
+    running = asyncio.create_task(coordinator.run("process_upload", job, "upload-1"))
+    await asyncio.sleep(0)
+    assert coordinator.running == 1
+
+    assert await coordinator.drain() == 0
+    await running
+    assert finished == ["upload-1"]
+    assert coordinator.running == 0
+
+
+@pytest.mark.asyncio
+async def test_jobs_past_the_deadline_are_checkpointed_and_resumed():
+    database = AsyncMongoMockClient()["shutdown_test"]
+    with patch("app.shutdown.db", database):
+        stopping = ShutdownCoordinator(SETTINGS)
+        started = []
+
+        async def stuck(emails):
+            started.append(emails)
+            await asyncio.sleep(60)
+
+        stopping.resumable("send_verified_emails", stuck)
+        asyncio.create_task(stopping.run("send_verified_emails", stuck, ["a@example.com"]))
+        await asyncio.sleep(0)
+
+        assert await stopping.drain(timeout=0.01) == 1
+        # Jobs arriving once shutdown started are not run but checkpointed too
+        await stopping.run("send_verified_emails", stuck, ["b@example.com"])
+        assert started == [["a@example.com"]]
+        assert await database[DEFERRED_COLLECTION].count_documents({}) == 2
+
+        # The next worker claims and runs them
+        starting = ShutdownCoordinator(SETTINGS)
+        resumed = AsyncMock()
+        starting.resumable("send_verified_emails", resumed)
+        assert await starting.start() == 2
+        await starting.drain()
+
+        assert [call.args for call in resumed.await_args_list] == [(["a@example.com"],), (["b@example.com"],)]
+        assert await database[DEFERRED_COLLECTION].count_documents({}) == 0
+
+
+@pytest.mark.asyncio
+async def test_jobs_without_a_resume_handler_are_dropped():
+    coordinator = ShutdownCoordinator(SETTINGS)
+    await coordinator.drain()
+
+    with patch("app.shutdown.db") as mock_db:
+        assert await coordinator.run("id_preview", AsyncMock(), "user@example.com") is None
+        mock_db.__getitem__.assert_not_called()
@@ -0,0 +1,37 @@
+import json
+import os
+import subprocess
+import sys
+from benchmarks.startup import compare
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules only needed once a PDF, an email or an ID preview is produced
+LAZY_MODULES = ("reportlab", "fastapi_mail", "PIL", "numpy")
+
+# ------------------------------------------------------------------- Startup tests --------------------------------------------------------------------------- #
+
+def test_importing_the_app_has_no_side_effects_or_heavy_imports(tmp_path):
+    script = (
+        "import sys, json, app.main; "
+        f"sys.stderr.write(json.dumps([name for name in {LAZY_MODULES!r} if name in sys.modules]))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", script],
+        capture_output=True, text=True, check=True, cwd=BACKEND_DIR,
+        env={**os.environ, "ID_UPLOAD_DIR": str(tmp_path / "ids")},
+    )
+
+    assert json.loads(result.stderr.strip().splitlines()[-1]) == []
+    # Nothing printed and no directory created on import, that happens in the lifespan
+    assert result.stdout == ""
+    assert not (tmp_path / "ids").exists()
+
+
+def test_startup_regressions_past_the_tolerance_are_reported():
+    baseline = {"import_ms": 100.0, "first_response_ms": 200.0, "process_ms": 300.0}
+
+    assert compare({"import_ms": 110.0, "first_response_ms": 240.0, "process_ms": 300.0}, baseline, 0.25) == []
+    assert compare({"import_ms": 130.0, "first_response_ms": 200.0, "process_ms": 300.0}, baseline, 0.25) == [
+        "import_ms: 130.0ms vs baseline 100.0ms"
+    ]
@@ -0,0 +1,98 @@
+import io
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI
+from fastapi.staticfiles import StaticFiles
+from httpx import AsyncClient
+from PIL import Image
+from pydantic import ValidationError
+from unittest.mock import patch
+from app.auth import get_current_admin
+from app.config import IdUploadSettings
+from app.id_storage import write_document
+from app.routes.home_routes import router
+from app.thumbnails import create_preview, move_legacy_previews, render_preview
+
+app = FastAPI()
+app.include_router(router)
+
+
+def jpeg_with_exif(size=(1200, 800)) -> bytes:
+    image = Image.new("RGB", size, "red")
+    exif = Image.Exif()
+    exif[0x0112] = 6  # rotated 90 degrees
+    exif[0x010F] = "Camera maker"
+    output = io.BytesIO()
+    image.save(output, format="JPEG", exif=exif)
+    return output.getvalue()
+
+# ------------------------------------------------------------------- Thumbnail tests --------------------------------------------------------------------------- #
+
+def test_previews_are_downscaled_rotated_and_stripped(tmp_path):
+    source = tmp_path / "id.jpg"
+    source.write_bytes(jpeg_with_exif())
+    target = tmp_path / "previews" / "id.webp"
+
+    render_preview(str(source), str(target), 300, "webp", 75)
+
+    with Image.open(target) as preview:
+        assert preview.format == "WEBP"
+        # The EXIF orientation is applied, landscape becomes portrait
+        assert preview.size == (200, 300)
+        assert not preview.getexif()
+
+
+@pytest.mark.asyncio
+async def test_previews_are_served_with_immutable_cache_headers(tmp_path):
+    settings = IdUploadSettings(dir=str(tmp_path / "ids"), preview_dir=str(tmp_path / "previews"), preview_max_size=64)
+    document = write_document(io.BytesIO(jpeg_with_exif()), settings.dir, 10 ** 6, {"image/jpeg"})
+
+    with patch("app.thumbnails.get_pool", return_value=ThreadPoolExecutor(1)):
+        preview = await create_preview(document, settings)
+
+    with patch("app.routes.home_routes.get_id_upload_settings", return_value=settings):
+        async with AsyncClient(app=app, base_url="http://test") as client:
+            anonymous = await client.get(f"/{preview}")
+            # Nothing under the public storage mount leads to the preview
+            static = FastAPI()
+            static.mount("/uploaded_ids", StaticFiles(directory=settings.dir))
+            async with AsyncClient(app=static, base_url="http://test") as static_client:
+                shard, name = preview.split("/")[1:]
+                public = await static_client.get(f"/uploaded_ids/previews/{shard}/{name}")
+            app.dependency_overrides[get_current_admin] = lambda: {"email": "admin@example.com", "user_type": "admin"}
+            try:
+                response = await client.get(f"/{preview}")
+                traversal = await client.get("/id-previews/..%2F..%2F/passwd")
+            finally:
+                app.dependency_overrides.clear()
+
+    assert preview == f"id-previews/{document.sha256[:2]}/{document.sha256}-64.webp"
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/webp"
+    assert response.headers["cache-control"] == "private, max-age=31536000, immutable"
+    assert anonymous.status_code == 401
+    assert public.status_code == 404
+    assert traversal.status_code == 404
+
+
+def test_previews_cannot_live_in_the_public_storage_directory(tmp_path):
+    with pytest.raises(ValidationError):
+        IdUploadSettings(dir=str(tmp_path), preview_dir=str(tmp_path / "previews"))
+
+
+def test_legacy_previews_move_out_of_the_storage_directory(tmp_path):
+    settings = IdUploadSettings(dir=str(tmp_path / "ids"), preview_dir=str(tmp_path / "previews"))
+    legacy = tmp_path / "ids" / "previews" / "ab"
+    legacy.mkdir(parents=True)
+    (legacy / "ab12-480.webp").write_bytes(b"preview")
+
+    assert move_legacy_previews(settings) == 1
+    assert (tmp_path / "previews" / "ab" / "ab12-480.webp").read_bytes() == b"preview"
+    assert not (tmp_path / "ids" / "previews").exists()
+
+
+@pytest.mark.asyncio
+async def test_documents_that_are_not_images_get_no_preview(tmp_path):
+    document = write_document(io.BytesIO(b"%PDF-1.4 document"), str(tmp_path), 10 ** 6, {"application/pdf"})
+
+    assert await create_preview(document, IdUploadSettings(dir=str(tmp_path))) is None
@@ -0,0 +1,72 @@
+import pytest
+from datetime import datetime
+from bson import ObjectId
+from fastapi import HTTPException
+from unittest.mock import patch, AsyncMock
+from app.routes.upload_routes import process_upload_async, get_my_uploads
+from app.migrations.move_uploaded_data import plan_batch
+
+# ------------------------------------------------------------------- Upload storage tests --------------------------------------------------------------------------- #
+
+@pytest.mark.asyncio
+@patch("app.routes.upload_routes.db")
+async def test_process_upload_only_updates_upload_document(mock_db):
+    upload_id = ObjectId()
+    mock_db.uploads.find_one = AsyncMock(return_value={"_id": upload_id, "user_id": ObjectId(), "content": {}})
+    mock_db.uploads.update_one = AsyncMock()
+    mock_db.users.update_one = AsyncMock()
+
+    await process_upload_async(upload_id)
+
+    update = mock_db.uploads.update_one.call_args[0][1]
+    assert update["$set"]["processed"] is True
+    mock_db.users.update_one.assert_not_called()
+
+
+@pytest.mark.asyncio
+@patch("app.routes.upload_routes.db")
+async def test_my_uploads_pages_newest_first(mock_db):
+    user_id = ObjectId()
+    uploads = [
+        {"_id": ObjectId(), "file_name": f"{i}.json", "upload_date": datetime(2024, 1, 3 - i)}
+        for i in range(3)
+    ]
+    mock_db.users.find_one = AsyncMock(return_value={"_id": user_id})
+    mock_db.uploads.find.return_value.sort.return_value.limit.return_value.to_list = AsyncMock(return_value=uploads)
+
+    result = await get_my_uploads(limit=2, before=None, current_user="test@example.com")
+
+    assert [upload["file_name"] for upload in result["uploads"]] == ["0.json", "1.json"]
+    assert result["next_cursor"] == f"2024-01-02T00:00:00|{uploads[1]['_id']}"
+    mock_db.uploads.find.return_value.sort.assert_called_once_with([("upload_date", -1), ("_id", -1)])
+
+    await get_my_uploads(limit=2, before=result["next_cursor"], current_user="test@example.com")
+
+    query = mock_db.uploads.find.call_args[0][0]
+    assert query["user_id"] == user_id
+    assert query["$or"][1] == {"upload_date": datetime(2024, 1, 2), "_id": {"$lt": uploads[1]["_id"]}}
+
+
+@pytest.mark.asyncio
+@patch("app.routes.upload_routes.db")
+async def test_my_uploads_rejects_bad_cursor(mock_db):
+    mock_db.users.find_one = AsyncMock(return_value={"_id": ObjectId()})
+
+    with pytest.raises(HTTPException) as exc_info:
+        await get_my_uploads(limit=20, before="garbage", current_user="test@example.com")
+    assert exc_info.value.status_code == 400
+
+
+def test_migration_plan_moves_processed_flag_and_drops_array():
+    user_id, upload_id = ObjectId(), ObjectId()
+    users = [
+        {"_id": user_id, "uploaded_data": [{"upload_id": upload_id, "processed": True}]},
+        {"_id": ObjectId(), "uploaded_data": []},
+    ]
+
+    upload_ops, user_ops = plan_batch(users)
+
+    assert len(upload_ops) == 1
+    assert upload_ops[0]._filter == {"_id": upload_id, "user_id": user_id}
+    assert upload_ops[0]._doc == {"$max": {"processed": True}}
+    assert [op._doc for op in user_ops] == [{"$unset": {"uploaded_data": ""}}] * 2